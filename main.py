@@ -4,38 +4,52 @@
 
 运行：
 1) 在环境变量或 .env 中设置：AI_API_KEY（必需）
-   可选：AI_BASE_URL / HOMEWORK_URL / MODEL_NAME
+   可选：AI_BASE_URL / HOMEWORK_URL / MODEL_NAME / JOB_FILE
 2) 执行：python main.py
 3) 浏览器打开后手动登录，回到终端按回车继续。
 
+多表单：设置 JOB_FILE 指向任务文件（JSON），一次登录批改多个表单，见 run_jobs()。
+录制/回放：设置 RECORD_DIR 录制；python main.py replay <目录> --speed 100 离线回放。
+
 行为与 Notebook 对齐：
 - 下载：点击 field_5 打开详情弹窗，滚动到底部找下载按钮，只下 .cpp；点击后固定等待 2s，再判断下载完成（兼容 .tmp/.crdownload）
 - 回填：AntD 弹窗里点“修改”→点“请选择”→在 listbox(role=option) 里点分数→“提交”→右上角 Close
-- 批量：field_11（教师评分）已有数字则跳过
+- 批量：field_11（教师评分）已有数字则跳过；进度按 entry id（ENTRY_ID_COL）跟踪并持久化到 state/
 - 性能：关闭 implicit wait，避免与显式等待叠加导致回填很慢
 """
 
 from __future__ import annotations
 
+import argparse
 import glob
+import hashlib
+import json
 import os
+import queue
 import re
+import shutil
+import subprocess
+import sys
+import threading
 import time
+import urllib.request
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from dataclasses import dataclass
+from types import SimpleNamespace
+from urllib.parse import unquote, urlparse
+
+_IMPORT_START = time.perf_counter()
 
+# 只在这里导入轻量依赖；openai / selenium.webdriver / webdriver_manager 在用到时才导入
+# （回放、离线批量评分等不开浏览器的场景不用付这部分启动成本）
 from dotenv import load_dotenv
-from openai import OpenAI
-from selenium import webdriver
 from selenium.common.exceptions import (
     NoSuchElementException,
     StaleElementReferenceException,
     TimeoutException,
 )
 from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import WebDriverWait
-from webdriver_manager.chrome import ChromeDriverManager
 
 
 load_dotenv()
@@ -48,6 +62,266 @@ MODEL_NAME = os.getenv("MODEL_NAME") or "gpt-5-mini"
 API_KEY = os.getenv("AI_API_KEY")
 BASE_URL = os.getenv("AI_BASE_URL") or "https://api.openai-proxy.org/v1"
 DOWNLOAD_DIR = os.path.join(os.getcwd(), "downloads")
+REPORT_DIR = os.path.join(os.getcwd(), "reports")
+STATE_DIR = os.path.join(os.getcwd(), "state")
+# 每个条目下载到的源码按 sources/<表单id>/<条目> 保存（多文件作业整体评分、事后复查）
+SOURCES_DIR = os.path.join(os.getcwd(), "sources")
+
+CACHE_DIR = os.path.join(os.getcwd(), ".cache")
+_DRIVER_CACHE_FILE = os.path.join(CACHE_DIR, "chromedriver.json")
+
+# chromedriver：CHROMEDRIVER_PATH 固定路径（不再联网解析）；OFFLINE=1 时完全不联网，
+# 只用固定路径 / 上次解析的缓存 / Selenium Manager 本地缓存
+CHROMEDRIVER_PATH = os.getenv("CHROMEDRIVER_PATH")
+OFFLINE = os.getenv("OFFLINE", "").strip() in ("1", "true", "yes")
+
+# 启动预算（秒）：`main.py startup-check` 用它判断导入耗时是否回归
+STARTUP_BUDGET_S = float(os.getenv("STARTUP_BUDGET_S") or 0.5)
+
+# 条目的稳定标识列（金数据“序号”列），用来代替会随排序/筛选变化的 row-index
+ENTRY_ID_COL = os.getenv("ENTRY_ID_COL") or "serial_number"
+
+# 多表单任务文件（JSON），为空时走单表单流程（HOMEWORK_URL）
+JOB_FILE = os.getenv("JOB_FILE")
+
+# 模型分级：设置 CASCADE_MODEL（便宜模型）后先用它评分，拿不准的再交给 MODEL_NAME；
+# CASCADE_BORDERLINE 为逗号分隔的临界分（如及格线），距临界分 CASCADE_MARGIN 以内的也升级
+CASCADE_MODEL = os.getenv("CASCADE_MODEL")
+CASCADE_MIN_CONFIDENCE = float(os.getenv("CASCADE_MIN_CONFIDENCE") or 0.7)
+CASCADE_MAX_SPREAD = float(os.getenv("CASCADE_MAX_SPREAD") or 1)
+CASCADE_BORDERLINE = os.getenv("CASCADE_BORDERLINE") or ""
+CASCADE_MARGIN = float(os.getenv("CASCADE_MARGIN") or 1)
+
+# 失败条目重试：主流程结束后最多重试 RETRY_ROUNDS 轮，第 n 轮前等待 RETRY_BACKOFF_S × 2^(n-1) 秒
+RETRY_ROUNDS = int(os.getenv("RETRY_ROUNDS") or 2)
+RETRY_BACKOFF_S = float(os.getenv("RETRY_BACKOFF_S") or 5)
+
+# 回填核对：运行结束后刷新页面、滚动一遍读出本次回填条目的教师评分列，与应填的分数对比，
+# 不一致的只重新回填这些（最多 RECONCILE_ROUNDS 轮）；RECONCILE=0 关闭
+RECONCILE = os.getenv("RECONCILE", "1").strip() not in ("0", "false", "no")
+RECONCILE_ROUNDS = int(os.getenv("RECONCILE_ROUNDS") or 1)
+
+# 浏览器回收：BROWSER_RECYCLE=reload（默认，只刷新页面）/ restart（重启 Chrome）/ off；
+# 每处理 BROWSER_RECYCLE_ROWS 行、JS 堆超过 BROWSER_MAX_HEAP_MB、或单行耗时涨到开头的 BROWSER_DRIFT 倍时回收
+BROWSER_RECYCLE = (os.getenv("BROWSER_RECYCLE") or "reload").strip().lower()
+BROWSER_RECYCLE_ROWS = int(os.getenv("BROWSER_RECYCLE_ROWS") or 150)
+BROWSER_MAX_HEAP_MB = float(os.getenv("BROWSER_MAX_HEAP_MB") or 600)
+BROWSER_DRIFT = float(os.getenv("BROWSER_DRIFT") or 2.0)
+
+# 浏览器配置：BROWSER_PROFILE=lean 时屏蔽无关资源（图片/字体/统计脚本，BROWSER_BLOCK_URLS 追加逗号分隔的模式）、
+# 关闭图片与动画、固定窗口 BROWSER_WINDOW（宽,高），表格只渲染用到的列（entry id / 详情 / 教师评分，
+# BROWSER_COLUMNS 追加逗号分隔的列 id），其余列不绘制内容
+BROWSER_PROFILE = (os.getenv("BROWSER_PROFILE") or "default").strip().lower()
+BROWSER_BLOCK_URLS = os.getenv("BROWSER_BLOCK_URLS") or ""
+BROWSER_WINDOW = os.getenv("BROWSER_WINDOW") or "1280,800"
+BROWSER_COLUMNS = os.getenv("BROWSER_COLUMNS") or ""
+
+# 多次采样评分：SCORE_SAMPLES>1 时一次请求取多份独立评分再聚合（SCORE_SAMPLES_MODE=n 用接口的 n 参数，
+# json 用提示词内多次判断）；与 CASCADE_MODEL 同时设置时以模型分级为准
+SCORE_SAMPLES = int(os.getenv("SCORE_SAMPLES") or 1)
+SCORE_SAMPLES_MODE = (os.getenv("SCORE_SAMPLES_MODE") or "n").strip().lower()
+
+# 多附件作业：直链并发下载的线程数；拼成一个项目提示词时的总字符预算
+ATTACHMENT_WORKERS = int(os.getenv("ATTACHMENT_WORKERS") or 4)
+PROJECT_CHAR_BUDGET = int(os.getenv("PROJECT_CHAR_BUDGET") or 60000)
+
+# WebDriver 往返统计：WD_PROFILE=1 开启；WD_CPROFILE=1 额外用 cProfile 统计 Python 侧；
+# WD_PROFILE_BASELINE 指向旧的 reports/wdprofile-*.json 时输出对比
+WD_PROFILE = os.getenv("WD_PROFILE", "").strip() in ("1", "true", "yes")
+WD_CPROFILE = os.getenv("WD_CPROFILE", "").strip() in ("1", "true", "yes")
+WD_PROFILE_BASELINE = os.getenv("WD_PROFILE_BASELINE")
+
+# 录制目录：设置后每个处理的条目都会保存弹窗 HTML、附件、模型回复、下拉选项，供 `main.py replay` 离线回放
+RECORD_DIR = os.getenv("RECORD_DIR")
+
+
+# 回放/测试时可调快整体节奏：所有固定等待与超时都按 _SPEED 倍速换算（正常运行为 1）
+_SPEED = 1.0
+
+
+def _sleep(seconds):
+    """按 _SPEED 缩放的 sleep（脚本里的固定等待都走这里）。"""
+    if seconds > 0:
+        time.sleep(seconds / _SPEED)
+
+
+def _clock():
+    """按 _SPEED 缩放的单调时钟，和 _sleep 配套用于超时判断。"""
+    return time.monotonic() * _SPEED
+
+
+def _wait_until(driver, condition, timeout, poll=0.5, message="", stage=None):
+    """显式等待：轮询 condition(driver) 直到返回真值并返回该值，超时抛 TimeoutException。
+
+    与 WebDriverWait 一致地忽略 NoSuchElement / StaleElement；时间按 _SPEED 缩放。
+    给出 stage 时超时与轮询间隔由 AdaptiveTimer 按该阶段的历史耗时调整（timeout/poll 为上限），
+    并记录本次耗时。
+    """
+    if stage is not None:
+        timeout = _stage_timeout(stage, timeout)
+        poll = _stage_poll(stage, poll)
+    start = _clock()
+    deadline = start + timeout
+    while True:
+        try:
+            value = condition(driver)
+            if value:
+                if stage is not None:
+                    _stage_observe(stage, _clock() - start)
+                return value
+        except (NoSuchElementException, StaleElementReferenceException):
+            pass
+        if _clock() >= deadline:
+            if stage is not None:
+                _stage_timed_out(stage)
+            raise TimeoutException(message)
+        _sleep(poll)
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+class AdaptiveTimer:
+    """按阶段学习等待耗时，给出超时与轮询间隔（代替固定常数）。
+
+    - 每个阶段（grid / modal_open / links / download / submit_* / modal_close）保留最近 window 次
+      成功等待的耗时；样本不足 min_samples 时仍用调用方给的默认值
+    - 超时 = p95 × factor + margin，不低于 floor、不超过默认值（只会比原来更快放弃，不会更慢）
+    - 轮询间隔 = p50 / 4，限制在 [min_poll, 默认轮询间隔]：快的步骤轮询更密
+    - 某阶段用学到的超时连续超时 2 次，认为环境整体变慢，清空该阶段重新学习
+    - 学到的耗时持久化到 path（STATE_DIR/timing.json），下次运行直接使用
+
+    时间都按 _clock 计（回放倍速下同样成立）。
+    """
+
+    def __init__(
+        self,
+        path=None,
+        window=200,
+        min_samples=8,
+        factor=1.5,
+        margin=1.0,
+        floor=1.0,
+        min_poll=0.05,
+    ):
+        self.path = path
+        self.window = window
+        self.min_samples = min_samples
+        self.factor = factor
+        self.margin = margin
+        self.floor = floor
+        self.min_poll = min_poll
+        self.samples: dict[str, list[float]] = {}
+        self.timeouts: dict[str, int] = {}
+        self._streak: dict[str, int] = {}
+        self._dirty = 0
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    saved = json.load(f).get("stages") or {}
+                self.samples = {k: [float(x) for x in v][-window:] for k, v in saved.items()}
+            except Exception as e:
+                print("耗时画像读取失败，将重新学习：", path, e)
+
+    def _learned(self, stage):
+        values = self.samples.get(stage) or []
+        return values if len(values) >= self.min_samples else None
+
+    def timeout(self, stage, default):
+        values = self._learned(stage)
+        if values is None:
+            return default
+        learned = _percentile(values, 0.95) * self.factor + self.margin
+        return min(default, max(self.floor, learned))
+
+    def poll(self, stage, default):
+        values = self._learned(stage)
+        if values is None:
+            return default
+        return min(default, max(self.min_poll, _percentile(values, 0.5) / 4))
+
+    def attempts(self, stage, default):
+        """学到耗时的阶段，重试次数减半（超时已按正常行情收紧，反复失败的行属于异常，尽快放弃）。"""
+        return default if self._learned(stage) is None else max(1, (default + 1) // 2)
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            values = self.samples.setdefault(stage, [])
+            values.append(round(seconds, 3))
+            del values[: -self.window]
+            self._streak[stage] = 0
+            self._dirty += 1
+            dirty = self._dirty
+        if dirty >= 20:
+            self.save()
+
+    def timed_out(self, stage):
+        with self._lock:
+            self.timeouts[stage] = self.timeouts.get(stage, 0) + 1
+            if self._learned(stage) is None:
+                return
+            self._streak[stage] = self._streak.get(stage, 0) + 1
+            if self._streak[stage] >= 2:
+                print(f"阶段 {stage} 连续超时，清空已学耗时，恢复默认超时重新学习")
+                self.samples[stage] = []
+                self._streak[stage] = 0
+                self._dirty += 1
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {"stages": {k: list(v) for k, v in self.samples.items()}}
+            self._dirty = 0
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+
+    def report(self) -> dict:
+        out = {}
+        for stage in sorted(set(self.samples) | set(self.timeouts)):
+            values = self.samples.get(stage) or []
+            out[stage] = {
+                "n": len(values),
+                "p50": _percentile(values, 0.5),
+                "p95": _percentile(values, 0.95),
+                "learned": self._learned(stage) is not None,
+                "timeouts": self.timeouts.get(stage, 0),
+            }
+        return out
+
+
+# ADAPTIVE_TIMING=0 时关闭，全部用固定常数
+_TIMER = (
+    AdaptiveTimer(os.path.join(STATE_DIR, "timing.json"))
+    if os.getenv("ADAPTIVE_TIMING", "1").strip() not in ("0", "false", "no")
+    else None
+)
+
+
+def _stage_timeout(stage, default):
+    return _TIMER.timeout(stage, default) if _TIMER is not None else default
+
+
+def _stage_poll(stage, default):
+    return _TIMER.poll(stage, default) if _TIMER is not None else default
+
+
+def _stage_observe(stage, seconds):
+    if _TIMER is not None:
+        _TIMER.observe(stage, seconds)
+
+
+def _stage_timed_out(stage):
+    if _TIMER is not None:
+        _TIMER.timed_out(stage)
 
 
 SCORING_CRITERIA = """
@@ -62,28 +336,475 @@ SCORING_CRITERIA = """
 """
 
 
-def setup_driver():
+# ---------------------------------------------------------------------------
+# WebDriver 命令计数 / 逐行往返分析（WD_PROFILE=1 开启）
+# ---------------------------------------------------------------------------
+
+# 当前线程正在处理的阶段与行（多会话时每个线程各自一份）
+_PROFILE_CTX = threading.local()
+
+# 这些 main.py 函数只是转发，不作为“调用点”统计，继续向外找真正的业务函数
+_PROFILE_TRANSPARENT = {"_page_call", "_ready", "_gone", "<lambda>", "<listcomp>", "<genexpr>"}
+
+
+@contextmanager
+def profile_stage(stage):
+    """标记当前线程所处的阶段（download/score/writeback...），命令按阶段归类。"""
+    prev = getattr(_PROFILE_CTX, "stage", None)
+    _PROFILE_CTX.stage = stage
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _PROFILE_CTX.stage = prev
+        _record_stage(stage, time.perf_counter() - start)
+
+
+@contextmanager
+def profile_row(key):
+    """标记当前线程正在处理的行（entry id），并记录该行的墙钟耗时。"""
+    prev = getattr(_PROFILE_CTX, "row", None)
+    _PROFILE_CTX.row = key
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if _PROFILER is not None:
+            _PROFILER.add_row_wall(key, time.perf_counter() - start)
+        _PROFILE_CTX.row = prev
+
+
+class WebDriverProfiler:
+    """统计每条 WebDriver 命令的次数与耗时，并归到 阶段 / 行 / Selenium API / main.py 调用点。
+
+    Selenium 的所有命令（包括 WebElement 上的 get_attribute / is_displayed / click）最终都走
+    driver.execute(command, params)，因此只需包一层 driver.execute 即可覆盖全部往返。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.strftime("%Y-%m-%d %H:%M:%S")
+        self.total = [0, 0.0]
+        self.by_command: dict[str, list] = {}
+        self.by_api: dict[str, list] = {}
+        self.by_site: dict[str, list] = {}
+        self.by_stage: dict[str, list] = {}
+        self.by_row: dict[str, dict] = {}
+        self.row_wall: dict[str, float] = {}
+
+    def instrument(self, driver):
+        if getattr(driver, "_wd_profiler", None) is self:
+            return driver
+        orig_execute = driver.execute
+
+        def execute(driver_command, params=None):
+            t0 = time.perf_counter()
+            try:
+                return orig_execute(driver_command, params)
+            finally:
+                self._record(driver_command, time.perf_counter() - t0)
+
+        driver.execute = execute
+        driver._wd_profiler = self
+        return driver
+
+    @staticmethod
+    def _call_site():
+        """沿调用栈向外找：最外层的 Selenium 公共 API 名 + 第一个 main.py 业务函数名。"""
+        api = None
+        page_fn = None
+        site = None
+        seen_main = False
+        frame = sys._getframe(3)
+        while frame is not None:
+            fn = frame.f_code.co_name
+            if frame.f_code.co_filename == __file__:
+                seen_main = True
+                if fn == "_page_call" and page_fn is None:
+                    page_fn = frame.f_locals.get("name")
+                if fn not in _PROFILE_TRANSPARENT:
+                    site = fn
+                    break
+            elif not seen_main and frame.f_globals.get("__name__", "").startswith("selenium"):
+                if not fn.startswith("_"):
+                    api = fn
+            frame = frame.f_back
+        if page_fn:
+            api = f"page:{page_fn}"
+        return api or "?", site or "?"
+
+    @staticmethod
+    def _add(bucket, key, seconds):
+        entry = bucket.setdefault(key, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+    def _record(self, command, seconds):
+        api, site = self._call_site()
+        stage = getattr(_PROFILE_CTX, "stage", None) or "-"
+        row = getattr(_PROFILE_CTX, "row", None)
+        with self._lock:
+            self.total[0] += 1
+            self.total[1] += seconds
+            self._add(self.by_command, command, seconds)
+            self._add(self.by_api, api, seconds)
+            self._add(self.by_site, site, seconds)
+            self._add(self.by_stage, stage, seconds)
+            if row is not None:
+                self._add(self.by_row.setdefault(row, {}), stage, seconds)
+
+    def add_row_wall(self, key, seconds):
+        with self._lock:
+            self.row_wall[key] = self.row_wall.get(key, 0.0) + seconds
+
+    def report(self):
+        def _rows(bucket):
+            items = sorted(bucket.items(), key=lambda kv: kv[1][1], reverse=True)
+            return [{"name": k, "count": v[0], "seconds": round(v[1], 4)} for k, v in items]
+
+        rows = []
+        for key, stages in self.by_row.items():
+            count = sum(v[0] for v in stages.values())
+            seconds = sum(v[1] for v in stages.values())
+            rows.append(
+                {
+                    "row": key,
+                    "commands": count,
+                    "roundtrip_s": round(seconds, 3),
+                    "wall_s": round(self.row_wall.get(key, 0.0), 3),
+                    "stages": {k: {"count": v[0], "seconds": round(v[1], 4)} for k, v in stages.items()},
+                }
+            )
+
+        counts = sorted(r["commands"] for r in rows)
+        return {
+            "started_at": self.started_at,
+            "revision": _git_revision(),
+            "summary": {
+                "commands": self.total[0],
+                "roundtrip_s": round(self.total[1], 3),
+                "rows": len(rows),
+                "commands_per_row_mean": round(sum(counts) / len(counts), 2) if counts else 0,
+                "commands_per_row_median": counts[len(counts) // 2] if counts else 0,
+                "roundtrip_s_per_row_mean": (
+                    round(sum(r["roundtrip_s"] for r in rows) / len(rows), 3) if rows else 0
+                ),
+            },
+            "stages": _rows(self.by_stage),
+            "commands": _rows(self.by_command),
+            "apis": _rows(self.by_api),
+            "sites": _rows(self.by_site),
+            "rows": rows,
+        }
+
+    def print_report(self, report=None, top=10):
+        report = report or self.report()
+        summary = report["summary"]
+        print("\n===== WebDriver 往返统计 =====")
+        print(
+            f"命令 {summary['commands']} 次，往返耗时 {summary['roundtrip_s']}s；"
+            f"每行平均 {summary['commands_per_row_mean']} 次 / {summary['roundtrip_s_per_row_mean']}s"
+        )
+        print(f"{'行(entry)':<20}{'命令数':>8}{'往返s':>10}{'墙钟s':>10}  最耗时阶段")
+        for r in report["rows"]:
+            worst = max(r["stages"].items(), key=lambda kv: kv[1]["seconds"], default=("-", {}))[0]
+            print(f"{str(r['row']):<20}{r['commands']:>8}{r['roundtrip_s']:>10}{r['wall_s']:>10}  {worst}")
+        print(f"\n调用点 Top {top}（main.py 函数）：")
+        for s in report["sites"][:top]:
+            print(f"  {s['name']:<36}{s['count']:>8} 次{s['seconds']:>10}s")
+        print(f"\nAPI Top {top}：")
+        for s in report["apis"][:top]:
+            print(f"  {s['name']:<36}{s['count']:>8} 次{s['seconds']:>10}s")
+
+
+def _git_revision():
+    """当前代码版本（用于跨版本对比报表），取不到时返回空串。"""
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            timeout=5,
+        )
+        return out.stdout.strip()
+    except Exception:
+        return ""
+
+
+def _compare_profile(baseline_path, report):
+    """与基线报表比较关键指标，打印变化百分比。"""
+    try:
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            base = json.load(f)
+    except Exception as e:
+        print("读取基线报表失败：", baseline_path, e)
+        return
+
+    print(f"\n===== 与基线对比（{base.get('revision') or '?'} → {report.get('revision') or '?'}） =====")
+    for k, v in report["summary"].items():
+        old = base.get("summary", {}).get(k)
+        if not isinstance(old, (int, float)) or not isinstance(v, (int, float)):
+            continue
+        delta = f"{(v - old) / old * 100:+.1f}%" if old else "-"
+        print(f"  {k:<28}{old:>12} → {v:<12}{delta}")
+
+
+_PROFILER = WebDriverProfiler() if WD_PROFILE else None
+
+
+@contextmanager
+def profile_run():
+    """包住一次批量处理：结束时输出 WebDriver 往返报表（WD_PROFILE），可选 cProfile（WD_CPROFILE）。
+
+    cProfile 只统计调用 profile_run 的线程（多会话并行时只覆盖主线程）。
+    """
+    prof = None
+    if WD_CPROFILE:
+        import cProfile
+
+        prof = cProfile.Profile()
+        prof.enable()
+    try:
+        yield
+    finally:
+        if prof is not None:
+            prof.disable()
+            import pstats
+
+            os.makedirs(REPORT_DIR, exist_ok=True)
+            prof_path = os.path.join(REPORT_DIR, f"cprofile-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+            prof.dump_stats(prof_path)
+            print("\n===== cProfile（按累计耗时 Top 20） =====")
+            pstats.Stats(prof).sort_stats("cumulative").print_stats(20)
+            print("cProfile 数据已写入：", prof_path)
+
+        if _PROFILER is not None:
+            report = _PROFILER.report()
+            _PROFILER.print_report(report)
+            path = _write_report("wdprofile", report)
+            print("WebDriver 往返报表已写入：", path)
+            if WD_PROFILE_BASELINE:
+                _compare_profile(WD_PROFILE_BASELINE, report)
+
+
+def _load_driver_cache() -> dict:
+    try:
+        with open(_DRIVER_CACHE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_driver_cache(path, browser_version, driver_version):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(_DRIVER_CACHE_FILE, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "path": path,
+                "browser_version": browser_version,
+                "driver_version": driver_version,
+                "resolved_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            },
+            f,
+            ensure_ascii=False,
+            indent=2,
+        )
+
+
+def _resolve_chromedriver(refresh=False):
+    """返回 (chromedriver 路径, 来源)。路径为 None（来源 selenium-manager-offline）时交给 Selenium Manager，
+    由 setup_driver 在启动期间让它只用本地缓存。
+
+    优先级：CHROMEDRIVER_PATH（固定）→ .cache/chromedriver.json（上次解析结果）
+    → 离线模式下 Selenium Manager 本地缓存 → 联网用 webdriver_manager 解析。
+    """
+    if CHROMEDRIVER_PATH:
+        return CHROMEDRIVER_PATH, "pinned"
+
+    if not refresh:
+        cached = _load_driver_cache().get("path")
+        if cached and os.path.exists(cached):
+            return cached, "cache"
+
+    if OFFLINE:
+        return None, "selenium-manager-offline"
+
+    from webdriver_manager.chrome import ChromeDriverManager
+
+    return ChromeDriverManager().install(), "webdriver_manager"
+
+
+def _major(version) -> str:
+    return str(version or "").split(".", 1)[0]
+
+
+def _driver_versions(d):
+    caps = getattr(d, "capabilities", None) or {}
+    browser = caps.get("browserVersion") or caps.get("version") or ""
+    driver = ((caps.get("chrome") or {}).get("chromedriverVersion") or "").split(" ", 1)[0]
+    return browser, driver
+
+
+# 精简配置屏蔽的资源：评分只需要表格数据、详情弹窗和源码附件
+_LEAN_BLOCKED_URLS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.ico", "*.bmp",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*.mp4", "*.webm", "*.mp3",
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*",
+    "*hm.baidu.com*", "*cnzz.com*", "*growingio.com*", "*sensorsdata*",
+    "*sentry.io*", "*clarity.ms*", "*hotjar*", "*intercom*",
+]
+
+
+def _lean_columns(jobs=None) -> set:
+    """精简配置下表格要绘制的列：各表单的 entry id / 详情 / 教师评分列（不给 jobs 时是单表单模式用的
+    ENTRY_ID_COL / field_5 / field_11），加上 BROWSER_COLUMNS 追加的列。每次启动浏览器时按本次的表单算。"""
+    if jobs:
+        columns = {c for job in jobs for c in (job.id_col, job.detail_col_id, job.score_col_id)}
+    else:
+        columns = {ENTRY_ID_COL, "field_5", "field_11"}
+    return columns | {c.strip() for c in BROWSER_COLUMNS.split(",") if c.strip()}
+
+
+def _lean_page_js(columns) -> str:
+    """每个新文档加载时注入的样式：动画/过渡缩到 1ms（保留 animationend 等事件，弹窗照常完成开关），
+    不在 columns 里的表格列跳过内容绘制。"""
+    keep = "".join(f":not([col-id={json.dumps(c)}])" for c in sorted(columns))
+    css = (
+        "*,*::before,*::after{animation-duration:1ms!important;animation-delay:0s!important;"
+        "transition-duration:1ms!important;transition-delay:0s!important;scroll-behavior:auto!important}"
+        f".ag-cell[col-id]{keep},.ag-header-cell[col-id]{keep}{{content-visibility:hidden}}"
+    )
+    return (
+        "(function(){var s=document.createElement('style');s.id='__grader_lean';s.textContent="
+        + json.dumps(css)
+        + ";(document.head||document.documentElement).appendChild(s);})();"
+    )
+
+
+def _window_size():
+    try:
+        w, h = (int(x) for x in BROWSER_WINDOW.split(","))
+        return w, h
+    except ValueError:
+        return 1280, 800
+
+
+def apply_lean_profile(driver, columns):
+    """启动后用 DevTools 屏蔽无关资源（Network.setBlockedURLs），并注入只绘制 columns 的精简样式。返回屏蔽的 URL 模式。"""
+    blocked = _LEAN_BLOCKED_URLS + [u.strip() for u in BROWSER_BLOCK_URLS.split(",") if u.strip()]
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": blocked})
+        driver.execute_cdp_cmd(
+            "Page.addScriptToEvaluateOnNewDocument", {"source": _lean_page_js(columns)}
+        )
+    except Exception as e:
+        print("精简浏览器配置未完全生效（不支持 CDP？）：", e)
+    try:
+        driver.set_window_size(*_window_size())
+    except Exception:
+        pass
+    return blocked
+
+
+def setup_driver(download_dir=None, profile=None, columns=None):
+    """启动 Chrome。profile=lean（默认取 BROWSER_PROFILE）时使用精简配置，见 apply_lean_profile；
+    columns 为要绘制的表格列（默认 _lean_columns()，即单表单模式的列）。"""
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.chrome.service import Service
+
+    profile = profile or BROWSER_PROFILE
     chrome_options = Options()
     prefs = {
-        "download.default_directory": DOWNLOAD_DIR,
+        "download.default_directory": download_dir or DOWNLOAD_DIR,
         "download.prompt_for_download": False,
         "download.directory_upgrade": True,
         "safebrowsing.enabled": True,
     }
+    if profile == "lean":
+        prefs["profile.managed_default_content_settings.images"] = 2
+        w, h = _window_size()
+        chrome_options.add_argument(f"--window-size={w},{h}")
+        chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+        chrome_options.add_argument("--force-prefers-reduced-motion")
+        chrome_options.add_argument("--force-device-scale-factor=1")
+        chrome_options.add_argument("--disable-smooth-scrolling")
     chrome_options.add_experimental_option("prefs", prefs)
 
-    service = Service(ChromeDriverManager().install())
-    d = webdriver.Chrome(service=service, options=chrome_options)
+    start = time.perf_counter()
+    path, source = _resolve_chromedriver()
+    resolved = time.perf_counter()
+
+    def _launch(p):
+        service = Service(p) if p else Service()
+        if p or "SE_OFFLINE" in os.environ:
+            return webdriver.Chrome(service=service, options=chrome_options)
+        # 离线且没有现成路径：只在这次启动期间让 Selenium Manager 只用本地缓存，不改动后续的进程环境
+        os.environ["SE_OFFLINE"] = "true"
+        try:
+            return webdriver.Chrome(service=service, options=chrome_options)
+        finally:
+            os.environ.pop("SE_OFFLINE", None)
+
+    try:
+        d = _launch(path)
+    except Exception as e:
+        # 缓存的 chromedriver 与升级后的 Chrome 不兼容时启动会直接失败：联网重新解析一次
+        if source != "cache" or OFFLINE:
+            raise
+        print("缓存的 chromedriver 启动失败，重新解析：", str(e).splitlines()[0] if str(e) else e)
+        path, source = _resolve_chromedriver(refresh=True)
+        d = _launch(path)
+
+    browser_version, driver_version = _driver_versions(d)
+    if _major(browser_version) and _major(browser_version) != _major(driver_version):
+        print(f"警告：Chrome {browser_version} 与 chromedriver {driver_version} 主版本不一致")
+        if source == "cache" and not OFFLINE:
+            d.quit()
+            path, source = _resolve_chromedriver(refresh=True)
+            d = _launch(path)
+            browser_version, driver_version = _driver_versions(d)
+
+    if path and source in ("cache", "webdriver_manager"):
+        _save_driver_cache(path, browser_version, driver_version)
+
+    launched = time.perf_counter()
+    STARTUP_TIMINGS.setdefault("launches", []).append(
+        {
+            "driver_source": source,
+            "driver_path": path,
+            "browser_version": browser_version,
+            "driver_version": driver_version,
+            "profile": profile,
+            "resolve_s": round(resolved - start, 3),
+            "launch_s": round(launched - resolved, 3),
+        }
+    )
+    print(
+        f"浏览器已启动：chromedriver 来源={source}，解析 {resolved - start:.2f}s，启动 {launched - resolved:.2f}s"
+    )
+
+    if _PROFILER is not None:
+        _PROFILER.instrument(d)
     # 默认关闭 implicit wait，避免与显式等待叠加导致整体变慢。
     d.implicitly_wait(0)
+    install_page_helpers(d)
+    if profile == "lean":
+        apply_lean_profile(d, columns or _lean_columns())
     return d
 
 
 def wait_for_grid(driver):
-    WebDriverWait(driver, 20).until(EC.presence_of_element_located((By.CLASS_NAME, "ag-root")))
-    viewport = WebDriverWait(driver, 20).until(
-        EC.presence_of_element_located((By.CLASS_NAME, "ag-body-viewport"))
-    )
+    with profile_stage("grid"):
+        return _wait_for_grid(driver)
+
+
+def _wait_for_grid(driver):
+    _wait_until(driver, lambda d: d.find_element(By.CLASS_NAME, "ag-root"), 20, stage="grid")
+    viewport = _wait_until(driver, lambda d: d.find_element(By.CLASS_NAME, "ag-body-viewport"), 20)
     return viewport
 
 
@@ -94,15 +815,17 @@ def get_visible_rows(driver):
     )
 
 
-def clear_download_dir():
-    for f in glob.glob(os.path.join(DOWNLOAD_DIR, "*")):
+def clear_download_dir(download_dir=None):
+    for f in glob.glob(os.path.join(download_dir or DOWNLOAD_DIR, "*")):
         try:
             os.remove(f)
         except Exception:
             pass
 
 
-def wait_download_complete(timeout=60, poll_interval=0.5, settle_rounds=3):
+def wait_download_complete(
+    timeout=60, poll_interval=0.5, settle_rounds=3, download_dir=None, stage=None
+):
     """等待下载完成。
 
     兼容两类临时文件：
@@ -112,19 +835,25 @@ def wait_download_complete(timeout=60, poll_interval=0.5, settle_rounds=3):
     规则：
     - 忽略 *.crdownload / *.tmp
     - 找到最新的“非临时文件”后，要求文件大小连续 settle_rounds 次不变才认为完成
+    - 给出 stage 时超时与轮询间隔按该阶段的历史耗时调整（见 AdaptiveTimer）
     """
 
-    start = time.time()
+    if stage is not None:
+        timeout = _stage_timeout(stage, timeout)
+        poll_interval = _stage_poll(stage, poll_interval)
+    start = _clock()
     last_path = None
     stable_count = 0
     last_size = None
 
-    while time.time() - start < timeout:
-        files = glob.glob(os.path.join(DOWNLOAD_DIR, "*"))
+    while _clock() - start < timeout:
+        files = glob.glob(os.path.join(download_dir or DOWNLOAD_DIR, "*"))
         candidates = [
             p
             for p in files
-            if not p.lower().endswith(".crdownload") and not p.lower().endswith(".tmp")
+            if os.path.isfile(p)
+            and not p.lower().endswith(".crdownload")
+            and not p.lower().endswith(".tmp")
         ]
 
         if candidates:
@@ -134,7 +863,7 @@ def wait_download_complete(timeout=60, poll_interval=0.5, settle_rounds=3):
             try:
                 size = os.path.getsize(path)
             except OSError:
-                time.sleep(poll_interval)
+                _sleep(poll_interval)
                 continue
 
             if path == last_path and size == last_size:
@@ -145,136 +874,349 @@ def wait_download_complete(timeout=60, poll_interval=0.5, settle_rounds=3):
                 last_size = size
 
             if stable_count >= settle_rounds:
+                if stage is not None:
+                    _stage_observe(stage, _clock() - start)
                 return path
 
-        time.sleep(poll_interval)
+        _sleep(poll_interval)
 
+    if stage is not None:
+        _stage_timed_out(stage)
     return None
 
 
 def _extract_filename_from_href(href: str) -> str:
     if not href:
         return ""
-    m = re.search(r"(?:\\?|&)(?:attname)=([^&]+)", href)
+    m = re.search(r"[?&]attname=([^&]+)", href)
     if not m:
         return ""
     try:
-        from urllib.parse import unquote
-
         return unquote(m.group(1))
     except Exception:
         return m.group(1)
 
 
-def _contains_cpp_hint(s: str) -> bool:
-    if not s:
-        return False
-    return bool(re.search(r"(?i)\\.cpp(\\b|$)", s))
+# 多文件作业一起评分的源码扩展名（与页面 helper 的 SOURCE_RE 保持一致）
+_SOURCE_EXT_RE = re.compile(r"(?i)\.(cpp|cc|cxx|h|hpp)(\b|$)")
 
 
-def _is_cpp_download_link(a) -> bool:
-    href = (a.get_attribute("href") or "").strip()
-    dl = (a.get_attribute("download") or "").strip()
-    title = (a.get_attribute("title") or "").strip()
-    aria = (a.get_attribute("aria-label") or "").strip()
-    text = (a.text or "").strip()
-    attname = _extract_filename_from_href(href).strip()
+def _contains_source_hint(s: str) -> bool:
+    return bool(s and _SOURCE_EXT_RE.search(s))
 
-    candidates = [dl, attname, title, aria, text, href]
-    return any(_contains_cpp_hint(c) for c in candidates)
 
+def _claim_path(dest_dir, name, taken: set) -> str:
+    """dest_dir 下不与已下载附件重名的目标路径（同名附件依次加 -2、-3 后缀）。"""
+    stem, ext = os.path.splitext(name)
+    candidate, n = name, 1
+    while candidate.lower() in taken:
+        n += 1
+        candidate = f"{stem}-{n}{ext}"
+    taken.add(candidate.lower())
+    return os.path.join(dest_dir, candidate)
 
-def _get_top_visible_ant_modal(driver):
-    """返回当前最上层、可见的弹层容器。
 
-    兼容：
-    - AntD Modal: .ant-modal
-    - AntD Drawer: .ant-drawer
-    - 兜底：任意 role=dialog 或 aria-modal=true
+# ---------------------------------------------------------------------------
+# 页面侧 helper：把“找弹层/找链接/读回填状态”合并成一次 execute_script 往返
+# ---------------------------------------------------------------------------
 
-    说明：为了尽量少改动原有代码，仍沿用旧函数名。
-    """
+_PAGE_HELPERS_VERSION = "4"
 
-    # 1) modal
-    try:
-        modals = driver.find_elements(By.CSS_SELECTOR, ".ant-modal")
-    except Exception:
-        modals = []
+# 注入到页面的 helper（window.__grader）。
+# 约定：每个函数只返回普通 JSON（元素以 WebElement 引用的形式夹带在 JSON 里），
+# Python 侧一次 _page_call 拿到全部所需信息，不再逐个 find_element / get_attribute。
+_PAGE_HELPERS_JS = r"""
+(function () {
+  var VERSION = '__VERSION__';
+  if (window.__grader && window.__grader.version === VERSION) return;
 
-    for m in reversed(modals):
-        try:
-            if m.is_displayed():
-                return m
-        except Exception:
-            continue
+  function norm(s) { return (s || '').replace(/\s+/g, ' ').trim(); }
 
-    # 2) drawer
-    try:
-        drawers = driver.find_elements(By.CSS_SELECTOR, ".ant-drawer")
-    except Exception:
-        drawers = []
+  // 与 Selenium is_displayed 近似：display/visibility/opacity + 有实际尺寸
+  function visible(el) {
+    if (!el || !el.isConnected) return false;
+    var st = window.getComputedStyle(el);
+    if (st.display === 'none' || st.visibility === 'hidden' || st.opacity === '0') return false;
+    var r = el.getBoundingClientRect();
+    return r.width > 0 && r.height > 0;
+  }
 
-    for d in reversed(drawers):
-        try:
-            if d.is_displayed():
-                return d
-        except Exception:
-            continue
+  function lastVisible(nodes) {
+    for (var i = nodes.length - 1; i >= 0; i--) {
+      if (visible(nodes[i])) return nodes[i];
+    }
+    return null;
+  }
+
+  function xpathAll(xp, ctx) {
+    var snap = document.evaluate(xp, ctx || document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    var out = [];
+    for (var i = 0; i < snap.snapshotLength; i++) out.push(snap.snapshotItem(i));
+    return out;
+  }
+
+  // 最上层可见弹层：AntD Modal → AntD Drawer → role=dialog / aria-modal=true
+  function topModal() {
+    return lastVisible(document.querySelectorAll('.ant-modal')) ||
+      lastVisible(document.querySelectorAll('.ant-drawer')) ||
+      lastVisible(document.querySelectorAll("[role='dialog'],[aria-modal='true']"));
+  }
+
+  function modalBody(m) {
+    if (!m) return null;
+    return m.querySelector('.ant-modal-body') || m.querySelector('.ant-drawer-body') || m;
+  }
+
+  // 把弹层内容滚到底，返回滚动后的 scrollTop（无弹层返回 null）
+  function scrollModal(m) {
+    var body = modalBody(m || topModal());
+    if (!body) return null;
+    body.scrollTop = body.scrollHeight;
+    return body.scrollTop;
+  }
+
+  var SOURCE_RE = /\.(cpp|cc|cxx|h|hpp)(\b|$)/i;
+
+  function attname(href) {
+    var m = /[?&]attname=([^&]+)/.exec(href || '');
+    if (!m) return '';
+    try { return decodeURIComponent(m[1]); } catch (e) { return m[1]; }
+  }
+
+  function linkInfo(a) {
+    var info = {
+      el: a,
+      href: (a.href || a.getAttribute('href') || '').trim(),
+      download: (a.getAttribute('download') || '').trim(),
+      title: (a.getAttribute('title') || '').trim(),
+      aria: (a.getAttribute('aria-label') || '').trim(),
+      text: (a.innerText || '').trim()
+    };
+    info.attname = attname(info.href).trim();
+    info.cpp = [info.download, info.attname, info.title, info.aria, info.text, info.href]
+      .some(function (s) { return SOURCE_RE.test(s); });
+    return info;
+  }
+
+  // 弹层里的下载入口：total 为可见下载入口总数，links 只含带源码（.cpp/.h 等）提示的
+  function cppLinks() {
+    var m = topModal();
+    if (!m) return {modal: false, total: 0, links: []};
+    var nodes = xpathAll(
+      ".//a[contains(@href,'download')] | .//button[contains(.,'下载')] | .//*[contains(@class,'download')]", m
+    ).filter(visible);
+    var infos = nodes.map(linkInfo);
+    return {modal: true, total: infos.length, links: infos.filter(function (i) { return i.cpp; })};
+  }
+
+  function findButton(label, scope) {
+    var btns = xpathAll(".//button[.//span[normalize-space()='" + label + "']]", scope || document);
+    for (var i = 0; i < btns.length; i++) {
+      if (visible(btns[i]) && !btns[i].disabled) return btns[i];
+    }
+    return null;
+  }
+
+  function scoreInput(m) {
+    if (!m) return null;
+    var xps = [
+      ".//input[@placeholder='请选择' and not(@disabled)]",
+      ".//input[contains(@class,'ant-select-selection-search-input') and not(@disabled)]"
+    ];
+    for (var i = 0; i < xps.length; i++) {
+      var els = xpathAll(xps[i], m);
+      for (var j = 0; j < els.length; j++) {
+        if (visible(els[j]) && !els[j].disabled) return els[j];
+      }
+    }
+    return null;
+  }
+
+  function optionText(opt) {
+    var label = opt.querySelector("[class*='SelectOptions-module__optionLabel']");
+    var t = label ? norm(label.innerText) : '';
+    return t || norm(opt.innerText);
+  }
+
+  // 回填流程的当前状态：修改按钮 / 分数输入框 / 已渲染选项的 listbox / 提交按钮
+  function submitState() {
+    var m = topModal();
+    var listbox = null;
+    var options = [];
+    var boxes = xpathAll("//div[@role='listbox' and contains(@class,'SelectOptions-module')]");
+    for (var i = boxes.length - 1; i >= 0; i--) {
+      if (!visible(boxes[i])) continue;
+      var opts = boxes[i].querySelectorAll("[role='option']");
+      if (!opts.length) continue;
+      listbox = boxes[i];
+      for (var k = 0; k < opts.length; k++) options.push({el: opts[k], text: optionText(opts[k])});
+      break;
+    }
+    return {
+      modal: m,
+      edit: (m && findButton('修改', m)) || findButton('修改'),
+      input: scoreInput(m),
+      listbox: listbox,
+      options: options,
+      submit: (m && findButton('提交', m)) || findButton('提交')
+    };
+  }
+
+  function closeModal(m) {
+    m = m || topModal();
+    if (!m) return false;
+    var btn = m.querySelector('button.ant-modal-close') ||
+      m.querySelector('button.ant-drawer-close') ||
+      xpathAll(".//button[@type='button' and @aria-label='Close']", m)[0];
+    if (!btn) return false;
+    btn.click();
+    return true;
+  }
+
+  // 点击某行的详情列：优先点 cell 内的 a/button/[role=button]，否则点 cell 本身
+  function openDetail(rowIndex, colId) {
+    var cells = xpathAll("//div[@role='row' and @row-index='" + rowIndex + "']//div[@col-id='" + colId + "']");
+    if (!cells.length) return 'missing';
+    var cell = cells.filter(visible)[0] || cells[0];
+    cell.scrollIntoView({block: 'center', inline: 'center'});
+    var sels = ['a', 'button', "[role='button']"];
+    for (var i = 0; i < sels.length; i++) {
+      var targets = Array.prototype.filter.call(cell.querySelectorAll(sels[i]), visible);
+      if (targets.length) { targets[0].click(); return 'clicked'; }
+    }
+    cell.click();
+    return 'clicked';
+  }
+
+  function cellText(cell) {
+    if (!cell) return '';
+    var v = cell.querySelector('.ag-cell-value');
+    var t = norm(v ? v.innerText : cell.innerText);
+    return t || norm(cell.getAttribute('title'));
+  }
+
+  // 同一 row-index 在 pinned/center 多套 row 里都有，按 col-id 找可见的那个 cell
+  function rowCell(rowIndex, colId) {
+    var cells = document.querySelectorAll("[role='row'][row-index='" + rowIndex + "'] [col-id='" + colId + "']");
+    for (var i = 0; i < cells.length; i++) if (visible(cells[i])) return cells[i];
+    return cells[0] || null;
+  }
+
+  // 行的稳定标识：entry id 列文本 → AG Grid row-id（与 row-index 不同才可信）→ 退回 row-index
+  function rowInfo(row, idCol, scoreCol) {
+    var ri = row.getAttribute('row-index');
+    var rid = row.getAttribute('row-id') || '';
+    var info = {
+      rowIndex: ri,
+      rowId: rid,
+      entryId: idCol ? cellText(rowCell(ri, idCol)) : '',
+      score: scoreCol ? cellText(rowCell(ri, scoreCol)) : ''
+    };
+    info.key = info.entryId || (rid && rid !== ri ? 'row-id:' + rid : 'row-index:' + ri);
+    return info;
+  }
+
+  function centerRows() {
+    return Array.prototype.slice.call(
+      document.querySelectorAll(".ag-center-cols-container [role='row'][row-index]")
+    );
+  }
+
+  function visibleRows(idCol, scoreCol) {
+    return centerRows().map(function (r) { return rowInfo(r, idCol, scoreCol); });
+  }
+
+  // 按稳定 key 重新定位行（表格重排/新增提交后 row-index 会变）
+  function findEntry(idCol, key, scoreCol) {
+    var rows = centerRows();
+    for (var i = 0; i < rows.length; i++) {
+      var info = rowInfo(rows[i], idCol, scoreCol);
+      if (info.key === key) return info;
+    }
+    return null;
+  }
+
+  function modalHtml() {
+    var m = topModal();
+    return m ? m.outerHTML : null;
+  }
+
+  window.__grader = {
+    version: VERSION,
+    modalHtml: modalHtml,
+    visibleRows: visibleRows,
+    findEntry: findEntry,
+    topModal: topModal,
+    scrollModal: scrollModal,
+    cppLinks: cppLinks,
+    submitState: submitState,
+    closeModal: closeModal,
+    openDetail: openDetail,
+    isShown: visible,
+    click: function (el) { el.click(); return true; },
+    revealClick: function (el) { el.scrollIntoView({block: 'center'}); el.click(); return true; }
+  };
+})();
+""".replace("__VERSION__", _PAGE_HELPERS_VERSION)
+
+_PAGE_CALL_JS = """
+var g = window.__grader;
+if (!g || g.version !== arguments[0]) return {missing: true};
+return {value: g[arguments[1]].apply(null, arguments[2])};
+"""
 
-    # 3) fallback dialog
+
+def install_page_helpers(driver):
+    """让每个新文档加载时自动带上 helper（CDP），页面跳转后无需额外往返重新注入。"""
     try:
-        dialogs = driver.find_elements(By.XPATH, "//*[@role='dialog' or @aria-modal='true']")
+        driver.execute_cdp_cmd(
+            "Page.addScriptToEvaluateOnNewDocument", {"source": _PAGE_HELPERS_JS}
+        )
     except Exception:
-        dialogs = []
-
-    for dlg in reversed(dialogs):
-        try:
-            if dlg.is_displayed():
-                return dlg
-        except Exception:
-            continue
+        # 非 Chromium 或不支持 CDP：由 _page_call 在缺失时按需注入
+        pass
 
-    return None
 
+def _page_call(driver, name, *args):
+    """调用页面 helper（一次往返）；helper 缺失/版本不符时注入后重试一次。"""
+    res = driver.execute_script(_PAGE_CALL_JS, _PAGE_HELPERS_VERSION, name, list(args))
+    if not res or res.get("missing"):
+        driver.execute_script(_PAGE_HELPERS_JS)
+        res = driver.execute_script(_PAGE_CALL_JS, _PAGE_HELPERS_VERSION, name, list(args))
+    return (res or {}).get("value")
 
-def _get_ant_modal_body(modal):
-    if not modal:
-        return None
 
-    # modal
-    try:
-        return modal.find_element(By.CSS_SELECTOR, ".ant-modal-body")
-    except Exception:
-        pass
+def _get_top_visible_ant_modal(driver):
+    """返回当前最上层、可见的弹层容器。
 
-    # drawer
-    try:
-        return modal.find_element(By.CSS_SELECTOR, ".ant-drawer-body")
-    except Exception:
-        pass
+    兼容：
+    - AntD Modal: .ant-modal
+    - AntD Drawer: .ant-drawer
+    - 兜底：任意 role=dialog 或 aria-modal=true
 
-    # fallback: 有些 dialog 结构不是 AntD
+    说明：为了尽量少改动原有代码，仍沿用旧函数名；查找在页面侧一次完成（topModal）。
+    """
     try:
-        return modal
-    except Exception:
+        return _page_call(driver, "topModal")
+    except StaleElementReferenceException:
         return None
 
 
-def _scroll_ant_modal_to_bottom(driver, modal, steps=10, pause=0.2):
-    """把弹窗内容区域滚动到最底部（用于触发懒加载/显示底部下载按钮）。"""
-    body = _get_ant_modal_body(modal)
-    if not body:
-        return
+def _scroll_ant_modal_to_bottom(driver, modal=None, steps=10, pause=0.2):
+    """把弹窗内容区域滚动到最底部（用于触发懒加载/显示底部下载按钮）。
 
+    modal 为空时滚动当前最上层弹层。
+    """
     last_top = None
     for _ in range(steps):
-        driver.execute_script("arguments[0].scrollTop = arguments[0].scrollHeight;", body)
-        time.sleep(pause)
         try:
-            top = driver.execute_script("return arguments[0].scrollTop;", body)
+            top = _page_call(driver, "scrollModal", modal)
         except Exception:
             top = None
-        if top is not None and top == last_top:
+        if top is None:
+            return
+        _sleep(pause)
+        if top == last_top:
             break
         last_top = top
 
@@ -284,301 +1226,360 @@ def _click_modal_close(driver, modal, timeout=10):
     if not modal:
         return False
 
-    close_btn = None
-    for sel in ("button.ant-modal-close", "button.ant-drawer-close"):
-        try:
-            close_btn = modal.find_element(By.CSS_SELECTOR, sel)
-            break
-        except Exception:
-            continue
-
-    if close_btn is None:
-        # 兜底：aria-label=Close
-        try:
-            close_btn = modal.find_element(
-                By.XPATH,
-                ".//button[@type='button' and @aria-label='Close']",
-            )
-        except Exception:
-            return False
-
     try:
-        driver.execute_script("arguments[0].click();", close_btn)
-    except Exception:
-        try:
-            close_btn.click()
-        except Exception:
+        if not _page_call(driver, "closeModal", modal):
             return False
+    except Exception:
+        return False
 
     def _gone(_):
         try:
-            return not modal.is_displayed()
+            return not _page_call(driver, "isShown", modal)
         except Exception:
             return True
 
-    WebDriverWait(driver, timeout).until(_gone)
+    _wait_until(driver, _gone, timeout, stage="modal_close")
     return True
 
 
-def _find_cell_by_row_index_and_col_id(driver, row_index: str, col_id: str):
-    """用 row-index + col-id 定位可见 cell（兼容 pinned/center 多套 row）。"""
-    cells = driver.find_elements(
-        By.XPATH,
-        f"//div[@role='row' and @row-index='{row_index}']//div[@col-id='{col_id}']",
-    )
-    for c in cells:
-        try:
-            if c.is_displayed():
-                return c
-        except Exception:
-            continue
-    return cells[0] if cells else None
-
-
-def _click_open_detail(driver, cell) -> bool:
-    """尽量点击到真正的可点击控件（有些 cell 内部是 a/button）。"""
-    if cell is None:
-        return False
-
-    # 若 cell 内有链接/按钮，优先点它
-    for xp in (".//a", ".//button", ".//*[@role='button']"):
-        try:
-            targets = cell.find_elements(By.XPATH, xp)
-            targets = [t for t in targets if t.is_displayed()]
-            if targets:
-                driver.execute_script("arguments[0].click();", targets[0])
-                return True
-        except Exception:
-            continue
-
-    # 否则点 cell 本身
+def _reset_modal(driver, timeout=5):
+    """关闭当前可见的弹层（上一行遗留的），返回是否关过。关不掉时只打印提示。"""
     try:
-        driver.execute_script("arguments[0].click();", cell)
-        return True
+        modal = _get_top_visible_ant_modal(driver)
     except Exception:
-        try:
-            cell.click()
-            return True
-        except Exception:
-            return False
+        return False
+    if modal is None:
+        return False
+    print("发现遗留的详情弹窗，先关闭")
+    try:
+        closed = _click_modal_close(driver, modal, timeout=timeout)
+    except TimeoutException:
+        closed = False
+    if not closed:
+        print("遗留弹窗未能关闭（将继续尝试打开本行详情）")
+    return True
 
 
-def _get_top_visible_select_listbox(driver):
-    """返回当前最上层、可见的自定义下拉选项容器（role=listbox）。"""
-    try:
-        boxes = driver.find_elements(
-            By.XPATH,
-            "//div[@role='listbox' and contains(@class,'SelectOptions-module')]",
-        )
-    except Exception:
-        return None
+def _wait_submit_state(driver, key, timeout=10):
+    """轮询页面侧 submitState()，直到 key 对应字段非空；返回整个 state。"""
 
-    for b in reversed(boxes):
+    def _ready(_):
         try:
-            if b.is_displayed():
-                return b
+            st = _page_call(driver, "submitState") or {}
         except Exception:
-            continue
-    return None
+            return None
+        return st if st.get(key) else None
 
+    return _wait_until(driver, _ready, timeout, stage=f"submit_{key}")
 
-def _get_top_visible_listbox_with_options(driver):
-    """返回当前最上层、可见且“有选项”的 listbox。
 
-    listbox 出现但内部可能还没渲染 optionLabel，
-    这里用 role=option 作为更稳定的判断/选择依据。
-    """
+def _choose_score_option(texts, score_str):
+    """在下拉选项文本里选出分数：先精确匹配，其次数值最接近，最后退回第一个。返回下标。"""
+    for i, txt in enumerate(texts):
+        if txt == score_str:
+            return i
+
     try:
-        boxes = driver.find_elements(
-            By.XPATH,
-            "//div[@role='listbox' and contains(@class,'SelectOptions-module')]",
-        )
+        target_val = float(score_str)
     except Exception:
-        return None
+        target_val = None
 
-    for b in reversed(boxes):
-        try:
-            if not b.is_displayed():
+    if target_val is not None:
+        best = None
+        for i, txt in enumerate(texts):
+            try:
+                v = float(txt)
+            except Exception:
                 continue
-            opts = b.find_elements(By.XPATH, ".//*[@role='option']")
-            if opts:
-                return b
+            diff = abs(v - target_val)
+            if best is None or diff < best[0]:
+                best = (diff, i)
+        if best is not None:
+            print(f"评分 {score_str} 不在下拉中，改选最接近的：{texts[best[1]]}")
+            return best[1]
+
+    print("警告：无法解析分数选项文本，将默认选择第一个 option：", texts[0])
+    return 0
+
+
+def open_detail(driver, row_index, detail_col_id="field_5", open_attempts=4, per_attempt_wait=8):
+    """点击该行的详情列打开弹窗，返回弹窗元素；打不开时返回 None。"""
+    current_row_index = str(row_index)
+
+    # 上一行失败时可能留下没关的弹层：先关掉再打开本行详情（复用它会把上一行的附件当成本行的）
+    _reset_modal(driver)
+    modal = None
+
+    # 多次尝试点击打开详情（每次短等待，避免单行卡死）；
+    # 定位 cell、滚动到视野、点击真正的可点击控件都在页面侧一次完成（openDetail）
+    open_start = time.perf_counter()
+    open_attempts = _TIMER.attempts("modal_open", open_attempts) if _TIMER is not None else open_attempts
+    for _attempt in range(1, open_attempts + 1):
+        try:
+            state = _page_call(driver, "openDetail", current_row_index, detail_col_id)
         except Exception:
+            state = None
+        if state == "missing":
+            print(f"第 {row_index + 1} 行：未找到 {detail_col_id} 单元格，跳过")
+            _record("opened", "missing")
+            return None
+        _sleep(0.2)
+        if state != "clicked":
+            continue
+        try:
+            modal = _wait_until(
+                driver, _get_top_visible_ant_modal, per_attempt_wait, poll=0.2, stage="modal_open"
+            )
+            break
+        except TimeoutException:
             continue
-    return None
-
 
-def _extract_option_text(option_el):
-    """从 option 元素里尽量提取用于匹配分数的文本。"""
-    try:
-        label = option_el.find_elements(
-            By.XPATH, ".//*[contains(@class,'SelectOptions-module__optionLabel')]"
+    _record("opened", modal is not None)
+    _record("open_s", round(time.perf_counter() - open_start, 3))
+    if modal is None:
+        print(
+            f"第 {row_index + 1} 行：点击 {detail_col_id} 后仍未出现弹窗/抽屉（已重试 {open_attempts} 次），跳过"
         )
-        if label:
-            t = (label[0].text or "").strip()
-            if t:
-                return t
-    except Exception:
-        pass
-    try:
-        return (option_el.text or "").strip()
-    except Exception:
-        return ""
+    return modal
 
 
-def download_homework_file(
+def download_homework_files(
     driver,
-    row,
     row_index,
     post_click_wait=2.0,
     open_attempts=4,
     per_attempt_wait=8,
+    detail_col_id="field_5",
+    download_dir=None,
+    dest_dir=None,
 ):
     """新版页面：
-    1) 先点击该行的 field_5 单元格打开详情/弹窗
+    1) 先点击该行的 field_5（detail_col_id）单元格打开详情/弹窗
     2) 弹窗里会出现多个下载按钮（a 标签）
-    3) 只下载以 .cpp 结尾的附件（若有多个，按顺序逐个尝试，直到下载到 .cpp）
+    3) 下载全部源码附件（.cpp/.cc/.cxx/.h/.hpp），多文件作业按一个项目整体评分
+
+    下载方式：
+    - 有直链（http/https href）的附件：带浏览器 cookie 并发直接下载到 dest_dir（默认 downloads/latest）
+    - 其余附件（或直链失败）：点击下载，逐个等待浏览器下载完成后移入 dest_dir
 
     关键适配：
     - 点击详情后，需要把弹窗内容下滑到最底部，才会显示下载按钮
     - 站点下载时可能先生成 *.tmp，必须等待其转为最终文件
     - 点击下载后固定等待 2s（post_click_wait）再开始轮询
+
+    返回：下载到的文件路径列表（按附件顺序）。
     """
 
-    current_row_index = row.get_attribute("row-index")
-
-    # 若已存在弹层，直接复用（避免因为上一个未关闭导致等待失败）
-    modal = _get_top_visible_ant_modal(driver)
-
+    modal = open_detail(driver, row_index, detail_col_id, open_attempts, per_attempt_wait)
     if modal is None:
-        # 定位 field_5 单元格（优先用全局定位，避开 pinned/center 差异）
-        cell = _find_cell_by_row_index_and_col_id(driver, current_row_index, "field_5")
-        if cell is None:
-            print(f"第 {row_index + 1} 行：未找到 field_5 单元格，跳过")
-            return None
-
+        return []
+
+    start = _clock()
+    links_timeout = _stage_timeout("links", 20)
+    links_poll = _stage_poll("links", 0.2)
+    found = {"total": 0, "links": []}
+    while True:
+        _scroll_ant_modal_to_bottom(driver)
         try:
-            driver.execute_script(
-                "arguments[0].scrollIntoView({block: 'center', inline: 'center'});",
-                cell,
-            )
+            # 兼容 a 或 button；同时保留 class=download 的旧线索（见 _PAGE_HELPERS_JS 的 cppLinks）
+            found = _page_call(driver, "cppLinks") or found
         except Exception:
-            pass
-        time.sleep(0.2)
-
-        # 多次尝试点击打开详情（每次短等待，避免单行卡死）
-        modal = None
-        for _attempt in range(1, open_attempts + 1):
-            ok = _click_open_detail(driver, cell)
-            time.sleep(0.2)
-            if not ok:
-                continue
-            try:
-                WebDriverWait(driver, per_attempt_wait).until(
-                    lambda drv: _get_top_visible_ant_modal(drv) is not None
-                )
-                modal = _get_top_visible_ant_modal(driver)
-                break
-            except TimeoutException:
-                try:
-                    driver.execute_script(
-                        "arguments[0].scrollIntoView({block: 'center', inline: 'center'});",
-                        cell,
-                    )
-                except Exception:
-                    pass
-
-        if modal is None:
-            print(
-                f"第 {row_index + 1} 行：点击 field_5 后仍未出现弹窗/抽屉（已重试 {open_attempts} 次），跳过"
-            )
-            return None
-
-    start = time.time()
-    all_links = []
-    while time.time() - start < 20:
-        modal = _get_top_visible_ant_modal(driver) or modal
-        if modal:
-            _scroll_ant_modal_to_bottom(driver, modal)
-            try:
-                # 兼容 a 或 button；同时保留 class=download 的旧线索
-                all_links = modal.find_elements(
-                    By.XPATH,
-                    ".//a[contains(@href,'download')] | .//button[contains(.,'下载')] | .//*[contains(@class,'download')]",
-                )
-                all_links = [a for a in all_links if a.is_displayed()]
-            except Exception:
-                all_links = []
+            found = {"total": 0, "links": []}
 
-        if all_links:
+        if found.get("total"):
+            _stage_observe("links", _clock() - start)
             break
-        time.sleep(0.2)
-
-    cpp_links = [a for a in all_links if _is_cpp_download_link(a)]
-
-    if not cpp_links:
-        print(f"第 {row_index + 1} 行：弹窗中未找到带 .cpp 提示的下载按钮（将不下载）")
-        return None
+        if _clock() - start >= links_timeout:
+            _stage_timed_out("links")
+            break
+        _sleep(links_poll)
 
-    if len(cpp_links) > 1:
-        print(
-            f"第 {row_index + 1} 行：发现 {len(cpp_links)} 个可能的 .cpp 附件，依次尝试下载直到拿到 .cpp："
-        )
-        for a in cpp_links:
-            href = a.get_attribute("href") or ""
-            dl = a.get_attribute("download") or ""
-            att = _extract_filename_from_href(href)
-            txt = (a.text or "").strip()
-            print("  -", dl or att or txt or href)
-
-    for idx, target in enumerate(cpp_links, start=1):
-        clear_download_dir()
-
-        file_name_hint = (
-            (target.get_attribute("download") or "").strip()
-            or _extract_filename_from_href(target.get_attribute("href") or "")
-            or (target.get_attribute("title") or "").strip()
-            or (target.text or "").strip()
-        )
+    cpp_links = found.get("links") or []
 
-        print(
-            f"下载第 {row_index + 1} 行（候选 {idx}/{len(cpp_links)}）: {file_name_hint or '(cpp 附件)'}"
-        )
+    if _RECORDER is not None:
+        _record("link_total", found.get("total") or 0)
+        _record("links", [{k: v for k, v in info.items() if k != "el"} for info in cpp_links])
+        try:
+            _record_text("modal.html", _page_call(driver, "modalHtml") or "")
+        except Exception:
+            pass
 
+    if not cpp_links:
+        print(f"第 {row_index + 1} 行：弹窗中未找到源码（.cpp/.h）下载按钮（将不下载）")
+        return []
+
+    print(f"第 {row_index + 1} 行：发现 {len(cpp_links)} 个源码附件")
+    for info in cpp_links:
+        print("  -", _link_file_name(info) or info.get("href"))
+
+    dest_dir = dest_dir or os.path.join(download_dir or DOWNLOAD_DIR, "latest")
+    shutil.rmtree(dest_dir, ignore_errors=True)
+    os.makedirs(dest_dir, exist_ok=True)
+
+    # 1) 有直链的附件：带上浏览器 cookie 并发直接下载，不经过浏览器下载目录。
+    #    每个附件先下到自己的临时子目录，再按附件顺序挪到不重名的文件名，同名附件不会互相覆盖
+    direct = [(i, info) for i, info in enumerate(cpp_links) if _is_http_url(info.get("href"))]
+    results: dict[int, str] = {}
+    rejected: set[int] = set()
+    taken: set[str] = set()
+    if direct:
+        headers = {"User-Agent": "Mozilla/5.0"}
         try:
-            driver.execute_script("arguments[0].scrollIntoView({block:'center'});", target)
-            time.sleep(0.2)
+            cookie = _cookie_header(driver, direct[0][1]["href"])
+            if cookie:
+                headers["Cookie"] = cookie
         except Exception:
             pass
 
+        def _fetch(item):
+            i, info = item
+            start = time.perf_counter()
+            part_dir = os.path.join(dest_dir, f".link{i}")
+            os.makedirs(part_dir, exist_ok=True)
+            try:
+                path = _fetch_attachment(info["href"], part_dir, _link_file_name(info), headers)
+            except Exception as e:
+                print(f"直链下载失败（{_link_file_name(info)}），改用浏览器下载：{e}")
+                path = None
+            return i, path, time.perf_counter() - start
+
+        with ThreadPoolExecutor(max_workers=min(ATTACHMENT_WORKERS, len(direct))) as pool:
+            for i, path, seconds in pool.map(_fetch, direct):
+                if path:
+                    # 与点击下载相同的过滤：文件名和链接提示都不像源码的不要
+                    base = os.path.basename(path)
+                    if not _contains_source_hint(base) and not _contains_source_hint(_link_file_name(cpp_links[i])):
+                        print("下载到的不是源码文件，跳过:", base)
+                        rejected.add(i)
+                        path = None
+                    else:
+                        target = _claim_path(dest_dir, base, taken)
+                        shutil.move(path, target)
+                        path = target
+                shutil.rmtree(os.path.join(dest_dir, f".link{i}"), ignore_errors=True)
+                _record_append(
+                    "downloads",
+                    {
+                        "link": i,
+                        "via": "http",
+                        "file": _record_file(path) if path else None,
+                        "seconds": round(seconds, 3),
+                    },
+                )
+                if path:
+                    results[i] = path
+
+    # 2) 没有直链或直链失败的：仍走浏览器点击下载（逐个，浏览器下载目录只能串行判断完成）
+    for i, info in enumerate(cpp_links):
+        if i in results or i in rejected:
+            continue
+        name_hint = _link_file_name(info)
+        clear_download_dir(download_dir)
+        print(f"下载第 {row_index + 1} 行（附件 {i + 1}/{len(cpp_links)}）: {name_hint or '(源码附件)'}")
+
         try:
-            driver.execute_script("arguments[0].click();", target)
+            _page_call(driver, "revealClick", info["el"])
         except Exception:
             try:
-                target.click()
+                info["el"].click()
             except Exception:
-                print("点击下载失败，尝试下一个候选")
+                print("点击下载失败，跳过该附件")
                 continue
-        time.sleep(post_click_wait)
-
-        downloaded = wait_download_complete(timeout=60)
+        click_time = time.perf_counter()
+        _sleep(post_click_wait)
+
+        downloaded = wait_download_complete(timeout=60, download_dir=download_dir, stage="download")
+        _record_append(
+            "downloads",
+            {
+                "link": i,
+                "via": "click",
+                "file": _record_file(downloaded) if downloaded else None,
+                "seconds": round(time.perf_counter() - click_time, 3),
+            },
+        )
         if not downloaded:
-            print("下载超时，尝试下一个候选")
+            print("下载超时，跳过该附件")
             continue
 
         base = os.path.basename(downloaded)
-        print("下载完成:", base)
+        if not _contains_source_hint(base) and not _contains_source_hint(name_hint):
+            print("下载到的不是源码文件，跳过:", base)
+            continue
+        if not _contains_source_hint(base):
+            print("注意：下载文件扩展名不是源码扩展名，但链接提示是源码，将尝试按文本读取：", base)
 
-        if base.lower().endswith(".cpp"):
-            return downloaded
+        target = _claim_path(dest_dir, base, taken)
+        shutil.move(downloaded, target)
+        results[i] = target
 
-        if _contains_cpp_hint(file_name_hint):
-            print("注意：下载文件扩展名不是 .cpp，但链接提示是 .cpp，将尝试按文本读取：", base)
-            return downloaded
+    files = [results[i] for i in sorted(results)]
+    print(f"下载完成：{len(files)}/{len(cpp_links)} 个附件 ->", dest_dir)
+    return files
 
-        print("下载到的不是 .cpp，清理后尝试下一个候选:", base)
 
-    return None
+def download_homework_file(driver, row_index, **kwargs):
+    """兼容旧接口：下载该行全部源码附件，返回第一个文件路径（没有则 None）。"""
+    files = download_homework_files(driver, row_index, **kwargs)
+    return files[0] if files else None
+
+
+# 可替换的直链下载函数 (url, dest_dir, name_hint) -> path：回放时从录制的附件读取
+_ATTACHMENT_FETCHER = None
+
+
+def _link_file_name(info) -> str:
+    return (
+        info.get("download")
+        or info.get("attname")
+        or info.get("title")
+        or info.get("text")
+        or ""
+    ).strip()
+
+
+def _is_http_url(url) -> bool:
+    return bool(url) and url.lower().startswith(("http://", "https://"))
+
+
+def _cookie_header(driver, url) -> str:
+    """把浏览器里对该域名有效的 cookie 拼成 Cookie 头（直链下载可能需要登录态）。"""
+    host = (urlparse(url).hostname or "").lower()
+    pairs = []
+    for c in driver.get_cookies():
+        domain = (c.get("domain") or "").lstrip(".").lower()
+        if domain and (host == domain or host.endswith("." + domain)):
+            pairs.append(f"{c['name']}={c['value']}")
+    return "; ".join(pairs)
+
+
+def _fetch_attachment(url, dest_dir, name_hint, headers, timeout=60, max_bytes=20_000_000):
+    """直接 HTTP 下载一个附件到 dest_dir，返回文件路径。设置 _ATTACHMENT_FETCHER 时由它接管（回放）。"""
+    if _ATTACHMENT_FETCHER is not None:
+        return _ATTACHMENT_FETCHER(url, dest_dir, name_hint)
+
+    req = urllib.request.Request(url, headers=headers)
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        name = name_hint or _filename_from_disposition(resp.headers.get("Content-Disposition"))
+        data = resp.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise ValueError(f"附件超过 {max_bytes} bytes")
+
+    name = os.path.basename(name or unquote(urlparse(url).path) or "attachment")
+    path = os.path.join(dest_dir, _safe_name(name))
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def _filename_from_disposition(value) -> str:
+    if not value:
+        return ""
+    m = re.search(r"filename\*=(?:UTF-8'')?([^;]+)", value, re.I)
+    if m:
+        return unquote(m.group(1).strip().strip('"'))
+    m = re.search(r'filename="?([^";]+)"?', value, re.I)
+    return m.group(1).strip() if m else ""
 
 
 def read_cpp_file(file_path, max_bytes=2_000_000):
@@ -586,27 +1587,35 @@ def read_cpp_file(file_path, max_bytes=2_000_000):
 
     乱码通常来自编码识别错误。这里采用“多编码候选 + 质量打分”选最优解码。
     """
+    return read_cpp_file_with_encoding(file_path, max_bytes)[0]
+
+
+def read_cpp_file_with_encoding(file_path, max_bytes=2_000_000, log=print):
+    """同 read_cpp_file，返回 (文本, 选中的编码)；读取失败时为 (None, None)。
+
+    log 为输出函数，批量读取时可传入空函数静默。
+    """
 
     if not file_path or not os.path.exists(file_path):
-        print("read_cpp_file: 文件不存在:", file_path)
-        return None
+        log("read_cpp_file: 文件不存在:", file_path)
+        return None, None
 
     size = os.path.getsize(file_path)
-    print("文件大小:", size, "bytes")
+    log("文件大小:", size, "bytes")
 
     with open(file_path, "rb") as f:
         data = f.read(max_bytes + 1)
 
     if len(data) > max_bytes:
         data = data[:max_bytes]
-        print(f"注意：文件过大，已截断到前 {max_bytes} bytes 读取")
+        log(f"注意：文件过大，已截断到前 {max_bytes} bytes 读取")
 
     if data.startswith(b"PK\x03\x04"):
-        print("read_cpp_file: 看起来像 ZIP/Office 文档（可能是 docx/xlsx），不是源码文本")
-        return None
+        log("read_cpp_file: 看起来像 ZIP/Office 文档（可能是 docx/xlsx），不是源码文本")
+        return None, None
     if data.startswith(b"%PDF"):
-        print("read_cpp_file: 看起来像 PDF，不是源码文本")
-        return None
+        log("read_cpp_file: 看起来像 PDF，不是源码文本")
+        return None, None
 
     def _score_text(text: str) -> tuple:
         if not text:
@@ -667,32 +1676,99 @@ def read_cpp_file(file_path, max_bytes=2_000_000):
         best_enc = "utf-8 (fallback)"
         best_score = _score_text(best)
 
-    print("读取编码:", best_enc, "score=", best_score)
+    log("读取编码:", best_enc, "score=", best_score)
 
     if best.count("�") > max(10, len(best) // 50):
-        print("警告：文本可能仍存在乱码（替换字符较多）。建议检查该作业源文件实际编码。")
+        log("警告：文本可能仍存在乱码（替换字符较多）。建议检查该作业源文件实际编码。")
 
-    return best
+    return best, best_enc
 
 
-def score_homework_with_ai(cpp_code):
-    if not API_KEY:
-        return None, "缺少 AI_API_KEY（环境变量/.env）"
-    if not cpp_code or not cpp_code.strip():
-        return None, "文件内容为空"
+def read_source_files(paths, quiet=False) -> list:
+    """读取多个源码附件，返回 [(文件名, 文本)]（读取失败的跳过）。
 
-    client = OpenAI(api_key=API_KEY, base_url=BASE_URL)
-    resp = client.chat.completions.create(
-        model=MODEL_NAME,
-        messages=[
-            {"role": "system", "content": SCORING_CRITERIA},
-            {"role": "user", "content": f"请评分以下C++代码：\n{cpp_code}"},
-        ],
-        timeout=30,
+    作业附件都很小，逐个在当前进程解码即可。
+    quiet=True 时不打印逐个文件的大小/编码（regrade 批量读取时用）。
+    """
+    files = []
+    for p in paths:
+        text = read_cpp_file_with_encoding(p, log=_quiet)[0] if quiet else read_cpp_file(p)
+        if text:
+            files.append((os.path.basename(p), text))
+    return files
+
+
+def build_project_source(files, budget=None) -> str:
+    """把多个源码文件拼成一段评分输入：头文件在前，每个文件带文件名分隔行。
+
+    超出字符预算时按“平均分配、短文件让出余量”截断较长的文件，并标注截断位置。
+    单个文件时原样返回（与旧版提示词一致）。
+    """
+    if not files:
+        return ""
+    if len(files) == 1:
+        return files[0][1]
+
+    budget = budget or PROJECT_CHAR_BUDGET
+    ordered = sorted(
+        files, key=lambda f: (not re.search(r"(?i)\.(h|hpp)$", f[0]), f[0].lower())
+    )
+
+    # 从短到长分配预算：短文件全量保留，剩余额度平分给更长的文件
+    limits = {}
+    remaining = budget
+    pending = sorted(range(len(ordered)), key=lambda i: len(ordered[i][1]))
+    for n, i in enumerate(pending):
+        share = remaining // (len(pending) - n)
+        limits[i] = min(len(ordered[i][1]), share)
+        remaining -= limits[i]
+
+    parts = []
+    for i, (name, text) in enumerate(ordered):
+        body = text[: limits[i]]
+        if len(body) < len(text):
+            body += f"\n// ...（{name} 过长，已截断 {len(text) - len(body)} 字符）"
+        parts.append(f"// ===== 文件：{name} =====\n{body}")
+    return "\n\n".join(parts)
+
+
+# 可替换的模型客户端工厂：回放/测试时注入假客户端（需提供 chat.completions.create）
+_MODEL_CLIENT_FACTORY = None
+
+
+_MODEL_CLIENT = None
+_MODEL_CLIENT_LOCK = threading.Lock()
+
+
+def _get_model_client():
+    """模型客户端（进程内共用一个，复用 HTTP 连接；客户端本身线程安全）。"""
+    global _MODEL_CLIENT
+    if _MODEL_CLIENT_FACTORY is not None:
+        return _MODEL_CLIENT_FACTORY()
+    with _MODEL_CLIENT_LOCK:
+        if _MODEL_CLIENT is None:
+            from openai import OpenAI
+
+            client = OpenAI(api_key=API_KEY, base_url=BASE_URL)
+            if _RECORDER is not None:
+                client = RecordingModelClient(client, _RECORDER)
+            _MODEL_CLIENT = client
+        return _MODEL_CLIENT
+
+
+def _model_request_key(kwargs) -> str:
+    """模型请求的指纹（模型 + 消息），录制与回放用它对齐回复。"""
+    payload = json.dumps(
+        {"model": kwargs.get("model"), "messages": kwargs.get("messages")},
+        ensure_ascii=False,
+        sort_keys=True,
     )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
 
-    result = resp.choices[0].message.content.strip()
-    lines = result.split("\n")
+def _parse_score_response(result):
+    """模型回复 → (分数, 评语)：第一处数字为分数，其余非纯数字行拼成评语。"""
+    lines = (result or "").strip().split("\n")
     score = None
     comment = ""
     for line in lines:
@@ -704,151 +1780,128 @@ def score_homework_with_ai(cpp_code):
     return score, comment.strip()
 
 
-def fill_score_and_comment(driver, row, score, comment=None):
-    """回填（新版弹窗 + 自定义选择框）。"""
+# 每个模型的累计请求数 / token / 耗时（写进运行报表，用于对比单次、分级、多次采样等模式的成本）
+_MODEL_USAGE: dict[str, dict] = {}
+_MODEL_USAGE_LOCK = threading.Lock()
 
-    score_str = str(score).strip() if score is not None else ""
-    if not score_str:
-        raise ValueError("score 为空，无法回填")
 
-    modal = _get_top_visible_ant_modal(driver)
+def _chat(model, system, user, timeout=30, **extra):
+    """发一次模型请求，返回 (原始回复, {"prompt","completion","total"} token 数, 耗时秒)。
 
-    def _find_edit():
-        m = _get_top_visible_ant_modal(driver) or modal
-        if m:
-            try:
-                btn = m.find_element(By.XPATH, ".//button[.//span[normalize-space()='修改']]")
-                if btn.is_displayed() and btn.is_enabled():
-                    return btn
-            except Exception:
-                pass
-        try:
-            btn = driver.find_element(By.XPATH, "//button[.//span[normalize-space()='修改']]")
-            if btn.is_displayed() and btn.is_enabled():
-                return btn
-        except Exception:
-            return None
-        return None
+    extra 原样传给接口（如 n）；不传时请求与以前完全相同（录制/回放按请求指纹对齐）。
+    接口不返回 usage 时 token 记 0。
+    """
+    start = time.perf_counter()
+    resp = _get_model_client().chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": system},
+            {"role": "user", "content": user},
+        ],
+        timeout=timeout,
+        **extra,
+    )
+    seconds = time.perf_counter() - start
+    raw = getattr(resp, "usage", None)
+    usage = {
+        "prompt": int(getattr(raw, "prompt_tokens", 0) or 0),
+        "completion": int(getattr(raw, "completion_tokens", 0) or 0),
+        "total": int(getattr(raw, "total_tokens", 0) or 0),
+    }
+    with _MODEL_USAGE_LOCK:
+        acc = _MODEL_USAGE.setdefault(model, {"calls": 0, "tokens": 0, "seconds": 0.0})
+        acc["calls"] += 1
+        acc["tokens"] += usage["total"]
+        acc["seconds"] = round(acc["seconds"] + seconds, 3)
+    return resp, usage, seconds
+
+
+def _call_model(model, system, user, timeout=30):
+    """单次模型请求，返回 (回复文本, 总 token 数, 耗时秒)。"""
+    resp, usage, seconds = _chat(model, system, user, timeout=timeout)
+    return resp.choices[0].message.content, usage["total"], seconds
+
+
+def _model_usage_report() -> dict:
+    with _MODEL_USAGE_LOCK:
+        return {
+            m: dict(
+                v,
+                tokens_per_call=round(v["tokens"] / v["calls"], 1),
+                seconds_per_call=round(v["seconds"] / v["calls"], 3),
+            )
+            for m, v in _MODEL_USAGE.items()
+            if v["calls"]
+        }
 
-    edit_btn = WebDriverWait(driver, 10).until(lambda _: _find_edit())
-    try:
-        edit_btn.click()
-    except Exception:
-        driver.execute_script("arguments[0].click();", edit_btn)
 
-    time.sleep(1)
-    modal = _get_top_visible_ant_modal(driver) or modal
+def score_homework_with_ai(cpp_code, criteria=None, model=None):
+    if not API_KEY and _MODEL_CLIENT_FACTORY is None:
+        return None, "缺少 AI_API_KEY（环境变量/.env）"
+    if not cpp_code or not cpp_code.strip():
+        return None, "文件内容为空"
 
-    def _find_score_input():
-        m = _get_top_visible_ant_modal(driver) or modal
-        if not m:
-            return None
+    text, _, _ = _call_model(
+        model or MODEL_NAME, criteria or SCORING_CRITERIA, f"请评分以下C++代码：\n{cpp_code}"
+    )
+    return _parse_score_response(text)
 
-        xpaths = [
-            ".//input[@placeholder='请选择' and not(@disabled)]",
-            ".//input[contains(@class,'ant-select-selection-search-input') and not(@disabled)]",
-        ]
-        for xp in xpaths:
-            try:
-                el = m.find_element(By.XPATH, xp)
-                if el.is_displayed() and el.is_enabled():
-                    return el
-            except Exception:
-                continue
-        return None
 
-    score_input = WebDriverWait(driver, 10).until(lambda _: _find_score_input())
-    score_input.click()
-    time.sleep(0.2)
+def fill_score_and_comment(driver, score, comment=None):
+    """回填（新版弹窗 + 自定义选择框）。返回 (实际选中的选项文本, 全部选项文本)。"""
+
+    score_str = str(score).strip() if score is not None else ""
+    if not score_str:
+        raise ValueError("score 为空，无法回填")
 
-    WebDriverWait(driver, 10).until(lambda _: _get_top_visible_listbox_with_options(driver) is not None)
-    listbox = _get_top_visible_listbox_with_options(driver) or _get_top_visible_select_listbox(driver)
+    # 每次轮询都是一次 submitState() 往返，拿到修改/输入框/选项/提交按钮的当前状态
+    st = _wait_submit_state(driver, "edit")
+    modal = st.get("modal")
+    edit_btn = st["edit"]
+    try:
+        edit_btn.click()
+    except Exception:
+        _page_call(driver, "click", edit_btn)
 
-    if not listbox:
-        raise RuntimeError("未找到评分下拉（listbox）")
+    _sleep(1)
 
-    options = listbox.find_elements(By.XPATH, ".//*[@role='option']")
-    if not options:
-        time.sleep(0.5)
-        options = listbox.find_elements(By.XPATH, ".//*[@role='option']")
+    st = _wait_submit_state(driver, "input")
+    modal = st.get("modal") or modal
+    st["input"].click()
+    _sleep(0.2)
 
-    if not options:
-        try:
-            html = listbox.get_attribute("outerHTML")
-            print("DEBUG: listbox outerHTML (truncated)=", (html or "")[:500])
-        except Exception:
-            pass
-        raise RuntimeError("未找到可用的评分选项（listbox 已出现，但无 role=option）")
+    st = _wait_submit_state(driver, "options")
 
-    parsed = []
-    for opt in options:
-        txt = _extract_option_text(opt)
-        if not txt:
-            continue
-        parsed.append((opt, txt))
+    parsed = [(o["el"], (o.get("text") or "").strip()) for o in st["options"]]
+    parsed = [(el, txt) for el, txt in parsed if txt]
 
     if not parsed:
         raise RuntimeError("未找到可用的评分选项（option 存在，但无法提取文本）")
 
-    chosen = None
-    for opt, txt in parsed:
-        if txt == score_str:
-            chosen = opt
-            break
-
-    if chosen is None:
-        try:
-            target_val = float(score_str)
-        except Exception:
-            target_val = None
-
-        if target_val is not None:
-            best = None
-            for opt, txt in parsed:
-                try:
-                    v = float(txt)
-                except Exception:
-                    continue
-                diff = abs(v - target_val)
-                if best is None or diff < best[0]:
-                    best = (diff, opt, txt)
-            if best is not None:
-                chosen = best[1]
-                print(f"评分 {score_str} 不在下拉中，改选最接近的：{best[2]}")
-
-    if chosen is None:
-        print("警告：无法解析分数选项文本，将默认选择第一个 option：", parsed[0][1])
-        chosen = parsed[0][0]
-
-    driver.execute_script("arguments[0].click();", chosen)
-    time.sleep(0.2)
-
-    def _find_submit():
-        m = _get_top_visible_ant_modal(driver) or modal
-        if m:
-            try:
-                btn = m.find_element(By.XPATH, ".//button[.//span[normalize-space()='提交']]")
-                if btn.is_displayed() and btn.is_enabled():
-                    return btn
-            except Exception:
-                pass
-        try:
-            btn = driver.find_element(By.XPATH, "//button[.//span[normalize-space()='提交']]")
-            if btn.is_displayed() and btn.is_enabled():
-                return btn
-        except Exception:
-            return None
-        return None
-
-    submit_btn = WebDriverWait(driver, 10).until(lambda _: _find_submit())
+    texts = [txt for _el, txt in parsed]
+    chosen_i = _choose_score_option(texts, score_str)
+    chosen = parsed[chosen_i][0]
+    _record("options", texts)
+    _record("chosen", texts[chosen_i])
+    _page_call(driver, "click", chosen)
+    _sleep(0.2)
+
+    st = _wait_submit_state(driver, "submit")
+    modal = st.get("modal") or modal
+    submit_btn = st["submit"]
     try:
         submit_btn.click()
     except Exception:
-        driver.execute_script("arguments[0].click();", submit_btn)
+        _page_call(driver, "click", submit_btn)
 
-    time.sleep(0.5)
-    modal = _get_top_visible_ant_modal(driver) or modal
-    closed = _click_modal_close(driver, modal, timeout=10)
+    # 已点击提交：之后弹窗关闭、grid 重渲染导致的 stale 是正常的，不影响回填结果
+    _sleep(0.5)
+    try:
+        modal = _get_top_visible_ant_modal(driver) or modal
+        closed = _click_modal_close(driver, modal, timeout=10)
+    except StaleElementReferenceException:
+        print("提交后弹窗元素变 stale（正常），继续...")
+        closed = False
     if not closed:
         print("已提交，但未找到/未能点击关闭按钮（请手动关闭弹窗）")
     else:
@@ -857,41 +1910,363 @@ def fill_score_and_comment(driver, row, score, comment=None):
     if comment and str(comment).strip():
         pass
 
-    # 当前回填逻辑不依赖 row，但保留参数以兼容批量调用
-    _ = row
+    return texts[chosen_i], texts
 
 
-def _get_ag_row_cell_text(row, col_id: str) -> str:
-    """从 AG Grid 的某行某列拿到可见文本（用于判断是否已有评分）。"""
-    if not row or not col_id:
-        return ""
-    try:
-        cell = row.find_element(By.XPATH, f".//div[@col-id='{col_id}']")
-    except Exception:
-        return ""
+def _has_score_text(txt) -> bool:
+    """教师评分列文本里有数字即视为已评分。"""
+    return bool(txt and re.search(r"\d", txt))
+
+
+def _same_score(observed, intended) -> bool:
+    """表格里显示的教师评分与应填的选项是否一致（文本相同，或解析出的数值相同）。"""
+    a = str(observed or "").strip()
+    b = str(intended or "").strip()
+    if not a or not b:
+        return False
+    if a == b:
+        return True
+    ma = re.search(r"-?\d+(?:\.\d+)?", a)
+    mb = re.search(r"-?\d+(?:\.\d+)?", b)
+    return bool(ma and mb and float(ma.group()) == float(mb.group()))
+
+
+def verify_writebacks(index, keys, observed):
+    """对比 observed（entry id → 教师评分列文本）与 index 里应填的分数，返回 (一致, 不一致, 未找到) 三个列表。
+
+    应填的分数取回填时实际选中的选项（option），没有时取 score；结果写回 index 的 verified 字段。
+    """
+    ok, bad, missing = [], [], []
+    updates = {}
+    for key in sorted(keys):
+        entry = index.get(key)
+        intended = entry.get("option") or entry.get("score")
+        if key not in observed:
+            missing.append(key)
+            continue
+        if _same_score(observed[key], intended):
+            ok.append(key)
+            updates[key] = {"verified": True}
+        else:
+            bad.append({"key": key, "expected": intended, "actual": observed[key]})
+            updates[key] = {"verified": False}
+    if updates:
+        index.update_many(updates)
+    return ok, bad, missing
+
+
+def _form_key(url) -> str:
+    """从表单地址里取出表单 id（/forms/<id>/），用于状态文件命名。"""
+    m = re.search(r"/forms/([^/?#]+)", url or "")
+    if m:
+        return m.group(1)
+    return hashlib.sha1((url or "").encode("utf-8")).hexdigest()[:12]
+
+
+def _state_path(url) -> str:
+    return os.path.join(STATE_DIR, f"{_form_key(url)}.json")
+
+
+class EntryIndex:
+    """entry id → 处理状态的索引（内存 + 持久化 JSON）。
+
+    AG Grid 的 row-index 会随排序/筛选/新提交变化，这里统一按稳定的 entry id
+    （ENTRY_ID_COL 列文本，退回 AG Grid row-id）记录状态，跨运行复用：
+
+    - status: written（已回填）/ skipped（已有教师评分）/ failed（本次失败）
+    - score / comment / model：回填内容；option：下拉框里实际选中的选项
+    - rubric_sha：评分时的评分标准 + 模型 + 评分策略指纹（规则变更后的增量重评据此判断是否需要重评）
+    - reason / attempts：失败原因与累计失败次数
+
+    meta 保存表单级信息（如 options：评分下拉框的全部选项）。
 
+    退回 row-index 的 key（读不到 entry id 时）只在本次运行内有效：下次运行同一位置可能已是
+    另一个条目，所以既不落盘，也不算“已完成”。
+    写入先改内存，由调用方在合适的时机（每屏处理完、运行结束）调用 flush() 落盘，
+    避免每行都重写整个 JSON；update_many 本身是批量操作，直接落盘。
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries: dict[str, dict] = {}
+        self.meta: dict = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self.entries = data.get("entries") or {}
+                self.meta = data.get("meta") or {}
+            except Exception as e:
+                print("状态文件读取失败，将重新建立：", path, e)
+
+    def get(self, entry_id) -> dict:
+        return self.entries.get(entry_id) or {}
+
+    def is_done(self, entry_id) -> bool:
+        if _unstable_key(entry_id):
+            return False
+        return self.get(entry_id).get("status") == "written"
+
+    def update(self, entry_id, **fields):
+        with self._lock:
+            state = dict(self.entries.get(entry_id) or {})
+            state.update(fields)
+            state["updated_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+            self.entries[entry_id] = state
+            self._dirty = True
+        return state
+
+    def update_many(self, updates: dict):
+        """批量更新 {entry id: 字段}，只落盘一次。"""
+        now = time.strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            for entry_id, fields in updates.items():
+                state = dict(self.entries.get(entry_id) or {})
+                state.update(fields)
+                state["updated_at"] = now
+                self.entries[entry_id] = state
+            self._save()
+            self._dirty = False
+
+    def written_keys(self) -> set:
+        return {k for k, v in self.entries.items() if v.get("status") == "written"}
+
+    def record_failure(self, entry_id, reason):
+        attempts = int(self.get(entry_id).get("attempts") or 0) + 1
+        return self.update(entry_id, status="failed", reason=reason, attempts=attempts)
+
+    def failed_keys(self) -> set:
+        return {k for k, v in self.entries.items() if v.get("status") == "failed"}
+
+    def set_meta(self, **fields):
+        with self._lock:
+            if all(self.meta.get(k) == v for k, v in fields.items()):
+                return
+            self.meta.update(fields)
+            self._dirty = True
+
+    def flush(self):
+        """把未落盘的修改写入状态文件（没有修改时什么都不做）。"""
+        with self._lock:
+            if self._dirty:
+                self._save()
+                self._dirty = False
+
+    def _save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        entries = {k: v for k, v in self.entries.items() if not _unstable_key(k)}
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"entries": entries, "meta": self.meta}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
+
+
+def _unstable_key(entry_id) -> bool:
+    """退回 row-index 的 key：表格重排/新增提交后会指向别的条目，不能跨运行使用。"""
+    return str(entry_id).startswith("row-index:")
+
+
+def _rubric_fingerprint(criteria=None, model=None, strategy=None) -> str:
+    """评分标准 + 模型 + 评分策略（模型分级 / 多次采样的配置）的指纹；任一变化，之前的分数就需要重评。"""
+    h = hashlib.sha256()
+    tier = json.dumps(strategy.config(), sort_keys=True) if strategy else ""
+    for part in (model or MODEL_NAME, criteria or SCORING_CRITERIA, tier):
+        h.update(part.encode("utf-8", errors="replace"))
+        h.update(b"\x00")
+    return h.hexdigest()[:16]
+
+
+def _entry_source_dir(index, key) -> str:
+    """条目源码的保存目录：sources/<表单id>/<条目>（表单 id 取自状态文件名）。"""
+    form = os.path.splitext(os.path.basename(index.path))[0] if index.path else "default"
+    return os.path.join(SOURCES_DIR, form, _safe_name(key))
+
+
+def _visible_entries(driver, entry_id_col, score_col_id):
+    """一次往返拿到当前可见行的 (rowIndex, key, entryId, score)。"""
     try:
-        val = cell.find_element(By.XPATH, ".//div[contains(@class,'ag-cell-value')]")
-        txt = (val.text or "").strip()
+        return _page_call(driver, "visibleRows", entry_id_col, score_col_id) or []
     except Exception:
-        txt = (cell.text or "").strip()
+        return []
+
+
+def _process_entry(
+    driver,
+    key,
+    index,
+    stats,
+    entry_id_col,
+    score_col_id="field_11",
+    detail_col_id="field_5",
+    skip_if_scored=True,
+    criteria=None,
+    model=None,
+    scorer=None,
+    download_dir=None,
+    strategy=None,
+):
+    """处理单个条目：按 entry id 重新定位 → 下载 → 读取 → 评分 → 回填。
+
+    返回：written / skipped / failed。状态同步写入 index，计数写入 stats。
+    strategy 为 scorer 使用的评分策略，只用于记录 rubric_sha。
+    """
+    scorer = scorer or score_homework_with_ai
 
-    if not txt:
+    # 处理前按 entry id 重新定位（期间表格可能重排、插入新提交）
+    with profile_stage("locate"):
         try:
-            txt = (cell.get_attribute("title") or "").strip()
+            loc = _page_call(driver, "findEntry", entry_id_col, key, score_col_id)
         except Exception:
-            txt = ""
-    return txt
+            loc = None
+    if not loc:
+        print(f"条目 {key}：重新定位失败（已不在可视区域），跳过")
+        index.record_failure(key, "locate")
+        stats["failed"] += 1
+        return "failed"
+
+    idx = int(loc["rowIndex"])
+
+    # 跳过：已有教师评分的行（field_11），用定位时顺带读到的最新文本判断
+    if skip_if_scored and _has_score_text(loc.get("score")):
+        print(f"\n--- 跳过第 {idx + 1} 行（条目 {key}）：已有教师评分 {loc['score']} ---")
+        index.update(key, status="skipped", score=loc["score"])
+        stats["skipped"] += 1
+        return "skipped"
+
+    print(f"\n--- 处理第 {idx + 1} 行（条目 {key}） ---")
+
+    source_dir = _entry_source_dir(index, key)
+    try:
+        with profile_stage("download"):
+            downloaded = download_homework_files(
+                driver,
+                idx,
+                detail_col_id=detail_col_id,
+                download_dir=download_dir,
+                dest_dir=source_dir,
+            )
+    except StaleElementReferenceException:
+        # 行被重渲染：记为失败，留给重试
+        print("行元素已失效（stale），跳过本行，继续...")
+        index.record_failure(key, "stale")
+        stats["failed"] += 1
+        return "failed"
+
+    if not downloaded:
+        print("下载失败，跳过")
+        index.record_failure(key, "download")
+        stats["failed"] += 1
+        return "failed"
+
+    with profile_stage("read"):
+        files = read_source_files(downloaded)
+        cpp_code = build_project_source(files)
+    if not cpp_code:
+        print("读取失败（可能下载到的不是源码文件），跳过")
+        index.record_failure(key, "read")
+        stats["failed"] += 1
+        return "failed"
+
+    with profile_stage("score"):
+        score, comment = scorer(cpp_code, criteria=criteria, model=model)
+    if not score:
+        print("评分失败，跳过：", comment)
+        index.record_failure(key, "score")
+        stats["failed"] += 1
+        return "failed"
+
+    stats["scored"] += 1
+    _record("score", score)
+    _record("comment", comment)
+    print("score =", score)
+    print("comment =", comment)
+
+    # 只有确认点击了提交（fill_score_and_comment 正常返回）才记为 written；
+    # 提交前的任何异常（超时、stale、找不到选项……）都记为失败，留给重试
+    try:
+        with profile_stage("writeback"):
+            option, options = fill_score_and_comment(driver, score, comment)
+        index.set_meta(options=options)
+    except Exception as e:
+        print("回填失败，留给重试：", f"{type(e).__name__}: {e}")
+        index.record_failure(key, "writeback")
+        stats["failed"] += 1
+        return "failed"
+    index.update(
+        key,
+        status="written",
+        score=score,
+        comment=comment,
+        option=option,
+        model=model or MODEL_NAME,
+        rubric_sha=_rubric_fingerprint(criteria, model, strategy),
+        reason="",
+        source_dir=source_dir,
+        files=[name for name, _ in files],
+    )
+    stats["written"] += 1
+    return "written"
 
 
-def _row_has_teacher_score(row, score_col_id: str = "field_11") -> tuple[bool, str]:
-    """判断该行是否已有教师评分。返回：(是否已评分, 原始文本)。"""
-    txt = _get_ag_row_cell_text(row, score_col_id)
-    if not txt:
-        return False, ""
-    if re.search(r"\d", txt):
-        return True, txt
-    return False, txt
+def _rewrite_entry(driver, key, index, stats, entry_id_col, score_col_id="field_11", detail_col_id="field_5"):
+    """只改分的回填：不下载、不评分，只打开详情把教师评分改成 index 里应填的分数。
+
+    应填内容优先取 index[key]["regrade_pending"]（regrade 命令离线重评后写入），
+    否则取该条目已记录的分数（回填核对发现没生效时重填）。返回 written / failed。
+    """
+    entry = index.get(key)
+    regrade = entry.get("regrade_pending")
+    pending = regrade or {k: entry.get(k) for k in ("score", "comment", "option", "model", "rubric_sha")}
+    with profile_stage("locate"):
+        try:
+            loc = _page_call(driver, "findEntry", entry_id_col, key, score_col_id)
+        except Exception:
+            loc = None
+    if not loc:
+        print(f"条目 {key}：重新定位失败（已不在可视区域），跳过")
+        index.update(key, reason="locate")
+        stats["failed"] += 1
+        return "failed"
+
+    idx = int(loc["rowIndex"])
+    print(f"\n--- 改分第 {idx + 1} 行（条目 {key}）：{loc.get('score')} → {pending.get('option')} ---")
+    with profile_stage("open"):
+        modal = open_detail(driver, idx, detail_col_id)
+    if modal is None:
+        index.update(key, reason="open")
+        stats["failed"] += 1
+        return "failed"
+
+    try:
+        with profile_stage("writeback"):
+            option, options = fill_score_and_comment(driver, pending["score"], pending.get("comment"))
+        index.set_meta(options=options)
+    except Exception as e:
+        print("改分失败：", e)
+        index.update(key, reason="writeback")
+        stats["failed"] += 1
+        return "failed"
+
+    fields = {}
+    if regrade:
+        fields = {"previous": {"score": entry.get("score"), "option": entry.get("option")}, "regrade_pending": None}
+    index.update(
+        key,
+        status="written",
+        score=pending["score"],
+        comment=pending.get("comment"),
+        option=option,
+        model=pending.get("model"),
+        rubric_sha=pending.get("rubric_sha"),
+        reason="",
+        **fields,
+    )
+    stats["written"] += 1
+    return "written"
 
 
 def process_all_visible_then_scroll(
@@ -900,112 +2275,2753 @@ def process_all_visible_then_scroll(
     max_loops=9999,
     skip_if_scored=True,
     score_col_id="field_11",
+    detail_col_id="field_5",
+    criteria=None,
+    model=None,
+    scorer=None,
+    download_dir=None,
+    stats=None,
+    entry_id_col=None,
+    index=None,
+    lifecycle=None,
+    retry_rounds=None,
+    only=None,
+    rewrite=False,
+    reconcile=None,
+    verify=None,
+    strategy=None,
 ):
-    processed: set[int] = set()
-
-    def _find_center_row_by_index(row_index: int):
-        return driver.find_element(
-            By.XPATH,
-            f"//div[contains(@class,'ag-center-cols-container')]//div[@role='row' and @row-index='{row_index}']",
+    """逐屏处理可见行，处理完一屏再向下滚动。
+
+    行按稳定的 entry id（entry_id_col 列，默认 ENTRY_ID_COL）跟踪：已处理集合、失败次数、
+    回填定位都以 entry id 为键，并持久化到 index（默认 STATE_DIR 下按表单 id 命名的 JSON）。
+    表格重排/新增提交导致 row-index 变化时不会重复下载/评分。
+
+    多表单调度时：
+    - detail_col_id / score_col_id：该表单的详情列、教师评分列
+    - criteria / model：该表单的评分标准与模型（为空则用全局默认）
+    - scorer：共享的评分入口（ScoringPool.score），为空则直接调用 score_homework_with_ai
+    - strategy：scorer 所用的评分策略（ModelCascade / ConsistentScorer），记入每个条目的 rubric_sha
+    - stats：计数字典（seen/skipped/scored/written/failed），用于吞吐报表
+    - lifecycle：BrowserLifecycle，每行后检查是否需要回收浏览器（回收后 driver 可能换新，
+      调用方结束后应使用 lifecycle.driver）
+
+    失败的条目（打不开、下载超时、stale、评分失败等）不会直接丢掉：主流程结束后最多重试
+    retry_rounds 轮（默认 RETRY_ROUNDS），每轮先退避等待、刷新页面，再只处理失败条目。
+    仍失败的条目列在 stats["still_failing"]（含原因与累计次数），stats["failed"] 为其数量。
+    only 为条目集合时只处理这些条目（--only-failed 重跑上次失败的）。
+    rewrite=True 时只给 only 里的条目改分（regrade 命令），不下载、不评分，见 _rewrite_entry。
+
+    回填核对（reconcile，默认 RECONCILE）：全部处理完后刷新页面，一次滚动读出本次回填的条目
+    （以及 verify 里额外指定的条目）的教师评分列，与应填分数对比；只把不一致的重新回填，
+    结果（核对数、一致数、首轮/最终核对通过率、重新回填成功数 rewritten）写入 stats["verification"]；
+    重新回填不计入 stats["written"]。
+    """
+    entry_id_col = entry_id_col or ENTRY_ID_COL
+    if index is None:
+        index = EntryIndex(_state_path(driver.current_url))
+    if _RECORDER is not None:
+        _RECORDER.begin_form(
+            driver.current_url,
+            entry_id_col=entry_id_col,
+            score_col_id=score_col_id,
+            detail_col_id=detail_col_id,
+            skip_if_scored=skip_if_scored,
+            criteria=criteria or SCORING_CRITERIA,
+            model=model or MODEL_NAME,
         )
+    processed: set[str] = set()
+    scorer = scorer or score_homework_with_ai
+    if stats is None:
+        stats = {}
+    for k in ("seen", "skipped", "scored", "written", "failed", "retried", "recovered"):
+        stats.setdefault(k, 0)
+    retry_rounds = RETRY_ROUNDS if retry_rounds is None else retry_rounds
+    warned_fallback = False
+    failures: dict[str, str] = {}  # 本次运行仍失败的条目 → 最近一次失败原因
+    touched: set[str] = set()  # 本次运行回填过的条目（回填核对的对象）
+    rewriting = rewrite
+    rewrite_stats = stats  # 回填核对时换成单独的计数，重新回填不算进本次的 written
+
+    def _handle(key, info):
+        nonlocal driver, viewport
+        row_start = time.perf_counter()
+        with profile_row(key), recording_row(key, info):
+            if rewriting:
+                result = _rewrite_entry(
+                    driver, key, index, rewrite_stats, entry_id_col, score_col_id=score_col_id, detail_col_id=detail_col_id
+                )
+            else:
+                result = _process_entry(
+                    driver,
+                    key,
+                    index,
+                    stats,
+                    entry_id_col,
+                    score_col_id=score_col_id,
+                    detail_col_id=detail_col_id,
+                    skip_if_scored=skip_if_scored,
+                    criteria=criteria,
+                    model=model,
+                    scorer=scorer,
+                    download_dir=download_dir,
+                    strategy=strategy,
+                )
+            _record("result", result)
+
+        if result == "failed":
+            failures[key] = index.get(key).get("reason") or ""
+        elif failures.pop(key, None) is not None:
+            stats["recovered"] += 1
+        if result == "written":
+            touched.add(key)
+
+        if lifecycle is not None and result != "skipped":
+            reason = lifecycle.after_row(time.perf_counter() - row_start)
+            if reason:
+                driver, viewport = lifecycle.recycle(viewport, reason)
+
+    def _scan(targets=None, counter="retried"):
+        """从当前位置逐屏向下处理。targets 为空时处理所有新条目（主流程），否则只处理其中的条目。"""
+        nonlocal warned_fallback
+        visited: set[str] = set()
+        for _ in range(max_loops):
+            # 先“快照”当前可见行的稳定 key（不要把 row WebElement 长期保存）
+            with profile_stage("snapshot"):
+                snapshot = _visible_entries(driver, entry_id_col, score_col_id)
+            if _RECORDER is not None and targets is None:
+                _RECORDER.add_snapshot(snapshot)
+
+            new_rows = 0
+
+            for info in snapshot:
+                key = info.get("key")
+                if not key or key in visited:
+                    continue
+                visited.add(key)
+                new_rows += 1
+                if targets is not None:
+                    if key in targets:
+                        stats[counter] = stats.get(counter, 0) + 1
+                        _handle(key, info)
+                    continue
 
-    for _ in range(max_loops):
-        # 先“快照”当前可见的 row-index 列表（不要把 row WebElement 长期保存）
-        row_indices: list[int] = []
-        for r in get_visible_rows(driver):
-            try:
-                idx_str = r.get_attribute("row-index")
-            except StaleElementReferenceException:
-                continue
-            except Exception:
-                continue
-
-            if not idx_str:
-                continue
-            try:
-                row_indices.append(int(idx_str))
-            except ValueError:
-                continue
-
-        new_rows = 0
+                processed.add(key)
+                if only is not None and key not in only:
+                    continue
+                stats["seen"] += 1
+
+                if key.startswith("row-index:") and not warned_fallback:
+                    warned_fallback = True
+                    print(f"警告：未读到 entry id 列 {entry_id_col}，退回按 row-index 跟踪（表格重排时可能重复/遗漏）")
+
+                # 状态文件说已回填，还要表格里确实有分数才跳过（否则当作未处理，重新评分回填）
+                if index.is_done(key) and not rewrite and _has_score_text(info.get("score")):
+                    print(f"\n--- 跳过条目 {key}：之前已回填 {index.get(key).get('score')} ---")
+                    stats["skipped"] += 1
+                    if _RECORDER is not None:
+                        _RECORDER.add_done(key, index.get(key))
+                    continue
 
-        for idx in row_indices:
-            if idx in processed:
-                continue
+                _handle(key, info)
 
-            processed.add(idx)
-            new_rows += 1
+            index.flush()
+            if targets is not None and targets <= visited:
+                return
+            if only is not None and targets is None and only <= processed:
+                print("指定的条目都已处理，结束本轮扫描")
+                return
 
-            # 每次处理前都重新定位“新鲜”的 row 元素
-            try:
-                r = _find_center_row_by_index(idx)
-            except Exception:
-                continue
+            with profile_stage("scroll"):
+                is_bottom = driver.execute_script(
+                    "return arguments[0].scrollTop + arguments[0].clientHeight >= arguments[0].scrollHeight - 50;",
+                    viewport,
+                )
 
-            # 跳过：已有教师评分的行（field_11）
-            if skip_if_scored:
-                try:
-                    has_score, raw = _row_has_teacher_score(r, score_col_id=score_col_id)
-                except StaleElementReferenceException:
-                    try:
-                        r = _find_center_row_by_index(idx)
-                        has_score, raw = _row_has_teacher_score(r, score_col_id=score_col_id)
-                    except Exception:
-                        continue
+            if is_bottom and new_rows == 0:
+                if targets is None:
+                    print("已到底部，结束。总处理:", len(processed))
+                return
 
-                if has_score:
-                    print(f"\n--- 跳过第 {idx + 1} 份作业：已有教师评分 {raw} ---")
-                    continue
+            print("向下滚动加载更多...")
+            with profile_stage("scroll"):
+                driver.execute_script("arguments[0].scrollTop += arguments[0].clientHeight;", viewport)
+            _sleep(2)
 
-            print(f"\n--- 处理第 {idx + 1} 份作业 ---")
+    if only is None or only:
+        _scan()
 
+    # 失败条目延后重试：等待（指数退避）→ 刷新页面得到干净状态 → 从头扫描，只处理失败的条目
+    for round_no in range(1, retry_rounds + 1):
+        if not failures:
+            break
+        wait_s = RETRY_BACKOFF_S * 2 ** (round_no - 1)
+        print(
+            f"\n===== 第 {round_no}/{retry_rounds} 轮重试：{len(failures)} 个失败条目，"
+            f"{wait_s:g}s 后刷新页面重试 ====="
+        )
+        _sleep(wait_s)
+        _reset_modal(driver)
+        try:
+            driver.refresh()
+            viewport = wait_for_grid(driver)
+        except Exception as e:
+            print("刷新页面失败，停止重试：", e)
+            break
+        _scan(targets=set(failures))
+
+    reconcile = RECONCILE if reconcile is None else reconcile
+    check = touched | set(verify or ())
+    if reconcile and check:
+        verification = {"checked": len(check), "requeued": 0}
+        rewrites = {"written": 0, "failed": 0}
+        final: dict[str, str] = {}
+        for round_no in range(RECONCILE_ROUNDS + 1):
+            # 刷新后读到的是服务端保存的值，而不是页面上可能没提交成功的临时状态
+            _reset_modal(driver)
             try:
-                downloaded = download_homework_file(driver, r, idx)
-            except StaleElementReferenceException:
-                # 行被重渲染：跳过本行，下一轮滚动/刷新时再碰到就会处理
-                print("行元素已失效（stale），跳过本行，继续...")
-                continue
+                driver.refresh()
+                viewport = wait_for_grid(driver)
+            except Exception as e:
+                print("刷新页面失败，跳过回填核对：", e)
+                break
+            with profile_stage("reconcile"):
+                observed = read_grid_scores(driver, viewport, check, entry_id_col, score_col_id)
+            ok, bad, missing = verify_writebacks(index, check, observed)
+            final.update({k: "ok" for k in ok})
+            final.update({b["key"]: "mismatch" for b in bad})
+            final.update({k: "missing" for k in missing})
+            if round_no == 0:
+                verification["first_pass_rate"] = round(len(ok) / len(check), 4)
+            verification["mismatched"] = bad
+            if not bad or round_no == RECONCILE_ROUNDS:
+                break
+            print(f"\n===== 回填核对：{len(bad)} 个条目的教师评分与应填不一致，只重新回填这些 =====")
+            for b in bad:
+                print(f"  {b['key']}：应为 {b['expected']}，实际 {b['actual'] or '空'}")
+            verification["requeued"] += len(bad)
+            rewriting, rewrite_stats = True, rewrites
+            try:
+                _scan(targets={b["key"] for b in bad}, counter="requeued")
+            finally:
+                rewriting, rewrite_stats = rewrite, stats
+            check = {b["key"] for b in bad}
+
+        verification["rewritten"] = rewrites["written"]
+        if final:
+            verified = sum(1 for v in final.values() if v == "ok")
+            verification.update(
+                {
+                    "verified": verified,
+                    "missing": sorted(k for k, v in final.items() if v == "missing"),
+                    "rate": round(verified / len(final), 4),
+                }
+            )
+            verification["mismatched"] = [b for b in verification.get("mismatched", []) if final.get(b["key"]) == "mismatch"]
+            print(
+                f"回填核对：{verification['checked']} 个条目，一致 {verified}（首轮通过率 {verification['first_pass_rate']:.1%}，"
+                f"最终 {verification['rate']:.1%}），重新回填 {verification['requeued']}（成功 {verification['rewritten']}），"
+                f"仍不一致 {len(verification['mismatched'])}，表格中未找到 {len(verification['missing'])}"
+            )
+        stats["verification"] = verification
 
-            if not downloaded:
-                print("下载失败，跳过")
-                continue
+    # 回填核对里重新回填失败的条目也算仍失败，所以放在核对之后统计
+    still_failing = [
+        {"key": key, "reason": reason, "attempts": index.get(key).get("attempts") or 0}
+        for key, reason in sorted(failures.items())
+    ]
+    stats["failed"] = len(still_failing)
+    stats["still_failing"] = still_failing
+    if still_failing:
+        print(f"\n仍失败 {len(still_failing)} 个条目（下次可用 --only-failed 只重跑这些）：")
+        for item in still_failing:
+            print(f"  {item['key']}：{item['reason']}（累计失败 {item['attempts']} 次）")
+
+    index.flush()
+    return processed
 
-            cpp_code = read_cpp_file(downloaded)
-            if not cpp_code:
-                print("读取失败（可能下载到的不是源码文件），跳过")
-                continue
 
-            score, comment = score_homework_with_ai(cpp_code)
-            if not score:
-                print("评分失败，跳过：", comment)
-                continue
+# ---------------------------------------------------------------------------
+# 浏览器生命周期：长时间运行时按行数 / JS 内存 / 单行耗时漂移，定期重载页面或重启 Chrome
+# ---------------------------------------------------------------------------
 
-            print("score =", score)
-            print("comment =", comment)
 
-            try:
-                fill_score_and_comment(driver, r, score, comment)
-            except StaleElementReferenceException:
-                # 提交/关闭弹窗后 grid 重渲染是正常的，忽略即可
-                print("回填后行元素变 stale（正常），继续...")
+def _median(values):
+    values = sorted(values)
+    if not values:
+        return None
+    mid = len(values) // 2
+    return values[mid] if len(values) % 2 else (values[mid - 1] + values[mid]) / 2
 
-        is_bottom = driver.execute_script(
-            "return arguments[0].scrollTop + arguments[0].clientHeight >= arguments[0].scrollHeight - 50;",
-            viewport,
-        )
 
-        if is_bottom and new_rows == 0:
-            print("已到底部，结束。总处理:", len(processed))
-            break
+class BrowserLifecycle:
+    """跟踪浏览器“变慢”的迹象，必要时回收，并回到原来的表格位置继续。
 
-        print("向下滚动加载更多...")
-        driver.execute_script("arguments[0].scrollTop += arguments[0].clientHeight;", viewport)
-        time.sleep(2)
+    - 触发条件（任一满足）：
+      rows：距上次回收已处理 max_rows 行
+      memory：DevTools Performance.getMetrics 的 JSHeapUsedSize 超过 max_heap_mb（每 check_every 行查一次）
+      drift：最近 window 行的耗时中位数超过开头 window 行中位数的 drift 倍
+    - 回收方式：mode="reload" 只刷新页面（DOM/监听器/JS 堆清零）；mode="restart" 退出 Chrome 重新启动，
+      复制会话 cookie 后打开原地址
+    - 回收后重新 wait_for_grid，并把表格滚回原来的 scrollTop；已处理集合不变，不会重复处理
 
-    return processed
+    driver 属性始终是当前可用的浏览器（restart 后会换成新实例，调用方退出时应 quit 这个）。
+    """
 
+    def __init__(
+        self,
+        driver,
+        download_dir=None,
+        mode="reload",
+        columns=None,
+        max_rows=150,
+        max_heap_mb=600,
+        drift=2.0,
+        window=10,
+        check_every=5,
+    ):
+        self.driver = driver
+        self.download_dir = download_dir
+        self.mode = mode
+        self.columns = columns  # restart 时新浏览器沿用原来的精简列
+        self.max_rows = int(max_rows or 0)
+        self.max_heap_mb = float(max_heap_mb or 0)
+        self.drift = float(drift or 0)
+        self.window = max(1, int(window))
+        self.check_every = max(1, int(check_every))
+        self.rows = 0
+        self.rows_since = 0
+        self.baseline: list[float] = []
+        self.recent: list[float] = []
+        self.recycles: list[dict] = []
+        self.last_metrics: dict = {}
+        self._perf_enabled = False
+
+    @classmethod
+    def from_env(cls, driver, download_dir=None, columns=None):
+        """按 BROWSER_RECYCLE 等环境变量创建；BROWSER_RECYCLE=off 时返回 None。"""
+        if BROWSER_RECYCLE == "off":
+            return None
+        return cls(
+            driver,
+            download_dir=download_dir,
+            mode=BROWSER_RECYCLE,
+            columns=columns,
+            max_rows=BROWSER_RECYCLE_ROWS,
+            max_heap_mb=BROWSER_MAX_HEAP_MB,
+            drift=BROWSER_DRIFT,
+        )
+
+    def metrics(self) -> dict:
+        """读当前页面的 JS 堆（MB）、DOM 节点数、事件监听器数；取不到时返回空字典。"""
+        try:
+            if not self._perf_enabled:
+                self.driver.execute_cdp_cmd("Performance.enable", {})
+                self._perf_enabled = True
+            raw = self.driver.execute_cdp_cmd("Performance.getMetrics", {}) or {}
+        except Exception:
+            return {}
+        values = {m.get("name"): m.get("value") for m in raw.get("metrics") or []}
+        if "JSHeapUsedSize" not in values:
+            return {}
+        self.last_metrics = {
+            "heap_mb": round(values["JSHeapUsedSize"] / 1024 / 1024, 1),
+            "nodes": int(values.get("Nodes") or 0),
+            "listeners": int(values.get("JSEventListeners") or 0),
+        }
+        return self.last_metrics
+
+    def after_row(self, seconds):
+        """记录一行的耗时，返回需要回收的原因（rows/memory/drift），不需要时返回 None。"""
+        self.rows += 1
+        self.rows_since += 1
+        if len(self.baseline) < self.window:
+            self.baseline.append(seconds)
+        else:
+            self.recent = (self.recent + [seconds])[-self.window :]
+
+        if self.max_rows and self.rows_since >= self.max_rows:
+            return "rows"
+        if self.max_heap_mb and self.rows_since % self.check_every == 0:
+            m = self.metrics()
+            if m and m["heap_mb"] >= self.max_heap_mb:
+                return "memory"
+        if self.drift and len(self.recent) >= self.window:
+            base = _median(self.baseline)
+            if base and _median(self.recent) > base * self.drift:
+                return "drift"
+        return None
+
+    def recycle(self, viewport, reason):
+        """按 mode 回收浏览器，回到原来的表格位置。返回 (driver, viewport)。"""
+        start = time.perf_counter()
+        url = self.driver.current_url
+        before = self.last_metrics or self.metrics()
+        try:
+            scroll_top = self.driver.execute_script("return arguments[0].scrollTop;", viewport) or 0
+        except Exception:
+            scroll_top = 0
+        recent = _median(self.recent)
+        print(
+            f"\n浏览器回收（{reason}，已处理 {self.rows_since} 行，{before or '无内存数据'}），"
+            f"方式 {self.mode}，回收后回到 scrollTop={scroll_top}"
+        )
+
+        if self.mode == "restart":
+            old = self.driver
+            new = setup_driver(download_dir=self.download_dir, columns=self.columns)
+            try:
+                _copy_session_cookies(old, new, url)
+            finally:
+                try:
+                    old.quit()
+                except Exception:
+                    pass
+            self.driver = new
+            self._perf_enabled = False
+        else:
+            self.driver.refresh()
+
+        viewport = wait_for_grid(self.driver)
+        _restore_scroll(self.driver, viewport, scroll_top)
+
+        self.recycles.append(
+            {
+                "row": self.rows,
+                "reason": reason,
+                "mode": self.mode,
+                "before": before,
+                "after": self.metrics(),
+                "recent_row_s": round(recent, 3) if recent is not None else None,
+                "baseline_row_s": round(_median(self.baseline) or 0, 3),
+                "seconds": round(time.perf_counter() - start, 2),
+            }
+        )
+        self.rows_since = 0
+        self.recent = []
+        return self.driver, viewport
+
+    def report(self) -> dict:
+        return {
+            "mode": self.mode,
+            "rows": self.rows,
+            "recycles": self.recycles,
+            "baseline_row_s": round(_median(self.baseline) or 0, 3),
+            "last_metrics": self.last_metrics,
+        }
+
+
+def _restore_scroll(driver, viewport, target, attempts=20):
+    """把表格滚回 target（虚拟滚动的高度可能还没撑开，逐次重设直到到位或到底）。"""
+    if not target:
+        return
+    for _ in range(attempts):
+        reached = driver.execute_script(
+            "arguments[0].scrollTop = arguments[1];"
+            "var v = arguments[0];"
+            "return v.scrollTop >= arguments[1] - 5 || v.scrollTop + v.clientHeight >= v.scrollHeight - 5;",
+            viewport,
+            target,
+        )
+        _sleep(0.5)
+        if reached:
+            return
+
+
+# ---------------------------------------------------------------------------
+# 模型分级：便宜模型先评，拿不准（低置信度 / 分数范围过宽 / 临界分 / 自相矛盾）再交给强模型
+# ---------------------------------------------------------------------------
+
+_CASCADE_INSTRUCTION = """
+
+另外，在回复最后单独输出两行（供自动复核使用，不算评语）：
+置信度: <0 到 1 之间的小数，表示你对这个分数有多确定>
+分数范围: <你认为合理的最低分>-<最高分>
+"""
+
+_CONFIDENCE_RE = re.compile(r"^\s*(?:置信度|confidence)\s*[:：]\s*(\d+(?:\.\d+)?)", re.I)
+_RANGE_RE = re.compile(
+    r"^\s*(?:分数范围|range)\s*[:：]\s*(\d+(?:\.\d+)?)\s*(?:-|~|～|到|至)\s*(\d+(?:\.\d+)?)", re.I
+)
+
+
+def _parse_cascade_response(text):
+    """便宜模型的回复 → (分数, 评语, 置信度, (最低分, 最高分))；缺失的字段为 None。"""
+    confidence = None
+    score_range = None
+    rest = []
+    for line in (text or "").split("\n"):
+        m = _CONFIDENCE_RE.match(line)
+        if m:
+            confidence = float(m.group(1))
+            if confidence > 1:  # 有的模型会写成百分数
+                confidence /= 100
+            continue
+        m = _RANGE_RE.match(line)
+        if m:
+            low, high = float(m.group(1)), float(m.group(2))
+            score_range = (min(low, high), max(low, high))
+            continue
+        rest.append(line)
+    score, comment = _parse_score_response("\n".join(rest))
+    return score, comment, confidence, score_range
+
+
+class ModelCascade:
+    """两级评分策略，接口与 score_homework_with_ai 相同，可直接作为 scorer 使用。
+
+    - 先用 cheap_model 评分，并要求它给出置信度和分数范围
+    - 以下情况升级到强模型（调用时传入的 model，默认 MODEL_NAME）重新评分：
+      unparsed（没解析出分数）、low_confidence（置信度 < min_confidence 或没给）、
+      wide_range（分数范围宽度 > max_spread）、borderline（分数距 borderline 中任一临界分 ≤ margin）、
+      inconsistent（分数不在它自己给的范围内）
+    - 强模型失败时退回便宜模型的分数（有的话）
+    - 强模型请求与不分级时完全相同，录制/回放、缓存都不受影响
+    """
+
+    def __init__(
+        self, cheap_model, min_confidence=0.7, max_spread=1.0, borderline=(), margin=1.0
+    ):
+        self.cheap_model = cheap_model
+        self.min_confidence = float(min_confidence)
+        self.max_spread = float(max_spread)
+        self.borderline = [float(b) for b in borderline or ()]
+        self.margin = float(margin)
+        self._lock = threading.Lock()
+        self.rows = 0
+        self.escalated = 0
+        self.fallbacks = 0
+        self.reasons: dict[str, int] = {}
+        self.latency = {"cheap": [], "strong": []}
+        self.tokens = {"cheap": 0, "strong": 0}
+        self._direct_tokens = 0  # 便宜模型直接定分的那些请求用掉的 token
+
+    @classmethod
+    def from_config(cls, cfg):
+        """任务文件 / 环境变量里的配置 → ModelCascade；cfg 为空或没有 model 时返回 None。"""
+        if not cfg or not cfg.get("model"):
+            return None
+        borderline = cfg.get("borderline") or ()
+        if isinstance(borderline, str):
+            borderline = [b for b in re.split(r"[,\s]+", borderline) if b]
+        return cls(
+            cfg["model"],
+            min_confidence=cfg.get("min_confidence", 0.7),
+            max_spread=cfg.get("max_spread", 1.0),
+            borderline=borderline,
+            margin=cfg.get("margin", 1.0),
+        )
+
+    def config(self) -> dict:
+        return {
+            "model": self.cheap_model,
+            "min_confidence": self.min_confidence,
+            "max_spread": self.max_spread,
+            "borderline": self.borderline,
+            "margin": self.margin,
+        }
+
+    def _escalation_reason(self, score, confidence, score_range):
+        if not score:
+            return "unparsed"
+        value = float(score)
+        if score_range and not (score_range[0] <= value <= score_range[1]):
+            return "inconsistent"
+        if confidence is None or confidence < self.min_confidence:
+            return "low_confidence"
+        if score_range and score_range[1] - score_range[0] > self.max_spread:
+            return "wide_range"
+        if any(abs(value - b) <= self.margin for b in self.borderline):
+            return "borderline"
+        return None
+
+    def score(self, cpp_code, criteria=None, model=None):
+        if not API_KEY and _MODEL_CLIENT_FACTORY is None:
+            return None, "缺少 AI_API_KEY（环境变量/.env）"
+        if not cpp_code or not cpp_code.strip():
+            return None, "文件内容为空"
+
+        criteria = criteria or SCORING_CRITERIA
+        user = f"请评分以下C++代码：\n{cpp_code}"
+        try:
+            text, cheap_tokens, cheap_s = _call_model(
+                self.cheap_model, criteria + _CASCADE_INSTRUCTION, user
+            )
+            score, comment, confidence, score_range = _parse_cascade_response(text)
+        except Exception as e:
+            score, comment, confidence, score_range = None, f"评分异常：{e}", None, None
+            cheap_tokens, cheap_s = 0, 0.0
+
+        reason = self._escalation_reason(score, confidence, score_range)
+        _record("cascade", {"cheap": score, "confidence": confidence, "range": score_range, "escalated": reason})
+        with self._lock:
+            self.rows += 1
+            self.latency["cheap"].append(cheap_s)
+            self.tokens["cheap"] += cheap_tokens
+            if reason is None:
+                self._direct_tokens += cheap_tokens
+                return score, comment
+            self.escalated += 1
+            self.reasons[reason] = self.reasons.get(reason, 0) + 1
+
+        print(f"便宜模型 {self.cheap_model} 给分 {score}（{reason}），升级到 {model or MODEL_NAME} 复评")
+        try:
+            text, strong_tokens, strong_s = _call_model(model or MODEL_NAME, criteria, user)
+            strong_score, strong_comment = _parse_score_response(text)
+        except Exception as e:
+            strong_score, strong_comment, strong_tokens, strong_s = None, f"评分异常：{e}", 0, 0.0
+
+        with self._lock:
+            self.latency["strong"].append(strong_s)
+            self.tokens["strong"] += strong_tokens
+            if not strong_score and score:
+                self.fallbacks += 1
+        if not strong_score and score:
+            print("强模型评分失败，退回便宜模型的分数：", strong_comment)
+            return score, comment
+        return strong_score, strong_comment
+
+    def report(self) -> dict:
+        """升级率、两级耗时与 token。
+
+        “全部用强模型”的耗时按强模型平均耗时估算；省下的强模型 token 按强模型每次平均用量
+        × 未升级份数估算（还没有强模型请求时，按同一提示词的便宜模型用量估算）。
+        """
+        with self._lock:
+            cheap, strong = self.latency["cheap"], self.latency["strong"]
+            total_s = sum(cheap) + sum(strong)
+            strong_avg = sum(strong) / len(strong) if strong else None
+            direct = self.rows - self.escalated
+            if strong and self.tokens["strong"]:
+                avoided = round(self.tokens["strong"] / len(strong) * direct)
+            else:
+                avoided = self._direct_tokens
+            return {
+                "config": self.config(),
+                "rows": self.rows,
+                "escalated": self.escalated,
+                "escalation_rate": round(self.escalated / self.rows, 3) if self.rows else 0.0,
+                "reasons": dict(self.reasons),
+                "fallbacks": self.fallbacks,
+                "latency_s": {
+                    "cheap_avg": round(sum(cheap) / len(cheap), 3) if cheap else None,
+                    "strong_avg": round(strong_avg, 3) if strong_avg is not None else None,
+                    "per_row_avg": round(total_s / self.rows, 3) if self.rows else None,
+                    "strong_only_per_row_est": round(strong_avg, 3) if strong_avg is not None else None,
+                },
+                "tokens": dict(self.tokens, strong_avoided_est=avoided),
+            }
+
+    def print_report(self):
+        print(_cascade_summary(self.report()))
+
+
+def _cascade_summary(r) -> str:
+    lat = r["latency_s"]
+    return (
+        f"模型分级：{r['rows']} 份，升级 {r['escalated']} 份（{r['escalation_rate']:.0%}），"
+        f"原因 {r['reasons'] or '-'}；每份平均耗时 {lat['per_row_avg']}s"
+        f"（全用强模型约 {lat['strong_only_per_row_est']}s）；"
+        f"token 便宜 {r['tokens']['cheap']} / 强 {r['tokens']['strong']}，"
+        f"约省强模型 token {r['tokens']['strong_avoided_est']}"
+    )
+
+
+def _cascade_from_env():
+    return ModelCascade.from_config(
+        {
+            "model": CASCADE_MODEL,
+            "min_confidence": CASCADE_MIN_CONFIDENCE,
+            "max_spread": CASCADE_MAX_SPREAD,
+            "borderline": CASCADE_BORDERLINE,
+            "margin": CASCADE_MARGIN,
+        }
+    )
+
+
+def _strategy_from_env():
+    """按环境变量选评分策略：模型分级优先，其次多次采样；都没开时返回 None（单次评分）。"""
+    return _cascade_from_env() or ConsistentScorer.from_config(SCORE_SAMPLES, SCORE_SAMPLES_MODE)
+
+
+# ---------------------------------------------------------------------------
+# 多次采样评分：一次请求拿多份独立评分（n 参数或提示词内多次判断），取中位数/多数，方差作置信度
+# ---------------------------------------------------------------------------
+
+_MULTI_JUDGE_INSTRUCTION = """
+
+本次请做 {n} 次相互独立的评分判断（每次都重新从头审视代码，不要参照前一次的结论），
+不要输出其它内容，只输出如下 JSON：
+{{"judgments": [{{"score": 分数, "comment": "简短评语"}}, ...]}}
+"""
+
+
+def _parse_judgments(text):
+    """解析提示词内多次判断的 JSON，返回 [(分数, 评语)]；解析不了时按普通单次回复处理。"""
+    m = re.search(r"\{.*\}", text or "", re.S)
+    if m:
+        try:
+            items = json.loads(m.group()).get("judgments") or []
+            out = []
+            for item in items:
+                score = re.search(r"\d+(?:\.\d+)?", str(item.get("score", "")))
+                if score:
+                    out.append((score.group(), str(item.get("comment") or "").strip()))
+            if out:
+                return out
+        except (ValueError, AttributeError):
+            pass
+    score, comment = _parse_score_response(text)
+    return [(score, comment)] if score else []
+
+
+def _aggregate_samples(samples):
+    """多份 (分数, 评语) → (最终分数, 评语, 明细)。
+
+    过半数一致时取多数分，否则取中位数；评语取与最终分数最接近的那份。
+    置信度 = 1 / (1 + 方差)，全部一致时为 1。
+    """
+    values = [float(s) for s, _ in samples]
+    counts: dict[float, int] = {}
+    for v in values:
+        counts[v] = counts.get(v, 0) + 1
+    top, top_n = max(counts.items(), key=lambda kv: (kv[1], -abs(kv[0] - _median(values))))
+    final = top if top_n * 2 > len(values) else _median(values)
+    mean = sum(values) / len(values)
+    variance = sum((v - mean) ** 2 for v in values) / len(values)
+    comment = min(samples, key=lambda s: abs(float(s[0]) - final))[1]
+    score = f"{final:g}"
+    detail = {
+        "scores": [f"{v:g}" for v in values],
+        "final": score,
+        "variance": round(variance, 3),
+        "confidence": round(1 / (1 + variance), 3),
+        "agreement": round(sum(1 for v in values if v == final) / len(values), 3),
+    }
+    return score, comment, detail
+
+
+class ConsistentScorer:
+    """一致性评分：一次请求取 samples 份独立评分再聚合，代替对临界作业的反复重跑。
+
+    - mode="n"：用接口的 n 参数一次生成多份回复（提示词与单次评分相同）；接口不支持 n 时自动改用 json
+    - mode="json"：提示词里要求模型输出 samples 次独立判断的 JSON
+    - 置信度低于 low_confidence 的条目列进报表（请人工复核，而不是再跑一遍）
+    - 报表里对比单次评分：token 按“提示词一份 + 回复按份数均摊”估算单次用量
+    """
+
+    def __init__(self, samples=3, mode="n", low_confidence=0.5):
+        self.samples = max(2, int(samples))
+        self.mode = mode if mode in ("n", "json") else "n"
+        self.low_confidence = float(low_confidence)
+        self._lock = threading.Lock()
+        self.rows = 0
+        self.latency: list[float] = []
+        self.tokens = {"prompt": 0, "completion": 0}
+        self.confidences: list[float] = []
+        self.unstable: list[dict] = []
+        self.fallbacks = 0
+        # 接口不支持 n 时记下来，之后直接走提示词内多次判断；mode 本身不变（缓存键/报表里的配置保持一致）
+        self._n_unsupported = False
+
+    @classmethod
+    def from_config(cls, samples, mode=None):
+        """samples ≤ 1 时返回 None（单次评分）。"""
+        if not samples or int(samples) <= 1:
+            return None
+        return cls(samples, mode=mode or "n")
+
+    def config(self) -> dict:
+        return {"samples": self.samples, "mode": self.mode}
+
+    def _request(self, model, criteria, user):
+        if self.mode == "n" and not self._n_unsupported:
+            try:
+                resp, usage, seconds = _chat(model, criteria, user, n=self.samples)
+                texts = [c.message.content for c in resp.choices]
+                samples = [s for s in (_parse_score_response(t) for t in texts) if s[0]]
+                return samples, usage, seconds
+            except Exception as e:
+                # 多数网关对不支持的参数直接报 400（openai.BadRequestError）：之后都改用提示词内多次判断。
+                # 超时、限流、5xx 等与 n 无关，照常抛出，这一行评分失败后进重试队列
+                if getattr(e, "status_code", None) != 400:
+                    raise
+                print("带 n 参数的请求失败，改为提示词内多次判断：", e)
+                with self._lock:
+                    self._n_unsupported = True
+                    self.fallbacks += 1
+        resp, usage, seconds = _chat(
+            model, criteria + _MULTI_JUDGE_INSTRUCTION.format(n=self.samples), user
+        )
+        return _parse_judgments(resp.choices[0].message.content), usage, seconds
+
+    def score(self, cpp_code, criteria=None, model=None):
+        if not API_KEY and _MODEL_CLIENT_FACTORY is None:
+            return None, "缺少 AI_API_KEY（环境变量/.env）"
+        if not cpp_code or not cpp_code.strip():
+            return None, "文件内容为空"
+
+        try:
+            samples, usage, seconds = self._request(
+                model or MODEL_NAME, criteria or SCORING_CRITERIA, f"请评分以下C++代码：\n{cpp_code}"
+            )
+        except Exception as e:
+            return None, f"评分异常：{e}"
+        if not samples:
+            return None, "多次采样均未解析出分数"
+        score, comment, detail = _aggregate_samples(samples)
+        _record("samples", detail)
+        with self._lock:
+            self.rows += 1
+            self.latency.append(seconds)
+            self.tokens["prompt"] += usage.get("prompt", 0)
+            self.tokens["completion"] += usage.get("completion", 0)
+            self.confidences.append(detail["confidence"])
+            if detail["confidence"] < self.low_confidence:
+                self.unstable.append(
+                    {
+                        "code_sha": hashlib.sha256(cpp_code.encode("utf-8", "replace")).hexdigest()[:12],
+                        **detail,
+                    }
+                )
+        if detail["confidence"] < self.low_confidence:
+            print(f"多次采样分歧较大：{detail['scores']} → {score}（置信度 {detail['confidence']}），建议人工复核")
+        return score, comment
+
+    def report(self) -> dict:
+        with self._lock:
+            rows = self.rows or 1
+            single_tokens = self.tokens["prompt"] + self.tokens["completion"] / self.samples
+            total_tokens = self.tokens["prompt"] + self.tokens["completion"]
+            return {
+                "config": self.config(),
+                "rows": self.rows,
+                "fallbacks": self.fallbacks,
+                "n_unsupported": self._n_unsupported,
+                "latency_s_avg": round(sum(self.latency) / rows, 3) if self.latency else None,
+                "tokens": dict(self.tokens, total=total_tokens),
+                "tokens_per_row": round(total_tokens / rows, 1),
+                "single_tokens_per_row_est": round(single_tokens / rows, 1),
+                "confidence_avg": round(sum(self.confidences) / rows, 3) if self.confidences else None,
+                "unstable": list(self.unstable),
+            }
+
+    def print_report(self):
+        print(_sampling_summary(self.report()))
+
+
+def _sampling_summary(r) -> str:
+    return (
+        f"多次采样（{r['config']['samples']} 份/{r['config']['mode']}）：{r['rows']} 份，平均置信度 {r['confidence_avg']}，"
+        f"分歧大 {len(r['unstable'])} 份；每份平均耗时 {r['latency_s_avg']}s，"
+        f"token {r['tokens_per_row']}/份（单次约 {r['single_tokens_per_row_est']}/份）"
+    )
+
+
+# ---------------------------------------------------------------------------
+# 多表单调度：一个任务文件列出多个表单，一次登录、共享评分并发上限与缓存
+# ---------------------------------------------------------------------------
+
+
+@dataclass
+class FormJob:
+    """任务文件里的一个表单（列 id / 评分标准 / 模型都可以按表单覆盖）。"""
+
+    name: str
+    url: str
+    detail_col_id: str = "field_5"
+    score_col_id: str = "field_11"
+    id_col: str = ENTRY_ID_COL
+    criteria: str = SCORING_CRITERIA
+    model: str = MODEL_NAME
+    pending: int | None = None
+    cascade: dict | bool | None = None  # None：任务文件没写，沿用环境变量；False：关闭
+    samples: int | None = None
+    samples_mode: str | None = None
+
+
+def load_job_file(path):
+    """读取任务文件，返回 (jobs, options)。
+
+    格式（JSON）：
+    {
+      "sessions": 1,             # 浏览器会话数（>1 时多窗口并行，只需登录第一个）
+      "scoring_workers": 4,      # 共享评分并发上限
+      "count_pending": true,     # 开始前是否扫描每个表单的待评分行数
+      "forms": [
+        {"name": "hw1", "url": "https://next.jinshuju.net/forms/xxxx/entries",
+         "detail_col": "field_5", "score_col": "field_11", "id_col": "serial_number",
+         "rubric": "...", "rubric_file": "rubrics/hw1.txt", "model": "gpt-5-mini",
+         "pending": 30,
+         "cascade": {"model": "gpt-5-nano", "min_confidence": 0.7, "max_spread": 1,
+                     "borderline": [6], "margin": 1},
+         "samples": 3, "samples_mode": "n"}
+      ],
+      "cascade": {...},          # 所有表单默认的模型分级；表单里写 "cascade": false 关闭
+      "samples": 3               # 所有表单默认的采样份数（1 = 单次评分）；同时配了 cascade 时以 cascade 为准
+    }
+    也可以直接写成 forms 数组。rubric_file 相对任务文件所在目录。
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+
+    if isinstance(raw, list):
+        raw = {"forms": raw}
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    jobs: list[FormJob] = []
+    for i, item in enumerate(raw.get("forms") or [], start=1):
+        url = (item.get("url") or "").strip()
+        if not url:
+            raise ValueError(f"任务文件第 {i} 个表单缺少 url")
+
+        cascade = item.get("cascade", raw.get("cascade"))
+        if cascade and not cascade.get("model"):
+            raise ValueError(f"任务文件第 {i} 个表单的 cascade 缺少 model（便宜模型）")
+
+        criteria = item.get("rubric")
+        if not criteria and item.get("rubric_file"):
+            rubric_path = os.path.join(base_dir, item["rubric_file"])
+            with open(rubric_path, "r", encoding="utf-8") as rf:
+                criteria = rf.read()
+
+        jobs.append(
+            FormJob(
+                name=item.get("name") or f"form{i}",
+                url=url,
+                detail_col_id=item.get("detail_col") or "field_5",
+                score_col_id=item.get("score_col") or "field_11",
+                id_col=item.get("id_col") or ENTRY_ID_COL,
+                criteria=criteria or SCORING_CRITERIA,
+                model=item.get("model") or MODEL_NAME,
+                pending=item.get("pending"),
+                cascade=cascade,
+                samples=item.get("samples", raw.get("samples")),
+                samples_mode=item.get("samples_mode", raw.get("samples_mode")),
+            )
+        )
+
+    if not jobs:
+        raise ValueError(f"任务文件中没有表单：{path}")
+
+    options = {k: v for k, v in raw.items() if k != "forms"}
+    return jobs, options
+
+
+class ScoringPool:
+    """跨表单/跨会话共享的评分缓存 + 并发上限。
+
+    评分在调用方线程里同步完成（调用方要拿分数去回填，没有可重叠的工作），这里不另开线程池：
+    - 并发上限由 max_workers 控制（多个浏览器会话共用一个信号量，避免打爆 API）
+    - 缓存键 = 模型 + 评分标准 + 源码；同一份源码重复提交只调用一次模型，
+      正在评分中的同一份源码由后来者等待结果，不会重复请求
+    """
+
+    def __init__(self, max_workers=4, score_fn=None):
+        self._slots = threading.BoundedSemaphore(max(1, int(max_workers)))
+        self._score_fn = score_fn or score_homework_with_ai
+        self._cache = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.cache_hits = 0
+
+    @staticmethod
+    def _key(cpp_code, criteria, model, strategy=None):
+        h = hashlib.sha256()
+        tier = json.dumps(strategy.config(), sort_keys=True) if strategy else ""
+        for part in (model or MODEL_NAME, criteria or SCORING_CRITERIA, tier, cpp_code or ""):
+            h.update(part.encode("utf-8", errors="replace"))
+            h.update(b"\x00")
+        return h.hexdigest()
+
+    def score(self, cpp_code, criteria=None, model=None, strategy=None):
+        """strategy 为 ModelCascade / ConsistentScorer 时按该策略评分（缓存与单次评分的结果分开）。"""
+        key = self._key(cpp_code, criteria, model, strategy)
+        owner = False
+        with self._lock:
+            fut = self._cache.get(key)
+            if fut is not None:
+                self.cache_hits += 1
+            else:
+                self.calls += 1
+                fut = Future()
+                self._cache[key] = fut
+                owner = True
+
+        if owner:
+            score_fn = strategy.score if strategy is not None else self._score_fn
+            try:
+                with self._slots:
+                    fut.set_result(score_fn(cpp_code, criteria, model))
+            except Exception as e:
+                fut.set_exception(e)
+
+        try:
+            score, comment = fut.result()
+        except Exception as e:
+            score, comment = None, f"评分异常：{e}"
+
+        if not score:
+            # 失败结果不缓存，下次遇到同样的源码会重新请求
+            with self._lock:
+                if self._cache.get(key) is fut:
+                    del self._cache[key]
+        return score, comment
+
+
+def count_pending_rows(
+    driver, viewport, score_col_id="field_11", max_loops=9999, entry_id_col=None
+):
+    """只读地滚动一遍表格，统计教师评分列为空的行数。返回：(待评分行数, 总行数)。"""
+    seen: set[str] = set()
+    pending = 0
+
+    driver.execute_script("arguments[0].scrollTop = 0;", viewport)
+    _sleep(0.5)
+
+    for _ in range(max_loops):
+        new_rows = 0
+        for info in _visible_entries(driver, entry_id_col or ENTRY_ID_COL, score_col_id):
+            key = info.get("key")
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            new_rows += 1
+            if not _has_score_text(info.get("score")):
+                pending += 1
+
+        is_bottom = driver.execute_script(
+            "return arguments[0].scrollTop + arguments[0].clientHeight >= arguments[0].scrollHeight - 50;",
+            viewport,
+        )
+        if is_bottom and new_rows == 0:
+            break
+        driver.execute_script("arguments[0].scrollTop += arguments[0].clientHeight;", viewport)
+        _sleep(0.5)
+
+    driver.execute_script("arguments[0].scrollTop = 0;", viewport)
+    return pending, len(seen)
+
+
+def read_grid_scores(driver, viewport, keys, entry_id_col=None, score_col_id="field_11", max_loops=9999):
+    """从顶部只读地滚动一遍表格，读出 keys 里各条目的教师评分列文本；都找到后提前结束。"""
+    keys = set(keys)
+    observed: dict[str, str] = {}
+    seen: set[str] = set()
+
+    driver.execute_script("arguments[0].scrollTop = 0;", viewport)
+    _sleep(0.5)
+
+    for _ in range(max_loops):
+        new_rows = 0
+        for info in _visible_entries(driver, entry_id_col or ENTRY_ID_COL, score_col_id):
+            key = info.get("key")
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            new_rows += 1
+            if key in keys:
+                observed[key] = info.get("score") or ""
+        if keys <= observed.keys():
+            break
+
+        is_bottom = driver.execute_script(
+            "return arguments[0].scrollTop + arguments[0].clientHeight >= arguments[0].scrollHeight - 50;",
+            viewport,
+        )
+        if is_bottom and new_rows == 0:
+            break
+        driver.execute_script("arguments[0].scrollTop += arguments[0].clientHeight;", viewport)
+        _sleep(0.5)
+
+    driver.execute_script("arguments[0].scrollTop = 0;", viewport)
+    return observed
+
+
+def _find_entry_list(data, id_col):
+    """在导出/抓取的 JSON 里找出条目列表（含 id_col 字段的 dict 列表），找不到返回 []。"""
+    if isinstance(data, list):
+        if any(isinstance(item, dict) and id_col in item for item in data):
+            return data
+        children = data
+    elif isinstance(data, dict):
+        children = data.values()
+    else:
+        return []
+    for child in children:
+        found = _find_entry_list(child, id_col)
+        if found:
+            return found
+    return []
+
+
+def _cell_text(value) -> str:
+    if isinstance(value, dict):
+        for k in ("text", "label", "name", "value"):
+            if value.get(k) is not None:
+                return _cell_text(value[k])
+        return ""
+    if isinstance(value, list):
+        return ",".join(_cell_text(v) for v in value)
+    return "" if value is None else str(value).strip()
+
+
+def load_entries_json(path, id_col=None, score_col_id="field_11"):
+    """读取抓取/导出的表单条目 JSON（如 DevTools 里保存的 entries 接口响应），返回 entry id → 教师评分列文本。"""
+    id_col = id_col or ENTRY_ID_COL
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    observed = {}
+    for item in _find_entry_list(data, id_col):
+        if isinstance(item, dict) and item.get(id_col) is not None:
+            observed[_cell_text(item[id_col])] = _cell_text(item.get(score_col_id))
+    return observed
+
+
+def _copy_session_cookies(src, dst, url):
+    """把已登录会话的 cookie 复制到另一个浏览器，避免每个窗口都手动登录。"""
+    dst.get(url)
+    for c in src.get_cookies():
+        c = dict(c)
+        if c.get("sameSite") not in (None, "Strict", "Lax", "None"):
+            c.pop("sameSite", None)
+        try:
+            dst.add_cookie(c)
+        except Exception:
+            continue
+    dst.get(url)
+
+
+def _job_strategy(job: FormJob):
+    """表单的评分策略，返回 (cascade, sampler)，至多一个不为 None。
+
+    任务文件没配置的，与单表单模式一样沿用环境变量（CASCADE_MODEL / SCORE_SAMPLES）。
+    """
+    cascade = _cascade_from_env() if job.cascade is None else ModelCascade.from_config(job.cascade or None)
+    samples = SCORE_SAMPLES if job.samples is None else job.samples
+    sampler = None
+    if cascade is None:
+        sampler = ConsistentScorer.from_config(samples, job.samples_mode or SCORE_SAMPLES_MODE)
+    return cascade, sampler
+
+
+def run_form_job(
+    driver, job: FormJob, pool: ScoringPool, download_dir=None, lifecycle=None, only_failed=False
+):
+    """在给定浏览器会话里处理一个表单，返回该表单的吞吐统计。
+
+    传入 lifecycle 时由它提供浏览器（长时间运行中可能被重启换新）。
+    only_failed=True 时只重跑状态文件里上次仍失败的条目。
+    """
+    if lifecycle is not None:
+        driver = lifecycle.driver
+    print(f"\n===== 表单 {job.name}：{job.url} =====")
+    stats: dict = {}
+    start = time.time()
+    error = ""
+    cascade, sampler = _job_strategy(job)
+    strategy = cascade or sampler
+    scorer = pool.score
+    if strategy is not None:
+        scorer = lambda code, criteria=None, model=None: pool.score(code, criteria, model, strategy=strategy)
+    index = EntryIndex(_state_path(job.url))
+    only = index.failed_keys() if only_failed else None
+    if only is not None and not only:
+        print("该表单没有失败的条目，跳过")
+    else:
+        try:
+            driver.get(job.url)
+            viewport = wait_for_grid(driver)
+            process_all_visible_then_scroll(
+                driver,
+                viewport,
+                score_col_id=job.score_col_id,
+                detail_col_id=job.detail_col_id,
+                criteria=job.criteria,
+                model=job.model,
+                scorer=scorer,
+                download_dir=download_dir,
+                stats=stats,
+                entry_id_col=job.id_col,
+                index=index,
+                lifecycle=lifecycle,
+                only=only,
+                strategy=strategy,
+            )
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            print(f"表单 {job.name} 处理中断：", error)
+        finally:
+            index.flush()
+
+    elapsed = time.time() - start
+    written = stats.get("written", 0)
+    return {
+        "form": job.name,
+        "url": job.url,
+        "model": job.model,
+        "pending": job.pending,
+        "seen": stats.get("seen", 0),
+        "skipped": stats.get("skipped", 0),
+        "scored": stats.get("scored", 0),
+        "written": written,
+        "failed": stats.get("failed", 0),
+        "retried": stats.get("retried", 0),
+        "recovered": stats.get("recovered", 0),
+        "still_failing": stats.get("still_failing", []),
+        "verification": stats.get("verification"),
+        "elapsed_s": round(elapsed, 1),
+        "written_per_min": round(written / elapsed * 60, 2) if elapsed > 0 else 0.0,
+        "cascade": cascade.report() if cascade is not None else None,
+        "sampling": sampler.report() if sampler is not None else None,
+        "browser_recycles": len(lifecycle.recycles) if lifecycle is not None else 0,
+        "error": error,
+    }
+
+
+def _write_report(prefix, data):
+    """把运行报表写到 REPORT_DIR/<prefix>-<时间戳>.json，返回文件路径。"""
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    path = os.path.join(REPORT_DIR, f"{prefix}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def _print_job_report(rows):
+    print("\n===== 多表单吞吐报表 =====")
+    print(f"{'表单':<16}{'待评':>6}{'已见':>6}{'跳过':>6}{'评分':>6}{'回填':>6}{'失败':>6}{'耗时s':>9}{'回填/分':>9}")
+    for r in rows:
+        pending = "-" if r["pending"] is None else r["pending"]
+        print(
+            f"{r['form']:<16}{pending:>6}{r['seen']:>6}{r['skipped']:>6}{r['scored']:>6}"
+            f"{r['written']:>6}{r['failed']:>6}{r['elapsed_s']:>9}{r['written_per_min']:>9}"
+        )
+        if r.get("cascade"):
+            print("  ", _cascade_summary(r["cascade"]))
+        if r.get("sampling"):
+            print("  ", _sampling_summary(r["sampling"]))
+        if r.get("still_failing"):
+            keys = ", ".join(f"{f['key']}({f['reason']})" for f in r["still_failing"][:10])
+            more = " ..." if len(r["still_failing"]) > 10 else ""
+            print(f"   重试 {r['retried']} 次、恢复 {r['recovered']} 个，仍失败：{keys}{more}")
+        v = r.get("verification")
+        if v and v.get("rate") is not None:
+            print(
+                f"   回填核对 {v['checked']} 个：首轮通过率 {v['first_pass_rate']:.1%}，重新回填 {v['requeued']}，"
+                f"最终 {v['rate']:.1%}"
+            )
+        if r.get("error"):
+            print("   中断原因：", r["error"])
+
+
+def run_jobs(job_path, only_failed=False):
+    """按任务文件批改多个表单（only_failed=True 时每个表单只重跑上次失败的条目）。
+
+    1) 启动 sessions 个浏览器（各自独立下载目录），只需在第一个窗口登录，cookie 自动复制
+    2) 扫描每个表单的待评分行数，按从多到少排序（多会话时负载更均衡）
+    3) 各会话从队列里取表单处理；评分统一走共享的 ScoringPool（并发上限 + 缓存）
+    4) 输出每个表单的吞吐报表，并写入 REPORT_DIR
+    """
+    jobs, options = load_job_file(job_path)
+    columns = _lean_columns(jobs)
+    sessions = max(1, min(int(options.get("sessions", 1)), len(jobs)))
+    pool = ScoringPool(max_workers=options.get("scoring_workers", 4))
+    drivers = []
+    lifecycles: dict[int, BrowserLifecycle] = {}
+    rows: list[dict] = []
+    run_start = time.time()
+
+    try:
+        for i in range(sessions):
+            d_dir = DOWNLOAD_DIR if sessions == 1 else os.path.join(DOWNLOAD_DIR, f"session{i + 1}")
+            os.makedirs(d_dir, exist_ok=True)
+            drivers.append((setup_driver(download_dir=d_dir, columns=columns), d_dir))
+
+        primary = drivers[0][0]
+        primary.get(jobs[0].url)
+        print("已打开页面：", jobs[0].url)
+        input("请在浏览器中完成登录（多会话时只需登录第一个窗口），然后回到这里按回车继续... ")
+        for d, _ in drivers[1:]:
+            _copy_session_cookies(primary, d, jobs[0].url)
+
+        if options.get("count_pending", True) and not only_failed:
+            for job in jobs:
+                if job.pending is not None:
+                    continue
+                try:
+                    primary.get(job.url)
+                    viewport = wait_for_grid(primary)
+                    job.pending, total = count_pending_rows(
+                        primary, viewport, job.score_col_id, entry_id_col=job.id_col
+                    )
+                    print(f"表单 {job.name}：待评分 {job.pending} / 共 {total} 行")
+                except Exception as e:
+                    print(f"表单 {job.name}：统计待评分行数失败（{e}），排到最后")
+
+        jobs.sort(key=lambda j: -1 if j.pending is None else j.pending, reverse=True)
+        work: queue.Queue = queue.Queue()
+        for job in jobs:
+            work.put(job)
+
+        rows_lock = threading.Lock()
+
+        for i, (d, d_dir) in enumerate(drivers, start=1):
+            lc = BrowserLifecycle.from_env(d, download_dir=d_dir, columns=columns)
+            if lc is not None:
+                lifecycles[i] = lc
+
+        def _session_worker(session_no, d, d_dir):
+            while True:
+                try:
+                    job = work.get_nowait()
+                except queue.Empty:
+                    return
+                row = run_form_job(
+                    d,
+                    job,
+                    pool,
+                    download_dir=d_dir,
+                    lifecycle=lifecycles.get(session_no),
+                    only_failed=only_failed,
+                )
+                row["session"] = session_no
+                with rows_lock:
+                    rows.append(row)
+
+        with profile_run():
+            if sessions == 1:
+                _session_worker(1, *drivers[0])
+            else:
+                threads = [
+                    threading.Thread(target=_session_worker, args=(i + 1, d, d_dir), daemon=True)
+                    for i, (d, d_dir) in enumerate(drivers)
+                ]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+    finally:
+        if _TIMER is not None:
+            _TIMER.save()
+        if drivers:
+            input("按回车关闭浏览器... ")
+        for i, (d, _) in enumerate(drivers, start=1):
+            d = lifecycles[i].driver if i in lifecycles else d
+            try:
+                d.quit()
+            except Exception:
+                pass
+
+    _print_job_report(rows)
+    print(f"模型调用 {pool.calls} 次，缓存命中 {pool.cache_hits} 次")
+    path = _write_report(
+        "jobs",
+        {
+            "job_file": os.path.abspath(job_path),
+            "sessions": sessions,
+            "elapsed_s": round(time.time() - run_start, 1),
+            "model_calls": pool.calls,
+            "cache_hits": pool.cache_hits,
+            "model_usage": _model_usage_report(),
+            "startup": STARTUP_TIMINGS,
+            "forms": rows,
+            "browsers": {i: lc.report() for i, lc in lifecycles.items()},
+            "timing": _TIMER.report() if _TIMER is not None else None,
+        },
+    )
+    print("报表已写入：", path)
+    return rows
+
+
+# ---------------------------------------------------------------------------
+# 录制 / 回放：RECORD_DIR 录下真实运行的页面与模型输入，`main.py replay` 离线重放
+# ---------------------------------------------------------------------------
+
+_RECORD_CTX = threading.local()
+
+
+def _safe_name(s) -> str:
+    return re.sub(r"[^\w.-]+", "_", str(s))[:80] or "_"
+
+
+class SessionRecorder:
+    """录制模式：按条目保存回放所需的全部输入。
+
+    目录结构：
+      <RECORD_DIR>/responses.jsonl               模型请求指纹 → 原始回复与耗时（所有表单共用）
+      <RECORD_DIR>/<表单id>/manifest.json         表单地址、列 id、模型、评分标准、每屏可见行快照
+      <RECORD_DIR>/<表单id>/rows/<序号>/row.json   单行：打开结果、下载入口、下载尝试、下拉选项、评分、结果
+      <RECORD_DIR>/<表单id>/rows/<序号>/...        modal.html、附件原始字节
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        self._forms: dict[str, dict] = {}
+        os.makedirs(root, exist_ok=True)
+
+    def _form(self):
+        return self._forms.get(getattr(_RECORD_CTX, "form", None))
+
+    def begin_form(self, url, **settings):
+        key = _form_key(url)
+        form_dir = os.path.join(self.root, key)
+        os.makedirs(os.path.join(form_dir, "rows"), exist_ok=True)
+        with self._lock:
+            self._forms[key] = {
+                "dir": form_dir,
+                "seq": 0,
+                "manifest": {"url": url, **settings, "snapshots": [], "done": {}},
+            }
+        _RECORD_CTX.form = key
+        self._save_manifest()
+
+    def _save_manifest(self):
+        form = self._form()
+        if form is None:
+            return
+        with self._lock:
+            with open(os.path.join(form["dir"], "manifest.json"), "w", encoding="utf-8") as f:
+                json.dump(form["manifest"], f, ensure_ascii=False, indent=2)
+
+    def add_snapshot(self, snapshot):
+        form = self._form()
+        if form is not None:
+            form["manifest"]["snapshots"].append(snapshot)
+            self._save_manifest()
+
+    def add_done(self, key, state):
+        """录制时因“之前已回填”跳过的条目，回放时预置到索引里保持同样的跳过决策。"""
+        form = self._form()
+        if form is not None:
+            form["manifest"]["done"][key] = state
+            self._save_manifest()
+
+    def begin_row(self, key, info):
+        form = self._form()
+        if form is None:
+            return
+        with self._lock:
+            form["seq"] += 1
+            seq = form["seq"]
+        row_dir = os.path.join(form["dir"], "rows", f"{seq:05d}-{_safe_name(key)}")
+        os.makedirs(row_dir, exist_ok=True)
+        _RECORD_CTX.row = {"key": key, "visible": info}
+        _RECORD_CTX.row_dir = row_dir
+
+    def end_row(self):
+        row = getattr(_RECORD_CTX, "row", None)
+        if row is None:
+            return
+        with open(os.path.join(_RECORD_CTX.row_dir, "row.json"), "w", encoding="utf-8") as f:
+            json.dump(row, f, ensure_ascii=False, indent=2)
+        _RECORD_CTX.row = None
+
+    def add_response(self, kwargs, text, latency):
+        line = json.dumps(
+            {"key": _model_request_key(kwargs), "text": text, "latency_s": round(latency, 3)},
+            ensure_ascii=False,
+        )
+        with self._lock:
+            with open(os.path.join(self.root, "responses.jsonl"), "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+class RecordingModelClient:
+    """包一层真实客户端，把每次回复写进录制目录。"""
+
+    def __init__(self, inner, recorder: SessionRecorder):
+        self._inner = inner
+        self._recorder = recorder
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        start = time.perf_counter()
+        resp = self._inner.chat.completions.create(**kwargs)
+        self._recorder.add_response(kwargs, resp.choices[0].message.content, time.perf_counter() - start)
+        return resp
+
+
+def _record(field, value):
+    row = getattr(_RECORD_CTX, "row", None)
+    if row is not None:
+        row[field] = value
+
+
+def _record_append(field, value):
+    row = getattr(_RECORD_CTX, "row", None)
+    if row is not None:
+        row.setdefault(field, []).append(value)
+
+
+def _record_stage(stage, seconds):
+    row = getattr(_RECORD_CTX, "row", None)
+    if row is not None:
+        stages = row.setdefault("stages", {})
+        stages[stage] = round(stages.get(stage, 0.0) + seconds, 3)
+
+
+def _record_file(src_path):
+    """把下载到的附件复制进当前行的录制目录，返回文件名（未在录制时返回 None）。"""
+    if getattr(_RECORD_CTX, "row", None) is None or not src_path:
+        return None
+    name = os.path.basename(src_path)
+    try:
+        shutil.copyfile(src_path, os.path.join(_RECORD_CTX.row_dir, name))
+    except OSError:
+        return None
+    return name
+
+
+def _record_text(name, text):
+    if getattr(_RECORD_CTX, "row", None) is None:
+        return
+    with open(os.path.join(_RECORD_CTX.row_dir, name), "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+@contextmanager
+def recording_row(key, info):
+    if _RECORDER is None:
+        yield
+        return
+    _RECORDER.begin_row(key, info)
+    try:
+        yield
+    finally:
+        _RECORDER.end_row()
+
+
+_REPLAY_LOCK = threading.Lock()
+
+
+def replay_form(form_dir, responses, speed=1.0, rtt=0.005):
+    """回放单个表单的录制，返回 (统计, 决策差异列表)。
+
+    回放期间临时替换倍速时钟、耗时画像、模型客户端、直链下载和源码目录这几个模块全局量，
+    结束（包括异常）时在 finally 里恢复；_REPLAY_LOCK 保证同一时刻只有一个回放在改它们。
+    """
+    global _SPEED, _MODEL_CLIENT_FACTORY, _ATTACHMENT_FETCHER, SOURCES_DIR, _TIMER
+    from replay_fakes import FakeDriver, FakePage, ReplayModelClient, load_recording
+
+    manifest, rows = load_recording(form_dir)
+    model_client = ReplayModelClient(responses, _model_request_key, sleep=_sleep)
+    download_dir = os.path.join(form_dir, ".replay-downloads")
+    os.makedirs(download_dir, exist_ok=True)
+
+    page = FakePage(manifest, rows, download_dir, sleep=_sleep)
+    driver = FakeDriver(page, manifest.get("url") or "", rtt=rtt, page_call_js=_PAGE_CALL_JS, sleep=_sleep)
+    if _PROFILER is not None:
+        _PROFILER.instrument(driver)
+
+    index = EntryIndex(None)
+    for key, state in (manifest.get("done") or {}).items():
+        index.entries[key] = dict(state)
+
+    stats: dict = {}
+    with _REPLAY_LOCK:
+        prev = (_SPEED, _MODEL_CLIENT_FACTORY, _ATTACHMENT_FETCHER, SOURCES_DIR, _TIMER)
+        start = time.perf_counter()
+        try:
+            _SPEED = speed
+            # 回放用独立的、不落盘的耗时画像，不污染真实运行学到的数据
+            _TIMER = AdaptiveTimer() if _TIMER is not None else None
+            _MODEL_CLIENT_FACTORY = lambda: model_client
+            _ATTACHMENT_FETCHER = page.fetch
+            SOURCES_DIR = os.path.join(download_dir, "sources")
+            viewport = wait_for_grid(driver)
+            process_all_visible_then_scroll(
+                driver,
+                viewport,
+                skip_if_scored=manifest.get("skip_if_scored", True),
+                score_col_id=manifest.get("score_col_id") or "field_11",
+                detail_col_id=manifest.get("detail_col_id") or "field_5",
+                entry_id_col=manifest.get("entry_id_col") or ENTRY_ID_COL,
+                criteria=manifest.get("criteria"),
+                model=manifest.get("model"),
+                download_dir=download_dir,
+                stats=stats,
+                index=index,
+            )
+        finally:
+            _SPEED, _MODEL_CLIENT_FACTORY, _ATTACHMENT_FETCHER, SOURCES_DIR, _TIMER = prev
+            shutil.rmtree(download_dir, ignore_errors=True)
+        elapsed = time.perf_counter() - start
+
+    diffs = []
+    for key, rec in rows.items():
+        replayed = index.get(key)
+        got_status = replayed.get("status") or "-"
+        same = got_status == (rec.get("result") or "-")
+        if same and rec.get("result") == "written":
+            same = replayed.get("score") == rec.get("score") and page.decisions.get(key) == rec.get("chosen")
+        if not same:
+            diffs.append(
+                {
+                    "key": key,
+                    "recorded": {"result": rec.get("result"), "score": rec.get("score"), "chosen": rec.get("chosen")},
+                    "replayed": {"result": got_status, "score": replayed.get("score"), "chosen": page.decisions.get(key)},
+                }
+            )
+
+    stats.update(
+        {
+            "form": manifest.get("url"),
+            "rows_recorded": len(rows),
+            "elapsed_s": round(elapsed, 3),
+            "rows_per_s": round(len(rows) / elapsed, 2) if elapsed > 0 else 0.0,
+            "model_misses": model_client.misses,
+            "decision_diffs": len(diffs),
+        }
+    )
+    return stats, diffs
+
+
+def run_replay(record_dir, speed=1.0, rtt=0.005):
+    """回放录制目录（单个表单目录或 RECORD_DIR 根目录），打印吞吐与决策差异并写报表。"""
+    record_dir = os.path.abspath(record_dir)
+    if os.path.exists(os.path.join(record_dir, "manifest.json")):
+        form_dirs = [record_dir]
+        root = os.path.dirname(record_dir)
+    else:
+        root = record_dir
+        form_dirs = sorted(
+            os.path.join(root, d)
+            for d in os.listdir(root)
+            if os.path.exists(os.path.join(root, d, "manifest.json"))
+        )
+    if not form_dirs:
+        print("未找到录制数据（manifest.json）：", record_dir)
+        raise SystemExit(1)
+
+    from replay_fakes import load_responses
+
+    responses = load_responses(root)
+    results = []
+    with profile_run():
+        for form_dir in form_dirs:
+            print(f"\n===== 回放 {form_dir}（{speed}x） =====")
+            stats, diffs = replay_form(form_dir, responses, speed=speed, rtt=rtt)
+            results.append({"stats": stats, "diffs": diffs})
+
+    print("\n===== 回放结果 =====")
+    for r in results:
+        st = r["stats"]
+        print(
+            f"{st['form']}: {st['rows_recorded']} 行，耗时 {st['elapsed_s']}s（{st['rows_per_s']} 行/秒），"
+            f"回填 {st.get('written', 0)}，失败 {st.get('failed', 0)}，"
+            f"缺失模型回复 {st['model_misses']}，决策差异 {st['decision_diffs']}"
+        )
+        for d in r["diffs"][:20]:
+            print("  差异：", d["key"], "录制=", d["recorded"], "回放=", d["replayed"])
+
+    path = _write_report("replay", {"record_dir": record_dir, "speed": speed, "rtt": rtt, "forms": results})
+    print("回放报表已写入：", path)
+    if any(r["diffs"] for r in results):
+        raise SystemExit(2)
+    return results
+
+
+_RECORDER = SessionRecorder(RECORD_DIR) if RECORD_DIR else None
+
+
+# ---------------------------------------------------------------------------
+# 本地批量评分：不开浏览器，直接给一个目录 / 压缩包里的源码打分（换评分标准时试跑、整批重评）
+# ---------------------------------------------------------------------------
+
+_GRADE_FIELDS = ["file", "score", "comment", "encoding", "latency_s", "model"]
+
+
+def _quiet(*_args, **_kwargs):
+    pass
+
+
+def _decode_for_grading(path):
+    """进程池里解码单个文件（静默），返回 (路径, 文本, 编码, 耗时秒)。"""
+    start = time.perf_counter()
+    text, enc = read_cpp_file_with_encoding(path, log=_quiet)
+    return path, text, enc, time.perf_counter() - start
+
+
+def _extract_archive(path, dest):
+    """解压 .zip / .tar / .tar.gz / .tgz 到 dest，返回 dest；不是压缩包时返回 None。"""
+    import tarfile
+    import zipfile
+
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as zf:
+            zf.extractall(dest)
+        return dest
+    if tarfile.is_tarfile(path):
+        with tarfile.open(path) as tf:
+            if hasattr(tarfile, "data_filter"):
+                tf.extractall(dest, filter="data")
+            else:
+                tf.extractall(dest)
+        return dest
+    return None
+
+
+def collect_grade_items(root, per_dir=False):
+    """列出待评分的条目：[(条目名, [源码路径...])]，条目名为相对 root 的路径。
+
+    默认每个 .cpp/.cc/.cxx 文件单独评分；per_dir=True 时每个一级子目录作为一个项目
+    （目录里所有源码和头文件一起评分，根目录下的散文件仍单独评分）。
+    """
+    sources = []
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            if _SOURCE_EXT_RE.search(name) and not name.startswith("."):
+                sources.append(os.path.join(dirpath, name))
+    sources.sort()
+
+    items: dict[str, list[str]] = {}
+    for path in sources:
+        rel = os.path.relpath(path, root).replace(os.sep, "/")
+        top = rel.split("/", 1)[0]
+        if per_dir and "/" in rel:
+            items.setdefault(top, []).append(path)
+        elif not re.search(r"(?i)\.(h|hpp)$", rel):
+            items[rel] = [path]
+    return sorted(items.items())
+
+
+def _load_grade_results(out_path) -> dict:
+    """读已有的结果文件（CSV 或 JSONL），返回 file → 最后一条记录。"""
+    if not os.path.exists(out_path):
+        return {}
+    results = {}
+    with open(out_path, "r", encoding="utf-8", newline="") as f:
+        if out_path.lower().endswith(".csv"):
+            import csv
+
+            for row in csv.DictReader(f):
+                results[row["file"]] = row
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    row = json.loads(line)
+                    results[row["file"]] = row
+    return results
+
+
+class _GradeWriter:
+    """边评边追加写结果（中途中断也不丢已完成的），结束时按文件去重重写一遍。"""
+
+    def __init__(self, out_path):
+        self.out_path = out_path
+        self.csv = out_path.lower().endswith(".csv")
+        self._lock = threading.Lock()
+        new = not os.path.exists(out_path) or os.path.getsize(out_path) == 0
+        os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+        self._f = open(out_path, "a", encoding="utf-8", newline="")
+        if self.csv:
+            import csv
+
+            self._writer = csv.DictWriter(self._f, fieldnames=_GRADE_FIELDS)
+            if new:
+                self._writer.writeheader()
+
+    def write(self, row):
+        with self._lock:
+            if self.csv:
+                self._writer.writerow({k: row.get(k, "") for k in _GRADE_FIELDS})
+            else:
+                self._f.write(json.dumps({k: row.get(k) for k in _GRADE_FIELDS}, ensure_ascii=False) + "\n")
+            self._f.flush()
+
+    def close(self):
+        self._f.close()
+        results = _load_grade_results(self.out_path)
+        tmp = self.out_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8", newline="") as f:
+            if self.csv:
+                import csv
+
+                writer = csv.DictWriter(f, fieldnames=_GRADE_FIELDS)
+                writer.writeheader()
+                for key in sorted(results):
+                    writer.writerow({k: results[key].get(k, "") for k in _GRADE_FIELDS})
+            else:
+                for key in sorted(results):
+                    f.write(json.dumps(results[key], ensure_ascii=False) + "\n")
+        os.replace(tmp, self.out_path)
+
+
+def grade_local(
+    source,
+    out_path,
+    workers=4,
+    decode_workers=None,
+    criteria=None,
+    model=None,
+    per_dir=False,
+    resume=True,
+    scorer=None,
+):
+    """批量给本地源码评分，结果写入 out_path（.csv 或 .jsonl），返回统计字典。
+
+    - source：目录，或 .zip/.tar/.tar.gz 压缩包（解压到临时目录）
+    - 解码：read_cpp_file 的多编码打分放进进程池（decode_workers，默认 CPU 数）
+    - 评分：最多 workers 个并发请求；解码完一个就提交一个，两段流水
+    - resume：out_path 里已有分数的条目跳过，没有分数（失败）的重评
+    - scorer：评分函数，默认 score_homework_with_ai（设置了 CASCADE_MODEL 时走模型分级）
+    """
+    import tempfile
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+    import multiprocessing
+
+    tmp_dir = None
+    root = source
+    if os.path.isfile(source):
+        tmp_dir = tempfile.mkdtemp(prefix="grade-")
+        root = _extract_archive(source, tmp_dir)
+        if root is None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise ValueError(f"不是目录也不是支持的压缩包：{source}")
+
+    strategy = None
+    if scorer is None:
+        strategy = _strategy_from_env()
+        scorer = strategy.score if strategy is not None else score_homework_with_ai
+    model = model or MODEL_NAME
+
+    items = collect_grade_items(root, per_dir=per_dir)
+    done = _load_grade_results(out_path) if resume else {}
+    todo = [(name, paths) for name, paths in items if not str(done.get(name, {}).get("score") or "")]
+    print(f"共 {len(items)} 份，已有结果 {len(items) - len(todo)} 份，本次评分 {len(todo)} 份 -> {out_path}")
+
+    if not resume and os.path.exists(out_path):
+        os.remove(out_path)
+    writer = _GradeWriter(out_path)
+
+    stats = {"items": len(items), "resumed": len(items) - len(todo), "scored": 0, "failed": 0}
+    latencies: list[float] = []
+    decode_s = 0.0
+    start = time.perf_counter()
+    finished = 0
+
+    def _finish(name, score, comment, enc, seconds):
+        nonlocal finished
+        finished += 1
+        if score:
+            stats["scored"] += 1
+            latencies.append(seconds)
+        else:
+            stats["failed"] += 1
+        writer.write(
+            {
+                "file": name,
+                "score": score or "",
+                "comment": comment,
+                "encoding": enc,
+                "latency_s": round(seconds, 3),
+                "model": model,
+            }
+        )
+        elapsed = time.perf_counter() - start
+        rate = finished / elapsed if elapsed > 0 else 0.0
+        eta = (len(todo) - finished) / rate if rate > 0 else 0.0
+        print(
+            f"[{finished}/{len(todo)}] {name}: {score or '失败'}（{seconds:.1f}s）"
+            f"  {rate * 60:.1f} 份/分钟，预计还需 {eta:.0f}s"
+        )
+
+    def _score(name, files, enc):
+        t0 = time.perf_counter()
+        try:
+            score, comment = scorer(build_project_source(files), criteria=criteria, model=model)
+        except Exception as e:
+            score, comment = None, f"评分异常：{e}"
+        return name, score, comment, enc, time.perf_counter() - t0
+
+    decode_pool = ProcessPoolExecutor(
+        max_workers=decode_workers or os.cpu_count() or 1,
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+    score_pool = ThreadPoolExecutor(max_workers=max(1, int(workers)))
+    try:
+        # 1) 所有文件提交解码；某个条目的文件全部解码完就提交评分
+        owners: dict[str, str] = {}
+        expected = {name: len(paths) for name, paths in todo}
+        decoded: dict[str, list] = {name: [] for name, _ in todo}
+        decode_futs = set()
+        for name, paths in todo:
+            for path in paths:
+                owners[path] = name
+                decode_futs.add(decode_pool.submit(_decode_for_grading, path))
+
+        score_futs = set()
+        while decode_futs or score_futs:
+            finished_futs, _ = wait(decode_futs | score_futs, return_when=FIRST_COMPLETED)
+            for fut in finished_futs:
+                if fut in decode_futs:
+                    decode_futs.discard(fut)
+                    path, text, enc, seconds = fut.result()
+                    decode_s += seconds
+                    name = owners[path]
+                    decoded[name].append((os.path.basename(path), text, enc))
+                    if len(decoded[name]) < expected[name]:
+                        continue
+                    parts = sorted((n, t) for n, t, _ in decoded[name] if t)
+                    encs = "/".join(sorted({e for _, t, e in decoded[name] if t}))
+                    if parts:
+                        score_futs.add(score_pool.submit(_score, name, parts, encs))
+                    else:
+                        _finish(name, None, "读取失败（不是源码文本）", "", 0.0)
+                else:
+                    score_futs.discard(fut)
+                    _finish(*fut.result())
+    finally:
+        score_pool.shutdown(wait=True)
+        decode_pool.shutdown(wait=True)
+        writer.close()
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    elapsed = time.perf_counter() - start
+    stats.update(
+        {
+            "elapsed_s": round(elapsed, 2),
+            "per_min": round(finished / elapsed * 60, 2) if elapsed > 0 else 0.0,
+            "decode_s": round(decode_s, 2),
+            "latency_s": {
+                "p50": round(_percentile(latencies, 0.5) or 0, 3),
+                "p95": round(_percentile(latencies, 0.95) or 0, 3),
+                "max": round(max(latencies), 3) if latencies else 0,
+            },
+            "workers": workers,
+            "model": model,
+            "cascade": strategy.report() if isinstance(strategy, ModelCascade) else None,
+            "sampling": strategy.report() if isinstance(strategy, ConsistentScorer) else None,
+            "model_usage": _model_usage_report(),
+        }
+    )
+    return stats
+
+
+def run_grade(args):
+    if not API_KEY and _MODEL_CLIENT_FACTORY is None:
+        print("错误：缺少 AI_API_KEY（对接模拟模型服务时随便填一个即可）")
+        raise SystemExit(1)
+    criteria = None
+    if args.rubric:
+        with open(args.rubric, "r", encoding="utf-8") as f:
+            criteria = f.read()
+    out = args.out or os.path.join(
+        REPORT_DIR, f"grade-{_safe_name(os.path.basename(os.path.abspath(args.source)))}.csv"
+    )
+    stats = grade_local(
+        args.source,
+        out,
+        workers=args.workers,
+        decode_workers=args.decode_workers,
+        criteria=criteria,
+        model=args.model,
+        per_dir=args.per_dir,
+        resume=not args.no_resume,
+    )
+    lat = stats["latency_s"]
+    print(
+        f"\n===== 批量评分结果 =====\n共 {stats['items']} 份：本次评分 {stats['scored']}，失败 {stats['failed']}，"
+        f"沿用已有结果 {stats['resumed']}；耗时 {stats['elapsed_s']}s（{stats['per_min']} 份/分钟），"
+        f"解码累计 {stats['decode_s']}s；评分耗时 p50={lat['p50']}s p95={lat['p95']}s"
+    )
+    if stats.get("cascade"):
+        print(_cascade_summary(stats["cascade"]))
+    if stats.get("sampling"):
+        print(_sampling_summary(stats["sampling"]))
+    print("结果文件：", out)
+    path = _write_report("grade", dict(stats, source=os.path.abspath(args.source), out=os.path.abspath(out)))
+    print("报表已写入：", path)
+
+
+# ---------------------------------------------------------------------------
+# 规则变更后的增量重评：用保存的源码离线重评，只为下拉选项真正变化的条目打开浏览器改分
+# ---------------------------------------------------------------------------
+
+
+def _cli_jobs(rubric_path=None, model=None):
+    """regrade / reconcile 要处理的表单：JOB_FILE 里的全部表单，否则 HOMEWORK_URL；rubric_path / model 覆盖所有表单。"""
+    if JOB_FILE:
+        jobs, _options = load_job_file(JOB_FILE)
+    else:
+        jobs = [FormJob(name=_form_key(HOMEWORK_URL), url=HOMEWORK_URL)]
+    criteria = None
+    if rubric_path:
+        with open(rubric_path, "r", encoding="utf-8") as f:
+            criteria = f.read()
+    for job in jobs:
+        job.criteria = criteria or job.criteria
+        job.model = model or job.model
+    return jobs
+
+
+def _option_for(score, options):
+    """分数会选中的下拉选项（与回填时的选法相同）；不知道选项列表时按数值规范化比较。"""
+    score_str = str(score or "").strip()
+    if options:
+        return options[_choose_score_option(options, score_str)]
+    try:
+        return f"{float(score_str):g}"
+    except ValueError:
+        return score_str
+
+
+def regrade_form(job, pool, workers=8, strategy=None):
+    """离线重评一个表单里之前回填过的条目，返回 (index, 待改分条目集合, 统计)。
+
+    - 只看 status=written 的条目（教师手工评过的 skipped 不动）
+    - rubric_sha 与当前评分标准 + 模型 + 评分策略一致的条目不重评（current）
+    - 上次重评后还没改分成功的（regrade_pending 指纹一致）直接沿用，不再请求模型（resumed）
+    - 没保存源码的条目（早期版本的记录）无法离线重评，列在 no_source
+    - 新分数选中的下拉选项与之前提交的相同：只更新 index，不需要打开浏览器（unchanged）
+    """
+    index = EntryIndex(_state_path(job.url))
+    fingerprint = _rubric_fingerprint(job.criteria, job.model, strategy)
+    options = index.meta.get("options")
+    stats = {
+        "form": job.name,
+        "url": job.url,
+        "entries": 0,
+        "current": 0,
+        "resumed": 0,
+        "no_source": [],
+        "rescored": 0,
+        "failed": 0,
+        "unchanged": 0,
+        "changed": [],
+    }
+
+    todo = []
+    for key, entry in index.entries.items():
+        if entry.get("status") != "written":
+            continue
+        stats["entries"] += 1
+        if (entry.get("regrade_pending") or {}).get("rubric_sha") == fingerprint:
+            stats["resumed"] += 1
+        elif entry.get("rubric_sha") == fingerprint:
+            stats["current"] += 1
+        else:
+            paths = [os.path.join(entry.get("source_dir") or "", name) for name in entry.get("files") or []]
+            paths = [p for p in paths if os.path.isfile(p)]
+            if paths:
+                todo.append((key, paths))
+            else:
+                stats["no_source"].append(key)
+
+    print(
+        f"表单 {job.name}：已回填 {stats['entries']} 条，需重评 {len(todo)}，规则未变 {stats['current']}，"
+        f"沿用上次重评 {stats['resumed']}，缺源码 {len(stats['no_source'])}"
+    )
+
+    def _rescore(item):
+        key, paths = item
+        code = build_project_source(read_source_files(paths, quiet=True))
+        score, comment = pool.score(code, job.criteria, job.model, strategy=strategy)
+        return key, score, comment
+
+    with ThreadPoolExecutor(max_workers=max(1, int(workers))) as executor:
+        futures = [executor.submit(_rescore, item) for item in todo]
+        for i, fut in enumerate(as_completed(futures), start=1):
+            try:
+                key, score, comment = fut.result()
+            except Exception as e:
+                stats["failed"] += 1
+                print(f"[{i}/{len(todo)}] 重评异常：{e}")
+                continue
+            if not score:
+                stats["failed"] += 1
+                print(f"[{i}/{len(todo)}] {key}：重评失败（{comment}），保留原分数")
+                continue
+
+            stats["rescored"] += 1
+            entry = index.get(key)
+            old_option = entry.get("option") or _option_for(entry.get("score"), options)
+            new_option = _option_for(score, options)
+            if new_option == old_option:
+                stats["unchanged"] += 1
+                index.update(
+                    key, score=score, comment=comment, model=job.model, rubric_sha=fingerprint, regrade_pending=None
+                )
+                print(f"[{i}/{len(todo)}] {key}：{entry.get('score')} → {score}，选项不变（{new_option}）")
+            else:
+                stats["changed"].append({"key": key, "from": old_option, "to": new_option})
+                index.update(
+                    key,
+                    regrade_pending={
+                        "score": score,
+                        "comment": comment,
+                        "option": new_option,
+                        "model": job.model,
+                        "rubric_sha": fingerprint,
+                    },
+                )
+                print(f"[{i}/{len(todo)}] {key}：{old_option} → {new_option}，需要改分")
+    index.flush()
+
+    pending = {
+        key
+        for key, entry in index.entries.items()
+        if (entry.get("regrade_pending") or {}).get("rubric_sha") == fingerprint
+    }
+    return index, pending, stats
+
+
+def run_regrade(args):
+    """规则/模型变更后的重评活动。
+
+    1) 离线：按各表单的状态文件找出之前回填过的条目，用 sources/ 里保存的源码高并发重评
+    2) 对比：新分数选中的下拉选项与之前提交的是否相同
+    3) 只为选项变化的条目打开浏览器改分（不下载、不评分），其余只更新状态文件
+    4) 报表：重评数、改分数、省下的浏览器回填次数，写入 REPORT_DIR
+    """
+    if not API_KEY and _MODEL_CLIENT_FACTORY is None:
+        print("错误：缺少 AI_API_KEY（对接模拟模型服务时随便填一个即可）")
+        raise SystemExit(1)
+    jobs = _cli_jobs(args.rubric, args.model)
+    pool = ScoringPool(max_workers=args.workers)
+    start = time.perf_counter()
+    plans = []
+    for job in jobs:
+        # 与正常运行用同一套策略，指纹才对得上
+        cascade, sampler = _job_strategy(job)
+        index, pending, stats = regrade_form(job, pool, workers=args.workers, strategy=cascade or sampler)
+        stats["cascade"] = cascade.report() if cascade is not None else None
+        stats["sampling"] = sampler.report() if sampler is not None else None
+        plans.append((job, index, pending, stats))
+    offline_s = time.perf_counter() - start
+
+    browser_s = 0.0
+    to_write = [plan for plan in plans if plan[2]]
+    if to_write and not args.dry_run:
+        start = time.perf_counter()
+        driver = setup_driver(columns=_lean_columns([plan[0] for plan in to_write]))
+        try:
+            driver.get(to_write[0][0].url)
+            print("已打开页面：", to_write[0][0].url)
+            input("请在浏览器中完成登录，然后回到这里按回车继续... ")
+            for job, index, pending, stats in to_write:
+                run_stats: dict = {}
+                try:
+                    driver.get(job.url)
+                    viewport = wait_for_grid(driver)
+                    process_all_visible_then_scroll(
+                        driver,
+                        viewport,
+                        score_col_id=job.score_col_id,
+                        detail_col_id=job.detail_col_id,
+                        stats=run_stats,
+                        entry_id_col=job.id_col,
+                        index=index,
+                        only=pending,
+                        rewrite=True,
+                    )
+                except Exception as e:
+                    stats["error"] = f"{type(e).__name__}: {e}"
+                    print(f"表单 {job.name} 改分中断：", stats["error"])
+                stats["written"] = run_stats.get("written", 0)
+                stats["still_failing"] = run_stats.get("still_failing", [])
+        finally:
+            if _TIMER is not None:
+                _TIMER.save()
+            input("按回车关闭浏览器... ")
+            try:
+                driver.quit()
+            except Exception:
+                pass
+        browser_s = time.perf_counter() - start
+
+    print("\n===== 增量重评结果 =====")
+    forms = []
+    for _job, _index, pending, stats in plans:
+        stats["pending"] = len(pending)
+        stats.setdefault("written", 0)
+        # 重评了、但选项没变的条目：不做增量时它们也要在浏览器里重新回填一遍
+        stats["writebacks_avoided"] = stats["unchanged"]
+        forms.append(stats)
+        print(
+            f"{stats['form']}：已回填 {stats['entries']}，重评 {stats['rescored']}（失败 {stats['failed']}），"
+            f"选项不变 {stats['unchanged']}，规则未变 {stats['current']}，需改分 {len(pending)}，"
+            f"已改 {stats['written']}，省下浏览器回填 {stats['writebacks_avoided']} 次"
+        )
+        if stats["no_source"]:
+            print(f"   缺源码无法离线重评 {len(stats['no_source'])} 条（需正常流程重新下载）")
+    if args.dry_run and to_write:
+        print("--dry-run：未打开浏览器；待改分条目已记入状态文件，去掉 --dry-run 再运行即可改分（不会重复请求模型）")
+    print(f"离线重评 {offline_s:.1f}s，浏览器改分 {browser_s:.1f}s")
+
+    path = _write_report(
+        "regrade",
+        {
+            "job_file": os.path.abspath(JOB_FILE) if JOB_FILE else None,
+            "dry_run": bool(args.dry_run),
+            "offline_s": round(offline_s, 1),
+            "browser_s": round(browser_s, 1),
+            "writebacks": sum(f["written"] for f in forms),
+            "writebacks_avoided": sum(f["writebacks_avoided"] for f in forms),
+            "forms": forms,
+            "model_usage": _model_usage_report(),
+        },
+    )
+    print("报表已写入：", path)
+
+
+def run_reconcile(args):
+    """单独核对之前回填的分数是否生效（不评分）。
+
+    - 默认打开浏览器：每个表单刷新后滚动一遍表格读出所有已回填条目的教师评分列，
+      与状态文件里应填的选项对比，只重新回填不一致的条目
+    - --entries-json：不开浏览器，从抓取/导出的条目 JSON 里读教师评分列对比；
+      不一致的在状态文件里标记 verified=false，之后去掉该参数运行即可只重填这些
+    """
+    jobs = _cli_jobs()
+    if args.form:
+        jobs = [job for job in jobs if job.name == args.form]
+        if not jobs:
+            print("任务文件里没有该表单：", args.form)
+            raise SystemExit(1)
+
+    forms = []
+    if args.entries_json:
+        if len(jobs) > 1:
+            print("条目 JSON 只对应一个表单，请用 --form 指定")
+            raise SystemExit(1)
+        job = jobs[0]
+        index = EntryIndex(_state_path(job.url))
+        keys = index.written_keys()
+        observed = load_entries_json(args.entries_json, job.id_col, job.score_col_id)
+        ok, bad, missing = verify_writebacks(index, keys, observed)
+        forms.append(
+            {
+                "form": job.name,
+                "checked": len(keys),
+                "verified": len(ok),
+                "mismatched": bad,
+                "missing": missing,
+                "rate": round(len(ok) / len(keys), 4) if keys else None,
+            }
+        )
+        for b in bad:
+            print(f"  {b['key']}：应为 {b['expected']}，实际 {b['actual'] or '空'}")
+        if bad:
+            print("不一致的条目已在状态文件里标记，去掉 --entries-json 再运行会在浏览器里只重新回填这些")
+    else:
+        driver = setup_driver(columns=_lean_columns(jobs))
+        try:
+            driver.get(jobs[0].url)
+            print("已打开页面：", jobs[0].url)
+            input("请在浏览器中完成登录，然后回到这里按回车继续... ")
+            for job in jobs:
+                index = EntryIndex(_state_path(job.url))
+                keys = index.written_keys()
+                if not keys:
+                    print(f"表单 {job.name}：没有已回填的条目，跳过")
+                    continue
+                stats: dict = {}
+                try:
+                    driver.get(job.url)
+                    viewport = wait_for_grid(driver)
+                    process_all_visible_then_scroll(
+                        driver,
+                        viewport,
+                        score_col_id=job.score_col_id,
+                        detail_col_id=job.detail_col_id,
+                        stats=stats,
+                        entry_id_col=job.id_col,
+                        index=index,
+                        only=set(),
+                        rewrite=True,
+                        reconcile=True,
+                        verify=keys,
+                    )
+                except Exception as e:
+                    stats["error"] = f"{type(e).__name__}: {e}"
+                    print(f"表单 {job.name} 核对中断：", stats["error"])
+                forms.append(dict(stats.get("verification") or {}, form=job.name, error=stats.get("error")))
+        finally:
+            if _TIMER is not None:
+                _TIMER.save()
+            input("按回车关闭浏览器... ")
+            try:
+                driver.quit()
+            except Exception:
+                pass
+
+    print("\n===== 回填核对结果 =====")
+    for f in forms:
+        rate = "-" if f.get("rate") is None else f"{f['rate']:.1%}"
+        print(
+            f"{f['form']}：核对 {f.get('checked', 0)}，一致 {f.get('verified', 0)}，"
+            f"不一致 {len(f.get('mismatched') or [])}，未找到 {len(f.get('missing') or [])}，通过率 {rate}"
+        )
+    path = _write_report(
+        "reconcile",
+        {"entries_json": os.path.abspath(args.entries_json) if args.entries_json else None, "forms": forms},
+    )
+    print("报表已写入：", path)
+
+
+# ---------------------------------------------------------------------------
+# 浏览器配置基准：默认配置 vs 精简配置的表格加载、打开详情、滚动耗时与 Chrome 内存
+# ---------------------------------------------------------------------------
+
+
+def _chrome_memory_mb(driver):
+    """Chrome 全部进程（chromedriver 的子进程树）的常驻内存之和（MB）；取不到时返回 None。
+
+    有 psutil 时用 psutil，否则读 /proc（仅 Linux）。
+    """
+    try:
+        root = driver.service.process.pid
+    except AttributeError:
+        return None
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil is not None:
+        try:
+            procs = psutil.Process(root).children(recursive=True)
+            return round(sum(p.memory_info().rss for p in procs) / 1024 / 1024, 1)
+        except psutil.Error:
+            return None
+    if not os.path.isdir("/proc"):
+        return None
+
+    children: dict[int, list] = {}
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/stat", "r") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(pid))
+    page = os.sysconf("SC_PAGE_SIZE")
+    total = 0
+    stack = list(children.get(root, []))
+    while stack:
+        pid = stack.pop()
+        stack.extend(children.get(pid, []))
+        try:
+            with open(f"/proc/{pid}/statm", "r") as f:
+                total += int(f.read().split()[1]) * page
+        except (OSError, IndexError, ValueError):
+            continue
+    return round(total / 1024 / 1024, 1)
+
+
+def _summary(samples) -> dict:
+    return {
+        "n": len(samples),
+        "p50": round(_percentile(samples, 0.5) or 0, 3),
+        "max": round(max(samples), 3) if samples else 0,
+    }
+
+
+def bench_profile(driver, url, loads=3, rows=5, screens=5, detail_col_id="field_5", score_col_id="field_11", entry_id_col=None):
+    """在一个已登录的浏览器里测一组指标（只读：打开详情后直接关闭，不回填）。"""
+    entry_id_col = entry_id_col or ENTRY_ID_COL
+    grid = []
+    for _ in range(max(1, int(loads))):
+        start = time.perf_counter()
+        driver.get(url)
+        wait_for_grid(driver)
+        _wait_until(driver, lambda d: _visible_entries(d, entry_id_col, score_col_id) or None, 20)
+        grid.append(time.perf_counter() - start)
+
+    viewport = wait_for_grid(driver)
+    opens = []
+    for info in _visible_entries(driver, entry_id_col, score_col_id)[: max(0, int(rows))]:
+        start = time.perf_counter()
+        modal = open_detail(driver, int(info["rowIndex"]), detail_col_id, open_attempts=2)
+        if modal is not None:
+            opens.append(time.perf_counter() - start)
+        _reset_modal(driver)
+
+    def _keys(d):
+        return {info.get("key") for info in _visible_entries(d, entry_id_col, score_col_id)}
+
+    # 滚动一屏到新行渲染出来的耗时（到底后提前结束）
+    scrolls = []
+    for _ in range(max(0, int(screens))):
+        before = _keys(driver)
+        start = time.perf_counter()
+        driver.execute_script("arguments[0].scrollTop += arguments[0].clientHeight;", viewport)
+        try:
+            _wait_until(driver, lambda d: (_keys(d) - before) or None, 10, poll=0.05)
+        except TimeoutException:
+            if driver.execute_script(
+                "return arguments[0].scrollTop + arguments[0].clientHeight >= arguments[0].scrollHeight - 50;",
+                viewport,
+            ):
+                break
+            continue
+        scrolls.append(time.perf_counter() - start)
+
+    metrics = BrowserLifecycle(driver).metrics()
+    return {
+        "grid_load_s": _summary(grid),
+        "modal_open_s": _summary(opens),
+        "scroll_s": _summary(scrolls),
+        "js_heap_mb": metrics.get("heap_mb"),
+        "dom_nodes": metrics.get("nodes"),
+        "listeners": metrics.get("listeners"),
+        "chrome_rss_mb": _chrome_memory_mb(driver),
+    }
+
+
+def _bench_delta(base, lean) -> dict:
+    """精简配置相对默认配置的变化百分比（负数 = 更快/更省）。"""
+    pairs = {
+        "grid_load_p50": (base["grid_load_s"]["p50"], lean["grid_load_s"]["p50"]),
+        "modal_open_p50": (base["modal_open_s"]["p50"], lean["modal_open_s"]["p50"]),
+        "scroll_p50": (base["scroll_s"]["p50"], lean["scroll_s"]["p50"]),
+        "js_heap_mb": (base["js_heap_mb"], lean["js_heap_mb"]),
+        "dom_nodes": (base["dom_nodes"], lean["dom_nodes"]),
+        "chrome_rss_mb": (base["chrome_rss_mb"], lean["chrome_rss_mb"]),
+    }
+    return {k: round((b2 - b1) / b1 * 100, 1) if b1 and b2 is not None else None for k, (b1, b2) in pairs.items()}
+
+
+def run_bench_browser(args):
+    """依次用默认配置和精简配置打开同一个表单，对比表格加载、打开详情、滚动耗时与内存，写入 REPORT_DIR。
+
+    只需在第一个浏览器里登录，cookie 复制给第二个；测第二个前先关掉第一个，内存互不影响。
+    """
+    global _TIMER
+    url = args.url or HOMEWORK_URL
+    columns = _lean_columns() | {args.detail_col}
+    prev_timer, _TIMER = _TIMER, None  # 基准测的是固定等待下的真实耗时，也不污染学到的超时
+    results: dict = {}
+    login = None
+    try:
+        for profile in ("default", "lean"):
+            driver = setup_driver(profile=profile, columns=columns)
+            if login is None:
+                driver.get(url)
+                print("已打开页面：", url)
+                input("请在浏览器中完成登录，然后回到这里按回车继续... ")
+            else:
+                _copy_session_cookies(login, driver, url)
+                login.quit()
+            login = driver
+            print(f"\n测量 {profile} 配置...")
+            results[profile] = bench_profile(
+                driver, url, loads=args.loads, rows=args.rows, screens=args.screens, detail_col_id=args.detail_col
+            )
+    finally:
+        _TIMER = prev_timer
+        if login is not None:
+            try:
+                login.quit()
+            except Exception:
+                pass
+
+    print("\n===== 浏览器配置基准 =====")
+    print(f"{'配置':<10}{'表格加载p50':>12}{'弹窗p50':>10}{'滚动p50':>10}{'JS堆MB':>9}{'DOM节点':>9}{'Chrome MB':>11}")
+    for profile, r in results.items():
+        print(
+            f"{profile:<10}{r['grid_load_s']['p50']:>12}{r['modal_open_s']['p50']:>10}{r['scroll_s']['p50']:>10}"
+            f"{str(r['js_heap_mb']):>9}{str(r['dom_nodes']):>9}{str(r['chrome_rss_mb']):>11}"
+        )
+    delta = _bench_delta(results["default"], results["lean"]) if len(results) == 2 else {}
+    if delta:
+        print("精简配置变化：" + "，".join(f"{k} {v:+.1f}%" for k, v in delta.items() if v is not None))
+    path = _write_report(
+        "bench",
+        {
+            "url": url,
+            "window": BROWSER_WINDOW,
+            "columns": sorted(columns),
+            "blocked_urls": _LEAN_BLOCKED_URLS + [u.strip() for u in BROWSER_BLOCK_URLS.split(",") if u.strip()],
+            "profiles": results,
+            "lean_vs_default_pct": delta,
+        },
+    )
+    print("报表已写入：", path)
+
+
+# ---------------------------------------------------------------------------
+# 模拟模型服务：按脚本返回固定回复的 OpenAI 兼容接口，用于测试模型分级、批量评分等
+# ---------------------------------------------------------------------------
+
+
+class UnsupportedParameterError(ValueError):
+    """脚本模型拒绝 n 参数时抛出；与 openai.BadRequestError 一样带 status_code=400。"""
+
+    status_code = 400
+
+
+class ScriptedModel:
+    """按脚本给出回复（线程安全）。脚本格式（JSON）：
+
+    {
+      "models": {
+        "gpt-5-nano": {
+          "latency_s": 0.2,
+          "rules": [{"contains": "bubble_sort", "text": "6\\n排序有误\\n置信度: 0.4\\n分数范围: 5-8"}],
+          "responses": ["8\\n结构清晰\\n置信度: 0.9\\n分数范围: 8-8"]
+        },
+        "gpt-5-mini": {"rules": [{"contains": "edge_case", "texts": ["7\\n还行", "5\\n漏了边界", "7\\n还行"]}]},
+        "*": {"latency_s": 1.0, "responses": ["7\\n基本正确"], "supports_n": true}
+      }
+    }
+
+    先按 rules 匹配用户消息（contains 子串），都不匹配时按顺序循环 responses；
+    没有该模型的脚本时用 "*"。token 用量按字符数粗估（约 4 字符 1 token）。
+    请求带 n 时返回 n 份回复：规则写 texts 时依次取，否则从 responses 里接着循环；
+    "supports_n": false 的模型收到 n > 1 时报错（模拟不支持该参数的网关）。
+    """
+
+    def __init__(self, script: dict):
+        self.models = script.get("models") or {}
+        self._counters: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.requests: list[dict] = []
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def reply(self, model, messages, n=1):
+        """返回 (回复文本列表, usage, 延迟秒数)；列表长度为 n。"""
+        spec = self.models.get(model) or self.models.get("*") or {}
+        n = max(1, int(n or 1))
+        if n > 1 and spec.get("supports_n") is False:
+            raise UnsupportedParameterError(f"模型 {model} 不支持 n 参数")
+        user = "\n".join(m.get("content") or "" for m in messages if m.get("role") == "user")
+        texts = None
+        for rule in spec.get("rules") or []:
+            if rule.get("contains") and rule["contains"] in user:
+                options = rule.get("texts") or [rule.get("text") or ""]
+                texts = [options[i % len(options)] for i in range(n)]
+                break
+        if texts is None:
+            responses = spec.get("responses") or [""]
+            with self._lock:
+                start = self._counters.get(model, 0)
+                self._counters[model] = start + n
+            texts = [responses[(start + i) % len(responses)] for i in range(n)]
+        with self._lock:
+            self.requests.append({"model": model, "chars": len(user), "n": n})
+        prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 4
+        completion_tokens = sum(len(t) // 4 + 1 for t in texts)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        return texts, usage, float(spec.get("latency_s") or 0)
+
+
+class ScriptedModelClient:
+    """进程内的脚本客户端（与 OpenAI 客户端同接口），可直接赋给 _MODEL_CLIENT_FACTORY。"""
+
+    def __init__(self, model: ScriptedModel):
+        self._model = model
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        texts, usage, latency = self._model.reply(
+            kwargs.get("model"), kwargs.get("messages") or [], n=kwargs.get("n", 1)
+        )
+        _sleep(latency)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=t)) for t in texts],
+            usage=SimpleNamespace(**usage),
+        )
+
+
+def serve_mock_model(script_path, host="127.0.0.1", port=8765):
+    """启动本地模拟模型服务（POST /v1/chat/completions），直到 Ctrl+C。
+
+    用法：AI_BASE_URL=http://127.0.0.1:8765/v1 AI_API_KEY=mock python main.py ...
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    model = ScriptedModel.load(script_path)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self.send_error(404)
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            try:
+                texts, usage, latency = model.reply(
+                    body.get("model"), body.get("messages") or [], n=body.get("n", 1)
+                )
+            except ValueError as e:
+                self.send_error(400, "unsupported parameter: n", str(e))
+                return
+            time.sleep(latency)
+            payload = json.dumps(
+                {
+                    "id": f"mock-{len(model.requests)}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model"),
+                    "choices": [
+                        {
+                            "index": i,
+                            "message": {"role": "assistant", "content": text},
+                            "finish_reason": "stop",
+                        }
+                        for i, text in enumerate(texts)
+                    ],
+                    "usage": usage,
+                },
+                ensure_ascii=False,
+            ).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, fmt, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f"模拟模型服务已启动：http://{host}:{port}/v1 （脚本 {script_path}），Ctrl+C 结束")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"共处理 {len(model.requests)} 次请求")
+
+
+# ---------------------------------------------------------------------------
+# 启动耗时：导入耗时 + 每次浏览器启动（解析 chromedriver / 拉起 Chrome）
+# ---------------------------------------------------------------------------
+
+# 不应出现在导入阶段的重依赖（startup-check 会检查）
+_LAZY_MODULES = ("openai", "webdriver_manager", "selenium.webdriver.chrome.webdriver")
+
+
+def check_startup(budget=None, runs=3):
+    """在干净的子进程里多次导入 main，取最快一次与预算比较，并确认重依赖没有被提前导入。
+
+    返回 (是否通过, 结果字典)。
+    """
+    budget = STARTUP_BUDGET_S if budget is None else budget
+    here = os.path.dirname(os.path.abspath(__file__))
+    probe = (
+        "import json, sys, time\n"
+        "t = time.perf_counter()\n"
+        "import main\n"
+        "dt = time.perf_counter() - t\n"
+        f"eager = [m for m in {list(_LAZY_MODULES)!r} if m in sys.modules]\n"
+        "print(json.dumps({'import_s': dt, 'eager': eager}))\n"
+    )
+    samples = []
+    eager: list[str] = []
+    for _ in range(max(1, runs)):
+        out = subprocess.run(
+            [sys.executable, "-c", probe], cwd=here, capture_output=True, text=True, timeout=120
+        )
+        if out.returncode != 0:
+            return False, {"error": out.stderr.strip()[-500:]}
+        res = json.loads(out.stdout.strip().splitlines()[-1])
+        samples.append(res["import_s"])
+        eager = res["eager"]
+
+    best = min(samples)
+    result = {
+        "import_s": round(best, 3),
+        "samples": [round(x, 3) for x in samples],
+        "budget_s": budget,
+        "eager_modules": eager,
+    }
+    return best <= budget and not eager, result
+
+
+STARTUP_TIMINGS: dict = {"import_s": round(time.perf_counter() - _IMPORT_START, 3)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="金数据作业：批量下载、AI 评分、回填教师评分")
+    sub = parser.add_subparsers(dest="command")
+    parser.add_argument(
+        "--only-failed", action="store_true", help="只重跑状态文件里上次仍失败的条目（不扫描处理其他行）"
+    )
+    p_replay = sub.add_parser("replay", help="离线回放 RECORD_DIR 录下的运行（不需要浏览器和 API Key）")
+    p_replay.add_argument("record_dir", help="录制目录（RECORD_DIR 根目录或其中某个表单目录）")
+    p_replay.add_argument("--speed", type=float, default=1.0, help="倍速（固定等待/超时/录制耗时按此缩放），如 100")
+    p_replay.add_argument("--rtt", type=float, default=0.005, help="模拟的单次 WebDriver 往返耗时（秒）")
+    p_startup = sub.add_parser("startup-check", help="检查导入耗时是否在预算内（失败退出码 1，可用于 CI）")
+    p_startup.add_argument("--budget", type=float, default=None, help="预算秒数（默认 STARTUP_BUDGET_S）")
+    p_grade = sub.add_parser("grade", help="不开浏览器，批量给本地目录/压缩包里的源码评分")
+    p_grade.add_argument("source", help="源码目录，或 .zip/.tar/.tar.gz 压缩包")
+    p_grade.add_argument("--out", help="结果文件 .csv 或 .jsonl（默认 reports/grade-<目录名>.csv）")
+    p_grade.add_argument("--workers", type=int, default=4, help="并发评分请求数")
+    p_grade.add_argument("--decode-workers", type=int, default=None, help="解码进程数（默认 CPU 数）")
+    p_grade.add_argument("--rubric", help="评分标准文件（默认内置 SCORING_CRITERIA）")
+    p_grade.add_argument("--model", help="模型（默认 MODEL_NAME）")
+    p_grade.add_argument("--per-dir", action="store_true", help="每个一级子目录作为一个多文件项目评分")
+    p_grade.add_argument("--no-resume", action="store_true", help="忽略已有结果，全部重评")
+    p_regrade = sub.add_parser("regrade", help="评分标准/模型变更后：离线重评已回填的条目，只为分数选项变化的条目改分")
+    p_regrade.add_argument("--workers", type=int, default=8, help="并发评分请求数")
+    p_regrade.add_argument("--rubric", help="新的评分标准文件（默认按任务文件 / SCORING_CRITERIA）")
+    p_regrade.add_argument("--model", help="新的模型（默认按任务文件 / MODEL_NAME）")
+    p_regrade.add_argument("--dry-run", action="store_true", help="只离线重评并对比，不打开浏览器")
+    p_reconcile = sub.add_parser("reconcile", help="核对已回填的分数是否生效，只重新回填不一致的条目")
+    p_reconcile.add_argument("--entries-json", help="抓取/导出的条目 JSON（不开浏览器，只对比并标记）")
+    p_reconcile.add_argument("--form", help="只核对任务文件里的这个表单（按 name）")
+    p_bench = sub.add_parser("bench-browser", help="对比默认/精简浏览器配置的表格加载、打开详情耗时与内存")
+    p_bench.add_argument("--url", help="表单地址（默认 HOMEWORK_URL）")
+    p_bench.add_argument("--loads", type=int, default=3, help="表格加载次数")
+    p_bench.add_argument("--rows", type=int, default=5, help="打开详情的行数（只读，不回填）")
+    p_bench.add_argument("--screens", type=int, default=5, help="向下滚动的屏数")
+    p_bench.add_argument("--detail-col", default="field_5", help="详情列 col-id")
+    p_mock = sub.add_parser("mock-model", help="启动按脚本回复的本地模拟模型服务（OpenAI 兼容接口）")
+    p_mock.add_argument("script", help="回复脚本（JSON），格式见 ScriptedModel")
+    p_mock.add_argument("--host", default="127.0.0.1")
+    p_mock.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args(argv)
+
+    if args.command == "grade":
+        run_grade(args)
+        return
+
+    if args.command == "regrade":
+        run_regrade(args)
+        return
+
+    if args.command == "reconcile":
+        run_reconcile(args)
+        return
+
+    if args.command == "bench-browser":
+        run_bench_browser(args)
+        return
+
+    if args.command == "mock-model":
+        serve_mock_model(args.script, host=args.host, port=args.port)
+        return
+
+    if args.command == "replay":
+        run_replay(args.record_dir, speed=args.speed, rtt=args.rtt)
+        return
+
+    if args.command == "startup-check":
+        ok, result = check_startup(budget=args.budget)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        if not ok:
+            print("启动预算检查未通过")
+            raise SystemExit(1)
+        print("启动预算检查通过")
+        return
 
-def main():
     os.makedirs(DOWNLOAD_DIR, exist_ok=True)
     print("DOWNLOAD_DIR =", DOWNLOAD_DIR)
     print("AI_API_KEY present =", bool(API_KEY))
@@ -1014,7 +5030,20 @@ def main():
         print("错误：缺少 AI_API_KEY（请在环境变量或 .env 中设置）")
         raise SystemExit(1)
 
+    if JOB_FILE:
+        run_jobs(JOB_FILE, only_failed=args.only_failed)
+        return
+
+    only = None
+    if args.only_failed:
+        only = EntryIndex(_state_path(HOMEWORK_URL)).failed_keys()
+        if not only:
+            print("状态文件里没有失败的条目，无需重跑")
+            return
+        print(f"只重跑上次失败的 {len(only)} 个条目")
+
     driver = setup_driver()
+    lifecycle = None
 
     try:
         driver.get(HOMEWORK_URL)
@@ -1024,10 +5053,47 @@ def main():
         viewport = wait_for_grid(driver)
         print("AG Grid 已就绪")
 
-        processed = process_all_visible_then_scroll(driver, viewport)
+        stats: dict = {}
+        run_start = time.time()
+        strategy = _strategy_from_env()
+        lifecycle = BrowserLifecycle.from_env(driver, download_dir=DOWNLOAD_DIR)
+        with profile_run():
+            processed = process_all_visible_then_scroll(
+                driver,
+                viewport,
+                stats=stats,
+                scorer=strategy.score if strategy else None,
+                lifecycle=lifecycle,
+                only=only,
+                strategy=strategy,
+            )
+        if lifecycle is not None and lifecycle.recycles:
+            print(f"浏览器共回收 {len(lifecycle.recycles)} 次")
         print("处理完成，总计行数：", len(processed))
+        if strategy is not None:
+            strategy.print_report()
+        path = _write_report(
+            "run",
+            {
+                "url": HOMEWORK_URL,
+                "model": MODEL_NAME,
+                "elapsed_s": round(time.time() - run_start, 1),
+                "startup": STARTUP_TIMINGS,
+                "stats": stats,
+                "cascade": strategy.report() if isinstance(strategy, ModelCascade) else None,
+                "sampling": strategy.report() if isinstance(strategy, ConsistentScorer) else None,
+                "model_usage": _model_usage_report(),
+                "browser": lifecycle.report() if lifecycle is not None else None,
+                "timing": _TIMER.report() if _TIMER is not None else None,
+            },
+        )
+        print("运行报表已写入：", path)
     finally:
+        if _TIMER is not None:
+            _TIMER.save()
         input("按回车关闭浏览器... ")
+        if lifecycle is not None:
+            driver = lifecycle.driver  # 运行中可能已重启过 Chrome
         try:
             driver.quit()
         except Exception:
@@ -0,0 +1,310 @@
+"""录制回放用的假页面 / 假 WebDriver / 假模型客户端（`main.py replay` 与测试共用）。
+
+只依赖标准库；与 main.py 的耦合都通过参数传入：
+- sleep：倍速时钟（回放时传 main._sleep）
+- page_call_js：页面 helper 的调用脚本（main._PAGE_CALL_JS）
+- request_key：模型请求指纹（main._model_request_key）
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import time
+from types import SimpleNamespace
+
+
+class ReplayModelClient:
+    """回放用模型客户端：按请求指纹返回录制的原始回复，并按录制耗时（倍速）等待。"""
+
+    def __init__(self, responses: dict, request_key, sleep=time.sleep):
+        self._responses = responses
+        self._request_key = request_key
+        self._sleep = sleep
+        self.misses = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        rec = self._responses.get(self._request_key(kwargs))
+        if rec is None:
+            self.misses += 1
+            text = ""
+        else:
+            self._sleep(rec.get("latency_s") or 0)
+            text = rec.get("text") or ""
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=text))], usage=None
+        )
+
+
+class FakeElement:
+    """回放页面里的元素引用（弹层、按钮、下载链接、选项等）。"""
+
+    def __init__(self, page, kind, ref=None):
+        self._page = page
+        self.kind = kind
+        self.ref = ref
+
+    def click(self):
+        self._page.click(self)
+
+    def is_displayed(self):
+        return True
+
+    def __repr__(self):
+        return f"<FakeElement {self.kind} {self.ref!r}>"
+
+
+class FakePage:
+    """用录制数据模拟表格 + 详情弹层 + 下载 + 回填下拉的状态机，实现页面 helper 的同名接口。"""
+
+    def __init__(self, manifest, rows, download_dir, sleep=time.sleep):
+        self._sleep = sleep
+        self.snapshots = manifest.get("snapshots") or [[]]
+        self.rows = rows
+        self.download_dir = download_dir
+        self.page_no = 0
+        self.open_key = None
+        self.phase = None
+        self.chosen = None
+        self.decisions: dict[str, str] = {}
+        self.lost: set[str] = set()  # 这些条目的下一次提交不生效（模拟提交静默失败）
+
+    # --- 表格 ---
+    def _row(self, r):
+        """快照里的行；回放中已提交的条目，教师评分列显示提交的选项。"""
+        row = dict(r)
+        if row.get("key") in self.decisions:
+            row["score"] = self.decisions[row["key"]]
+        return row
+
+    def visibleRows(self, _id_col=None, _score_col=None):
+        return [self._row(r) for r in self.snapshots[self.page_no]]
+
+    def findEntry(self, _id_col, key, _score_col=None):
+        for r in self.snapshots[self.page_no]:
+            if r.get("key") == key:
+                return self._row(r)
+        return None
+
+    def is_bottom(self):
+        return self.page_no >= len(self.snapshots) - 1
+
+    def scroll(self, to_top=False):
+        self.page_no = 0 if to_top else min(self.page_no + 1, len(self.snapshots) - 1)
+
+    # --- 详情弹层 ---
+    def openDetail(self, row_index, _col_id):
+        for r in self.snapshots[self.page_no]:
+            if str(r.get("rowIndex")) == str(row_index):
+                rec = self.rows.get(r.get("key")) or {}
+                if rec.get("opened") == "missing":
+                    return "missing"
+                if rec.get("opened"):
+                    self._sleep(rec.get("open_s") or 0)
+                    self.open_key = r.get("key")
+                    self.phase = "view"
+                return "clicked"
+        return "missing"
+
+    def _modal(self):
+        return FakeElement(self, "modal", self.open_key) if self.open_key else None
+
+    def topModal(self):
+        return self._modal()
+
+    def scrollModal(self, _modal=None):
+        return 0 if self.open_key else None
+
+    def modalHtml(self):
+        return None
+
+    def cppLinks(self):
+        if not self.open_key:
+            return {"modal": False, "total": 0, "links": []}
+        rec = self.rows.get(self.open_key) or {}
+        links = [
+            dict(info, el=FakeElement(self, "link", i)) for i, info in enumerate(rec.get("links") or [])
+        ]
+        return {"modal": True, "total": rec.get("link_total") or len(links), "links": links}
+
+    # --- 回填 ---
+    def submitState(self):
+        rec = self.rows.get(self.open_key) or {}
+        options = []
+        if self.phase in ("options", "chosen"):
+            options = [
+                {"el": FakeElement(self, "option", t), "text": t} for t in rec.get("options") or []
+            ]
+        return {
+            "modal": self._modal(),
+            "edit": FakeElement(self, "edit") if self.phase == "view" else None,
+            "input": FakeElement(self, "input") if self.phase in ("editing", "options", "chosen") else None,
+            "listbox": FakeElement(self, "listbox") if options else None,
+            "options": options,
+            "submit": FakeElement(self, "submit") if self.phase == "chosen" else None,
+        }
+
+    def closeModal(self, _modal=None):
+        if not self.open_key:
+            return False
+        if self.phase == "submitted" and self.chosen is not None:
+            if self.open_key in self.lost:
+                self.lost.discard(self.open_key)
+            else:
+                self.decisions[self.open_key] = self.chosen
+        self.open_key = None
+        self.phase = None
+        self.chosen = None
+        return True
+
+    def isShown(self, el):
+        return el is not None and el.kind == "modal" and el.ref == self.open_key
+
+    def click(self, el):
+        if el.kind == "link":
+            self._download(el.ref)
+        elif el.kind == "edit":
+            self.phase = "editing"
+        elif el.kind == "input":
+            self.phase = "options"
+        elif el.kind == "option":
+            self.chosen = el.ref
+            self.phase = "chosen"
+        elif el.kind == "submit":
+            self.phase = "submitted"
+        return True
+
+    def revealClick(self, el):
+        return self.click(el)
+
+    def _download(self, link_no):
+        """按录制的下载尝试写出附件（录制时超时的尝试这里同样不产生文件）。"""
+        rec = self.rows.get(self.open_key) or {}
+        for attempt in rec.get("downloads") or []:
+            if attempt.get("link") != link_no or attempt.get("via") == "http":
+                continue
+            if not attempt.get("file"):
+                return
+            self._sleep(max(0.0, (attempt.get("seconds") or 0) - 2.0))
+            src = os.path.join(rec["_dir"], attempt["file"])
+            shutil.copyfile(src, os.path.join(self.download_dir, attempt["file"]))
+            return
+
+    def fetch(self, url, dest_dir, _name_hint=None):
+        """直链下载：按录制的 via=http 尝试写出附件；录制里没有或当时失败则抛错（走点击下载）。"""
+        rec = self.rows.get(self.open_key) or {}
+        links = rec.get("links") or []
+        for attempt in rec.get("downloads") or []:
+            n = attempt.get("link")
+            if attempt.get("via") != "http" or n is None or n >= len(links) or links[n].get("href") != url:
+                continue
+            if not attempt.get("file"):
+                raise OSError("录制时该直链下载失败")
+            self._sleep(attempt.get("seconds") or 0)
+            target = os.path.join(dest_dir, attempt["file"])
+            shutil.copyfile(os.path.join(rec["_dir"], attempt["file"]), target)
+            return target
+        raise OSError("录制中没有该直链的下载结果")
+
+
+class FakeDriver:
+    """回放用 WebDriver：只实现脚本实际用到的接口；所有命令都经过 execute，便于 WD_PROFILE 计数。
+
+    每条命令按 rtt 秒（经 sleep 做倍速换算）模拟一次往返；page_call_js 是 main._PAGE_CALL_JS，
+    用它识别页面 helper 调用并转给 FakePage 的同名方法。
+    """
+
+    def __init__(self, page: FakePage, url, rtt=0.005, page_call_js=None, sleep=time.sleep):
+        self.page = page
+        self.current_url = url
+        self.rtt = rtt
+        self._page_call_js = page_call_js
+        self._sleep = sleep
+
+    def execute(self, driver_command, params=None):
+        self._sleep(self.rtt)
+        params = params or {}
+        if driver_command == "executeScript":
+            return {"value": self._script(params.get("script") or "", params.get("args") or [])}
+        if driver_command in ("findElement", "findElements"):
+            el = FakeElement(self.page, "viewport")
+            return {"value": [el] if driver_command == "findElements" else el}
+        return {"value": None}
+
+    def _script(self, script, args):
+        if script == self._page_call_js:
+            fn = getattr(self.page, args[1], None)
+            if fn is None:
+                return {"value": None}
+            return {"value": fn(*args[2])}
+        if "scrollTop = arguments[1]" in script:
+            # 浏览器回收后恢复位置：回放里 scrollTop 就是快照序号
+            self.page.page_no = min(int(args[1]), len(self.page.snapshots) - 1)
+            return True
+        if script == "return arguments[0].scrollTop;":
+            return self.page.page_no
+        if "scrollTop + arguments[0].clientHeight >=" in script:
+            return self.page.is_bottom()
+        if "scrollTop +=" in script:
+            self.page.scroll()
+        elif "scrollTop = 0" in script:
+            self.page.scroll(to_top=True)
+        return None
+
+    def execute_script(self, script, *args):
+        return self.execute("executeScript", {"script": script, "args": list(args)})["value"]
+
+    def find_element(self, by=None, value=None):
+        return self.execute("findElement", {"using": by, "value": value})["value"]
+
+    def find_elements(self, by=None, value=None):
+        return self.execute("findElements", {"using": by, "value": value})["value"]
+
+    def execute_cdp_cmd(self, cmd, params):
+        return {}
+
+    def get(self, url):
+        self.current_url = url
+
+    def refresh(self):
+        self.page.scroll(to_top=True)
+        self.page.open_key = None
+
+    def implicitly_wait(self, _seconds):
+        pass
+
+    def get_cookies(self):
+        return []
+
+    def quit(self):
+        pass
+
+
+def load_recording(form_dir):
+    with open(os.path.join(form_dir, "manifest.json"), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    rows = {}
+    rows_dir = os.path.join(form_dir, "rows")
+    for name in sorted(os.listdir(rows_dir)) if os.path.isdir(rows_dir) else []:
+        path = os.path.join(rows_dir, name, "row.json")
+        if not os.path.exists(path):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            rec = json.load(f)
+        rec["_dir"] = os.path.join(rows_dir, name)
+        rows[rec["key"]] = rec
+    return manifest, rows
+
+
+def load_responses(root):
+    responses = {}
+    path = os.path.join(root, "responses.jsonl")
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    rec = json.loads(line)
+                    responses[rec["key"]] = rec
+    return responses
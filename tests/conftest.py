@@ -0,0 +1,79 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+sys.path.insert(0, ROOT)
+
+import main  # noqa: E402
+import replay_fakes  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def isolated(tmp_path, monkeypatch):
+    """每个测试使用独立的状态/源码/报表/缓存目录，关闭自适应等待，不读写仓库里的文件。"""
+    for name in ("STATE_DIR", "SOURCES_DIR", "REPORT_DIR", "DOWNLOAD_DIR", "CACHE_DIR"):
+        monkeypatch.setattr(main, name, str(tmp_path / name.lower()))
+    monkeypatch.setattr(main, "_DRIVER_CACHE_FILE", str(tmp_path / "cache_dir" / "chromedriver.json"))
+    monkeypatch.setattr(main, "_TIMER", None)
+    monkeypatch.setattr(main, "_RECORDER", None)
+    monkeypatch.setattr(main, "API_KEY", "test")
+
+
+@pytest.fixture
+def recording(tmp_path):
+    """录制数据（tests/fixtures/recording）的副本：回放会在表单目录下写临时文件。"""
+    root = tmp_path / "recording"
+    shutil.copytree(os.path.join(FIXTURES, "recording"), root)
+    return root
+
+
+class FakeForm:
+    """按录制数据搭好的假表单：假页面 + 假浏览器 + 回放模型客户端，按 _SPEED 倍速运行。"""
+
+    def __init__(self, recording, download_dir):
+        self.manifest, rows = replay_fakes.load_recording(str(recording / "F1"))
+        responses = replay_fakes.load_responses(str(recording))
+        self.client = replay_fakes.ReplayModelClient(responses, main._model_request_key, sleep=main._sleep)
+        self.download_dir = str(download_dir)
+        os.makedirs(self.download_dir, exist_ok=True)
+        self.page = replay_fakes.FakePage(self.manifest, rows, self.download_dir, sleep=main._sleep)
+        self.driver = replay_fakes.FakeDriver(
+            self.page, self.manifest["url"], rtt=0, page_call_js=main._PAGE_CALL_JS, sleep=main._sleep
+        )
+
+    def index(self):
+        return main.EntryIndex(main._state_path(self.manifest["url"]))
+
+    def process(self, index=None, **kwargs):
+        """跑一遍 process_all_visible_then_scroll，返回 (stats, index)。"""
+        index = index or self.index()
+        stats: dict = {}
+        kwargs.setdefault("reconcile", False)
+        main.process_all_visible_then_scroll(
+            self.driver,
+            main.wait_for_grid(self.driver),
+            score_col_id=self.manifest["score_col_id"],
+            detail_col_id=self.manifest["detail_col_id"],
+            entry_id_col=self.manifest["entry_id_col"],
+            criteria=self.manifest["criteria"],
+            model=self.manifest["model"],
+            download_dir=self.download_dir,
+            stats=stats,
+            index=index,
+            **kwargs,
+        )
+        return stats, index
+
+
+@pytest.fixture
+def fake_form(recording, tmp_path, monkeypatch):
+    form = FakeForm(recording, tmp_path / "downloads")
+    monkeypatch.setattr(main, "_SPEED", 200)
+    monkeypatch.setattr(main, "RETRY_BACKOFF_S", 1)
+    monkeypatch.setattr(main, "_MODEL_CLIENT_FACTORY", lambda: form.client)
+    monkeypatch.setattr(main, "_ATTACHMENT_FETCHER", form.page.fetch)
+    return form
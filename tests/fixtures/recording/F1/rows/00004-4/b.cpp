@@ -0,0 +1,3 @@
+#include "a.h"
+int add(int a,int b){return a+b;}
+int main(){return add(1,2);}
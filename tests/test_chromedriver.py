@@ -0,0 +1,128 @@
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+
+class FakeChrome:
+    """代替 webdriver.Chrome：按 chromedriver 路径决定启动成功与否、报告的版本。"""
+
+    launches: list = []
+
+    def __init__(self, service=None, options=None):
+        FakeChrome.launches.append(service.path)
+        FakeChrome.se_offline.append(os.environ.get("SE_OFFLINE"))
+        spec = FakeChrome.drivers[service.path]
+        if spec is None:
+            raise RuntimeError("session not created: This version of ChromeDriver only supports Chrome version 120")
+        self.capabilities = {"browserVersion": "131.0.6778.85", "chrome": {"chromedriverVersion": f"{spec} (abc)"}}
+        self.quit_called = False
+
+    def execute_cdp_cmd(self, _cmd, _params):
+        return {}
+
+    def implicitly_wait(self, _seconds):
+        pass
+
+    def quit(self):
+        self.quit_called = True
+
+
+@pytest.fixture
+def chrome(tmp_path, monkeypatch):
+    """假的 Chrome / Service / webdriver_manager；返回 (旧驱动路径, 新驱动路径)。"""
+    import selenium.webdriver
+    import selenium.webdriver.chrome.service
+    import webdriver_manager.chrome
+
+    old = tmp_path / "chromedriver-120"
+    new = tmp_path / "chromedriver-131"
+    old.write_text("")
+    new.write_text("")
+    FakeChrome.launches = []
+    FakeChrome.se_offline = []
+    FakeChrome.drivers = {str(old): None, str(new): "131.0.6778.85", None: "131.0.6778.85"}
+
+    monkeypatch.setattr(selenium.webdriver, "Chrome", FakeChrome)
+    monkeypatch.setattr(
+        selenium.webdriver.chrome.service, "Service", lambda path=None: SimpleNamespace(path=path)
+    )
+    monkeypatch.setattr(
+        webdriver_manager.chrome, "ChromeDriverManager", lambda: SimpleNamespace(install=lambda: str(new))
+    )
+    monkeypatch.setattr(main, "CHROMEDRIVER_PATH", None)
+    monkeypatch.setattr(main, "OFFLINE", False)
+    monkeypatch.setattr(main, "BROWSER_PROFILE", "default")
+    monkeypatch.setattr(main, "_PROFILER", None)
+    return str(old), str(new)
+
+
+def _cache():
+    with open(main._DRIVER_CACHE_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_resolve_prefers_pinned_then_cache(chrome, monkeypatch):
+    old, new = chrome
+    main._save_driver_cache(old, "120.0", "120.0")
+    assert main._resolve_chromedriver() == (old, "cache")
+    assert main._resolve_chromedriver(refresh=True) == (new, "webdriver_manager")
+
+    monkeypatch.setattr(main, "CHROMEDRIVER_PATH", "/opt/chromedriver")
+    assert main._resolve_chromedriver() == ("/opt/chromedriver", "pinned")
+
+
+def test_missing_cached_binary_is_ignored(chrome, monkeypatch, tmp_path):
+    main._save_driver_cache(str(tmp_path / "gone"), "120.0", "120.0")
+    monkeypatch.setattr(main, "OFFLINE", True)
+    monkeypatch.delenv("SE_OFFLINE", raising=False)
+
+    assert main._resolve_chromedriver() == (None, "selenium-manager-offline")
+    assert "SE_OFFLINE" not in os.environ
+
+
+def test_offline_selenium_manager_env_is_scoped_to_launch(chrome, monkeypatch):
+    monkeypatch.setattr(main, "OFFLINE", True)
+    monkeypatch.delenv("SE_OFFLINE", raising=False)
+
+    main.setup_driver(download_dir="/tmp/downloads")
+
+    assert FakeChrome.launches == [None]
+    assert FakeChrome.se_offline == ["true"]
+    assert "SE_OFFLINE" not in os.environ
+
+
+def test_stale_cached_driver_is_re_resolved_and_cache_updated(chrome):
+    old, new = chrome
+    main._save_driver_cache(old, "120.0", "120.0")
+
+    driver = main.setup_driver(download_dir="/tmp/downloads")
+
+    assert FakeChrome.launches == [old, new]
+    assert driver.capabilities["browserVersion"].startswith("131")
+    assert _cache()["path"] == new
+    assert _cache()["driver_version"] == "131.0.6778.85"
+
+
+def test_major_version_mismatch_from_cache_triggers_refresh(chrome):
+    old, new = chrome
+    FakeChrome.drivers[old] = "120.0.6099.109"  # 能启动，但主版本与 Chrome 131 不一致
+    main._save_driver_cache(old, "120.0", "120.0")
+
+    main.setup_driver(download_dir="/tmp/downloads")
+
+    assert FakeChrome.launches == [old, new]
+    assert _cache()["path"] == new
+
+
+def test_offline_mode_does_not_re_resolve(chrome, monkeypatch):
+    old, _new = chrome
+    main._save_driver_cache(old, "120.0", "120.0")
+    monkeypatch.setattr(main, "OFFLINE", True)
+
+    with pytest.raises(RuntimeError):
+        main.setup_driver(download_dir="/tmp/downloads")
+    assert FakeChrome.launches == [old]
@@ -0,0 +1,63 @@
+import json
+
+import main
+
+
+def test_verify_writebacks_splits_ok_mismatch_missing(tmp_path):
+    index = main.EntryIndex(str(tmp_path / "F1.json"))
+    index.update("1", status="written", score="8", option="8分")
+    index.update("2", status="written", score="9")
+    index.update("3", status="written", score="7")
+
+    ok, bad, missing = main.verify_writebacks(index, {"1", "2", "3"}, {"1": "8", "2": "7"})
+
+    assert ok == ["1"]
+    assert bad == [{"key": "2", "expected": "9", "actual": "7"}]
+    assert missing == ["3"]
+    assert index.get("1")["verified"] is True
+    assert index.get("2")["verified"] is False
+    # update_many 直接落盘
+    saved = json.loads((tmp_path / "F1.json").read_text(encoding="utf-8"))["entries"]
+    assert saved["2"]["verified"] is False
+
+
+def test_same_score_compares_numbers():
+    assert main._same_score("8.0", "8")
+    assert main._same_score("8分", "8")
+    assert not main._same_score("", "8")
+    assert not main._same_score("7", "8")
+
+
+def test_updates_are_written_on_flush(tmp_path):
+    path = tmp_path / "F1.json"
+    index = main.EntryIndex(str(path))
+    index.update("1", status="written", score="8")
+    index.set_meta(options=["7", "8"])
+
+    assert not path.exists()
+    index.flush()
+    again = main.EntryIndex(str(path))
+    assert again.is_done("1")
+    assert again.meta == {"options": ["7", "8"]}
+
+
+def test_row_index_keys_are_neither_saved_nor_done(tmp_path):
+    path = tmp_path / "F1.json"
+    index = main.EntryIndex(str(path))
+    index.update("row-index:3", status="written", score="8")
+    index.update("12", status="written", score="9")
+    index.flush()
+
+    assert not index.is_done("row-index:3")
+    saved = json.loads(path.read_text(encoding="utf-8"))["entries"]
+    assert set(saved) == {"12"}
+
+
+def test_record_failure_counts_attempts(tmp_path):
+    index = main.EntryIndex(str(tmp_path / "F1.json"))
+    index.record_failure("5", "download")
+    index.record_failure("5", "writeback")
+
+    assert index.get("5")["attempts"] == 2
+    assert index.get("5")["reason"] == "writeback"
+    assert index.failed_keys() == {"5"}
@@ -0,0 +1,53 @@
+import json
+import os
+from types import SimpleNamespace
+
+import main
+
+
+def _written(index, key, score, rubric_sha, source_dir):
+    index.update(key, status="written", score=score, option=score, rubric_sha=rubric_sha, source_dir=source_dir, files=["a.cpp"])
+
+
+def _sources(tmp_path, name, code):
+    path = tmp_path / "src" / name
+    path.mkdir(parents=True)
+    (path / "a.cpp").write_text(code, encoding="utf-8")
+    return str(path)
+
+
+def test_strategy_change_marks_entries_for_regrade(tmp_path):
+    job = main.FormJob(name="F1", url="https://example.com/forms/F1/entries")
+    index = main.EntryIndex(main._state_path(job.url))
+    _written(index, "1", "8", main._rubric_fingerprint(), _sources(tmp_path, "1", "int main(){}"))
+    index.flush()
+    pool = main.ScoringPool(score_fn=lambda *_args: ("8", "ok"))
+    sampler = SimpleNamespace(config=lambda: {"samples": 3, "mode": "n"}, score=lambda *_args: ("8", "ok"))
+
+    _index, _pending, stats = main.regrade_form(job, pool)
+    assert (stats["current"], stats["rescored"]) == (1, 0)
+
+    # 同样的评分标准和模型，换成多次采样：之前的分数需要重评
+    _index, _pending, stats = main.regrade_form(job, pool, strategy=sampler)
+    assert (stats["current"], stats["rescored"], stats["unchanged"]) == (0, 1, 1)
+
+
+def test_writebacks_avoided_counts_only_rescored_unchanged(tmp_path, monkeypatch):
+    model = main.ScriptedModel({"models": {"*": {"responses": ["8\n不错"]}}})
+    monkeypatch.setattr(main, "_MODEL_CLIENT_FACTORY", lambda: main.ScriptedModelClient(model))
+    monkeypatch.setattr(main, "JOB_FILE", None)
+    rubric = tmp_path / "rubric.txt"
+    rubric.write_text("新的评分标准", encoding="utf-8")
+    index = main.EntryIndex(main._state_path(main.HOMEWORK_URL))
+    _written(index, "1", "8", main._rubric_fingerprint("新的评分标准"), _sources(tmp_path, "1", "int a;"))
+    _written(index, "2", "8", "old", _sources(tmp_path, "2", "int b;"))
+    _written(index, "3", "5", "old", _sources(tmp_path, "3", "int c;"))
+    index.flush()
+
+    main.run_regrade(SimpleNamespace(rubric=str(rubric), model=None, workers=2, dry_run=True))
+
+    (name,) = os.listdir(main.REPORT_DIR)
+    with open(os.path.join(main.REPORT_DIR, name), encoding="utf-8") as f:
+        (form,) = json.load(f)["forms"]
+    assert (form["current"], form["rescored"], form["unchanged"], form["pending"]) == (1, 2, 1, 1)
+    assert form["writebacks_avoided"] == 1
@@ -0,0 +1,117 @@
+import pytest
+
+import main
+import replay_fakes
+
+
+def test_replay_matches_recording(recording):
+    before = (main._SPEED, main._MODEL_CLIENT_FACTORY, main._ATTACHMENT_FETCHER, main.SOURCES_DIR)
+    responses = replay_fakes.load_responses(str(recording))
+
+    stats, diffs = main.replay_form(str(recording / "F1"), responses, speed=200, rtt=0)
+
+    assert diffs == []
+    assert stats["decision_diffs"] == 0
+    assert stats["model_misses"] == 0
+    assert (stats["written"], stats["skipped"], stats["failed"]) == (2, 1, 1)
+    assert (main._SPEED, main._MODEL_CLIENT_FACTORY, main._ATTACHMENT_FETCHER, main.SOURCES_DIR) == before
+
+
+def test_replay_restores_globals_when_processing_raises(recording, monkeypatch):
+    before = (main._SPEED, main._MODEL_CLIENT_FACTORY, main._ATTACHMENT_FETCHER, main.SOURCES_DIR)
+
+    def boom(*_args, **_kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(main, "process_all_visible_then_scroll", boom)
+    with pytest.raises(RuntimeError):
+        main.replay_form(str(recording / "F1"), {}, speed=200, rtt=0)
+
+    assert (main._SPEED, main._MODEL_CLIENT_FACTORY, main._ATTACHMENT_FETCHER, main.SOURCES_DIR) == before
+    assert not (recording / "F1" / ".replay-downloads").exists()
+
+
+def test_multi_file_entry_keeps_every_attachment(fake_form):
+    stats, index = fake_form.process(retry_rounds=0)
+
+    assert index.get("4")["files"] == ["b.cpp", "a.h"]
+    assert fake_form.page.decisions == {"1": "8", "4": "9"}
+    assert stats["written"] == 2
+
+
+def test_writeback_timeout_is_retried_instead_of_aborting(fake_form, monkeypatch):
+    real_fill = main.fill_score_and_comment
+    calls = []
+
+    def flaky_fill(driver, score, comment=None):
+        calls.append(score)
+        if len(calls) == 1:
+            raise main.TimeoutException("submit button")
+        return real_fill(driver, score, comment)
+
+    monkeypatch.setattr(main, "fill_score_and_comment", flaky_fill)
+    stats, index = fake_form.process(retry_rounds=1)
+
+    assert stats["recovered"] == 1
+    assert index.get("1")["status"] == "written"
+    assert index.get("1")["option"] == "8"
+    assert fake_form.page.decisions == {"1": "8", "4": "9"}
+
+
+def test_writeback_failure_is_not_marked_written(fake_form, monkeypatch):
+    def broken_fill(driver, score, comment=None):
+        raise RuntimeError("未找到可用的评分选项")
+
+    monkeypatch.setattr(main, "fill_score_and_comment", broken_fill)
+    stats, index = fake_form.process(retry_rounds=0)
+
+    assert index.get("1")["status"] == "failed"
+    assert index.get("1")["reason"] == "writeback"
+    assert index.written_keys() == set()
+    assert {f["key"] for f in stats["still_failing"]} == {"1", "3", "4"}
+
+
+def test_reconcile_rewrites_only_lost_submits(fake_form):
+    fake_form.page.lost = {"4"}
+
+    stats, index = fake_form.process(retry_rounds=0, reconcile=True)
+
+    verification = stats["verification"]
+    assert verification["checked"] == 2
+    assert verification["first_pass_rate"] == 0.5
+    assert verification["requeued"] == 1
+    assert verification["rate"] == 1.0
+    assert verification["rewritten"] == 1
+    assert stats["written"] == 2  # 重新回填单独计数，不算进 written
+    assert fake_form.page.decisions == {"1": "8", "4": "9"}
+    assert index.get("4")["verified"] is True
+
+
+def test_failed_reconcile_rewrite_is_still_failing(fake_form, monkeypatch):
+    fake_form.page.lost = {"4"}
+    real_fill = main.fill_score_and_comment
+    calls = []
+
+    def fill_then_break(driver, score, comment=None):
+        calls.append(score)
+        if len(calls) > 2:
+            raise RuntimeError("未找到可用的评分选项")
+        return real_fill(driver, score, comment)
+
+    monkeypatch.setattr(main, "fill_score_and_comment", fill_then_break)
+    stats, _index = fake_form.process(retry_rounds=0, reconcile=True)
+
+    assert stats["verification"]["rewritten"] == 0
+    assert {f["key"]: f["reason"] for f in stats["still_failing"]} == {"3": "download", "4": "writeback"}
+    assert stats["failed"] == 2
+
+
+def test_done_entry_is_reprocessed_when_grid_score_is_empty(fake_form):
+    index = fake_form.index()
+    index.update("1", status="written", score="8", option="8")
+
+    stats, index = fake_form.process(index=index, retry_rounds=0)
+
+    # 状态文件说已回填，但表格里条目 1 的教师评分是空的：重新评分回填，而不是跳过
+    assert fake_form.page.decisions.get("1") == "8"
+    assert stats["skipped"] == 1  # 只有表格里已有分数的条目 2
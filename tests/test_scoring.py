@@ -0,0 +1,156 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def scripted(monkeypatch):
+    """把模型客户端换成脚本模型；返回一个函数：传入脚本（models 字段），返回 ScriptedModel。"""
+
+    def use(models):
+        model = main.ScriptedModel({"models": models})
+        monkeypatch.setattr(main, "_MODEL_CLIENT_FACTORY", lambda: main.ScriptedModelClient(model))
+        return model
+
+    return use
+
+
+def test_aggregate_takes_majority_when_more_than_half_agree():
+    score, comment, detail = main._aggregate_samples([("8", "a"), ("8", "b"), ("5", "c")])
+
+    assert (score, comment) == ("8", "a")
+    assert detail["scores"] == ["8", "8", "5"]
+    assert detail["agreement"] == 0.667
+    assert detail["confidence"] == round(1 / (1 + 2.0), 3)
+
+
+def test_aggregate_falls_back_to_median_without_majority():
+    score, comment, detail = main._aggregate_samples([("6", "低"), ("8", "中"), ("9", "高")])
+
+    assert (score, comment) == ("8", "中")
+    assert detail["final"] == "8"
+
+
+def test_aggregate_all_equal_is_fully_confident():
+    _score, _comment, detail = main._aggregate_samples([("7", "x")] * 3)
+
+    assert detail["variance"] == 0
+    assert detail["confidence"] == 1
+
+
+def test_consistent_scorer_uses_n_in_one_request(scripted):
+    model = scripted({"*": {"rules": [{"contains": "int", "texts": ["7\n还行", "5\n漏了边界", "7\n还行"]}]}})
+    scorer = main.ConsistentScorer(3, "n")
+
+    assert scorer.score("int main(){}") == ("7", "还行")
+    assert [r["n"] for r in model.requests] == [3]
+    assert scorer.report()["rows"] == 1
+
+
+def test_consistent_scorer_fallback_keeps_mode_and_cache_key(scripted):
+    judgments = '{"judgments": [{"score": 8, "comment": "a"}, {"score": 8, "comment": "b"}, {"score": 6, "comment": "c"}]}'
+    model = scripted({"*": {"supports_n": False, "responses": [judgments]}})
+    scorer = main.ConsistentScorer(3, "n")
+    key_before = main.ScoringPool._key("int a;", None, None, scorer)
+
+    assert scorer.score("int a;") == ("8", "a")
+    assert scorer.score("int b;") == ("8", "a")
+
+    # 第一次 n 请求失败后不再尝试 n；mode/config/缓存键都保持不变
+    assert scorer.mode == "n"
+    assert scorer.config() == {"samples": 3, "mode": "n"}
+    assert main.ScoringPool._key("int a;", None, None, scorer) == key_before
+    assert scorer.report()["fallbacks"] == 1
+    assert [r["n"] for r in model.requests] == [1, 1]
+
+
+def test_consistent_scorer_keeps_n_after_unrelated_errors(monkeypatch):
+    def create(**_kwargs):
+        raise TimeoutError("Request timed out.")
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    monkeypatch.setattr(main, "_MODEL_CLIENT_FACTORY", lambda: client)
+    scorer = main.ConsistentScorer(3, "n")
+
+    score, comment = scorer.score("int a;")
+
+    # 超时不是“不支持 n”：这一行失败（进重试队列），下次仍用 n
+    assert score is None and "Request timed out" in comment
+    assert scorer.report()["fallbacks"] == 0
+    assert scorer.report()["n_unsupported"] is False
+
+
+@pytest.mark.parametrize(
+    "cheap_reply, reason",
+    [
+        ("8\n不错\n置信度: 0.9\n分数范围: 8-8", None),
+        ("8\n不错\n置信度: 0.3\n分数范围: 8-8", "low_confidence"),
+        ("8\n不错\n置信度: 0.9\n分数范围: 6-9", "wide_range"),
+        ("6\n及格\n置信度: 0.9\n分数范围: 6-6", "borderline"),
+        ("9\n很好\n置信度: 0.9\n分数范围: 5-6", "inconsistent"),
+        ("说不好", "unparsed"),
+    ],
+)
+def test_cascade_escalates_only_uncertain_scores(scripted, cheap_reply, reason):
+    scripted({"cheap": {"responses": [cheap_reply]}, "strong": {"responses": ["7\n强模型复评"]}})
+    cascade = main.ModelCascade("cheap", min_confidence=0.7, max_spread=1, borderline=[6], margin=0.5)
+
+    score, comment = cascade.score("int main(){}", model="strong")
+
+    report = cascade.report()
+    if reason is None:
+        assert (score, comment) == ("8", "不错")
+        assert report["escalated"] == 0
+    else:
+        assert (score, comment) == ("7", "强模型复评")
+        assert report["reasons"] == {reason: 1}
+
+
+def test_cascade_keeps_cheap_score_when_strong_model_fails(scripted):
+    scripted({"cheap": {"responses": ["8\n不错\n置信度: 0.2"]}, "strong": {"responses": ["无法评分"]}})
+    cascade = main.ModelCascade("cheap")
+
+    assert cascade.score("int main(){}", model="strong")[0] == "8"
+    assert cascade.report()["fallbacks"] == 1
+
+
+def test_cascade_from_config_requires_cheap_model():
+    assert main.ModelCascade.from_config(None) is None
+    assert main.ModelCascade.from_config({"min_confidence": 0.5}) is None
+    cascade = main.ModelCascade.from_config({"model": "cheap", "borderline": "6, 8"})
+    assert cascade.borderline == [6.0, 8.0]
+
+
+def test_scoring_pool_scores_identical_source_once():
+    calls = []
+    release = threading.Event()
+
+    def slow_score(code, criteria=None, model=None):
+        calls.append(code)
+        release.wait(5)
+        return "8", "ok"
+
+    pool = main.ScoringPool(max_workers=2, score_fn=slow_score)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(pool.score("int a;"))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert results == [("8", "ok")] * 4
+    assert calls == ["int a;"]
+    assert (pool.calls, pool.cache_hits) == (1, 3)
+
+
+def test_scoring_pool_does_not_cache_failures():
+    replies = iter([(None, "超时"), ("8", "ok")])
+    pool = main.ScoringPool(score_fn=lambda *_args: next(replies))
+
+    assert pool.score("int a;") == (None, "超时")
+    assert pool.score("int a;") == ("8", "ok")
+    assert pool.calls == 2
@@ -0,0 +1,50 @@
+import main
+
+
+def test_single_file_is_returned_unchanged():
+    assert main.build_project_source([("main.cpp", "int main(){}")]) == "int main(){}"
+    assert main.build_project_source([]) == ""
+
+
+def test_headers_come_first_with_file_banners():
+    source = main.build_project_source([("main.cpp", "int main(){}"), ("list.h", "struct L;")])
+
+    assert source == "// ===== 文件：list.h =====\nstruct L;\n\n// ===== 文件：main.cpp =====\nint main(){}"
+
+
+def test_budget_keeps_short_files_and_splits_the_rest():
+    files = [("a.h", "h" * 10), ("b.cpp", "b" * 500), ("c.cpp", "c" * 300)]
+
+    source = main.build_project_source(files, budget=210)
+
+    assert "h" * 10 + "\n" in source
+    # 剩余 200 字符平分给两个长文件，各自标注截断了多少
+    assert "b" * 100 + "\n// ...（b.cpp 过长，已截断 400 字符）" in source
+    assert "c" * 100 + "\n// ...（c.cpp 过长，已截断 200 字符）" in source
+    assert "b" * 101 not in source
+
+
+def test_budget_not_exceeded_leaves_files_whole():
+    files = [("a.cpp", "a" * 50), ("b.cpp", "b" * 50)]
+
+    source = main.build_project_source(files, budget=1000)
+
+    assert "已截断" not in source
+    assert "a" * 50 in source and "b" * 50 in source
+
+
+def test_read_source_files_detects_gbk(tmp_path):
+    path = tmp_path / "main.cpp"
+    path.write_bytes('// 冒泡排序\nint main(){return 0;}\n'.encode("gbk"))
+    (tmp_path / "empty.h").write_bytes(b"")
+
+    files = main.read_source_files([str(path), str(tmp_path / "empty.h")], quiet=True)
+
+    assert files == [("main.cpp", "// 冒泡排序\nint main(){return 0;}\n")]
+
+
+def test_same_named_attachments_get_distinct_paths(tmp_path):
+    taken: set = set()
+    names = [main._claim_path(str(tmp_path), n, taken) for n in ("a.cpp", "A.cpp", "a.cpp", "b.h")]
+
+    assert [p.rsplit("/", 1)[-1] for p in names] == ["a.cpp", "A-2.cpp", "a-3.cpp", "b.h"]
@@ -0,0 +1,34 @@
+import os
+import subprocess
+import sys
+
+import main
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_import_stays_within_startup_budget():
+    ok, result = main.check_startup()
+
+    assert ok, result
+    assert result["import_s"] <= main.STARTUP_BUDGET_S
+
+
+def test_heavy_dependencies_are_imported_lazily():
+    probe = (
+        "import sys\n"
+        "import main\n"
+        f"print(','.join(m for m in {list(main._LAZY_MODULES) + ['replay_fakes']!r} if m in sys.modules))\n"
+    )
+    out = subprocess.run([sys.executable, "-c", probe], cwd=ROOT, capture_output=True, text=True, timeout=120)
+
+    assert out.returncode == 0, out.stderr
+    assert out.stdout.strip() == ""
+
+
+def test_startup_check_command_exits_zero():
+    out = subprocess.run(
+        [sys.executable, "main.py", "startup-check"], cwd=ROOT, capture_output=True, text=True, timeout=300
+    )
+
+    assert out.returncode == 0, out.stdout + out.stderr
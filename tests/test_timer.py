@@ -0,0 +1,50 @@
+import main
+
+
+def _learned(timer, stage, seconds, n=None):
+    for _ in range(n or timer.min_samples):
+        timer.observe(stage, seconds)
+
+
+def test_defaults_until_enough_samples():
+    timer = main.AdaptiveTimer(min_samples=8)
+    _learned(timer, "modal_open", 0.4, n=7)
+
+    assert timer.timeout("modal_open", 8) == 8
+    assert timer.poll("modal_open", 0.5) == 0.5
+    assert timer.attempts("modal_open", 4) == 4
+
+
+def test_learned_timeout_is_tighter_but_bounded():
+    timer = main.AdaptiveTimer(min_samples=8, factor=1.5, margin=1.0, floor=1.0, min_poll=0.05)
+    _learned(timer, "modal_open", 0.4)
+
+    assert timer.timeout("modal_open", 8) == 0.4 * 1.5 + 1.0
+    assert timer.poll("modal_open", 0.5) == 0.1
+    assert timer.attempts("modal_open", 4) == 2
+    # 学到的超时不会超过调用方给的默认值，也不会低于 floor
+    _learned(timer, "download", 30)
+    assert timer.timeout("download", 20) == 20
+    _learned(timer, "links", 0.0)
+    assert timer.timeout("links", 20) == 1.0
+
+
+def test_two_timeouts_in_a_row_reset_the_stage():
+    timer = main.AdaptiveTimer(min_samples=8)
+    _learned(timer, "grid", 0.5)
+
+    timer.timed_out("grid")
+    assert timer.timeout("grid", 20) < 20
+    timer.timed_out("grid")
+    assert timer.timeout("grid", 20) == 20
+    assert timer.report()["grid"]["timeouts"] == 2
+
+
+def test_samples_persist_across_runs(tmp_path):
+    path = str(tmp_path / "timing.json")
+    timer = main.AdaptiveTimer(path, min_samples=8)
+    _learned(timer, "grid", 0.5)
+    timer.save()
+
+    again = main.AdaptiveTimer(path, min_samples=8)
+    assert again.timeout("grid", 20) == timer.timeout("grid", 20)